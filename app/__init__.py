@@ -1,24 +1,60 @@
+import os
+
 from flask import Flask, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_wtf import CSRFProtect
+from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
+from app.routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 bcrypt = Bcrypt()
 csrf = CSRFProtect()
+migrate = Migrate()
 
 def create_app():
+    from app.warmup import StartupTimer, install_bytecode_cache, warm
+    timer = StartupTimer()
     app = Flask(__name__)
     app.config.from_object(Config)
+    hops = app.config.get('PROXY_FIX_HOPS')
+    if hops:
+        # trust this many proxies' X-Forwarded-* headers (client address, scheme, host)
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+    install_bytecode_cache(app)
 
+    from app import engine, routing
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine.engine_options(app.config))
+    routing.configure_binds(app.config, engine.engine_options)
     db.init_app(app)
+    engine.init_app(app, db)
+    migrate.init_app(app, db, directory=os.path.join(os.path.dirname(app.root_path), 'migrations'),
+                     render_as_batch=True)
+    if app.config.get('REPLICA_SYNC_INTERVAL'):
+        app.before_request(lambda: routing.start_replicator(app, db))
+    if app.config.get('STOCK_HOLD_SWEEP_INTERVAL'):
+        from app import reservations
+        app.before_request(lambda: reservations.start_sweeper(app))
+    if app.config.get('CHECKOUT_KEY_COMPACT_INTERVAL'):
+        from app import idempotency
+        app.before_request(lambda: idempotency.start_compactor(app))
+    if app.config.get('OUTBOX_POLL_INTERVAL'):
+        from app import outbox
+        app.before_request(lambda: outbox.start_worker(app))
     login_manager.init_app(app)
     bcrypt.init_app(app)
     csrf.init_app(app)
 
+    from app import sessions, ratelimit, streaming
+    sessions.init_app(app)
+    ratelimit.init_app(app)
+    streaming.init_app(app)
+    timer.mark('extensions')
+
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
@@ -29,6 +65,7 @@ def create_app():
     from app.blueprints.cart import cart_bp
     from app.blueprints.admin import admin_bp
     from app.blueprints.account import account_bp
+    from app.blueprints.api import api_bp
 
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -36,9 +73,30 @@ def create_app():
     app.register_blueprint(cart_bp, url_prefix='/cart')
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(account_bp, url_prefix='/account')
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+    timer.mark('blueprints')
+
+    from app import catalogue  # noqa: F401  registers the version-bump listeners
+    from app import reviews  # noqa: F401  keeps review aggregates current
+    from app import order_events  # noqa: F401  registers the order.placed outbox handlers
+    from app.commands import register_commands
+    register_commands(app)
+    timer.mark('modules')
+
+    if app.config.get('DB_REPORT_ON_STARTUP'):
+        with app.app_context():
+            try:
+                app.logger.info('Database engine (%s profile): %s',
+                                app.config.get('DB_PROFILE'), engine.report(db.engine))
+            except Exception as e:
+                app.logger.warning('Could not report database engine settings: %s', e)
+            # don't hand this connection to forked workers
+            db.engine.dispose()
+        timer.mark('db report')
+
     @app.context_processor
     def inject_nav():
-        from app.models import NavigationItem
+        from app import snapshot
         def resolve_url(url_val):
             # If it's a route name like 'shop.products'
             try:
@@ -54,7 +112,12 @@ def create_app():
             return url_val
 
             
-        nav_items = NavigationItem.query.filter_by(is_active=True).order_by(NavigationItem.display_order.asc()).all()
+        nav_items = snapshot.get().nav_items
         return dict(nav_items=nav_items, resolve_url=resolve_url)
 
+    if app.config.get('WARMUP_ON_STARTUP'):
+        warm(app, timer)
+    app.extensions['startup_timings'] = timer.report()
+    app.logger.info('Startup timings (ms): %s', app.extensions['startup_timings'])
+
     return app
@@ -0,0 +1,127 @@
+"""
+JSON API conventions (``/api/v1``, see app/blueprints/api.py).
+
+- A response is ``{"data": ...}``. Lists add ``"next"``, a cursor to pass
+  back as ``?after=`` (null on the last page); batch GETs (``?ids=1,2,3``,
+  at most ``API_BATCH_MAX``) add ``"missing"``, the ids not found.
+- ``?fields=a,b`` returns only those fields of each record. A ``Resource``
+  declares its fields; those that cost a query of their own (a product's
+  ``description`` or live ``in_stock``, an order's ``items``) are
+  *deferred*: left out by default and, when asked for, loaded for the
+  whole page in one query.
+- Cursors are opaque: the URL-safe base64 of the last record's sort key,
+  so every page is a keyset range however deep the client reads.
+- Every GET carries an ETag of its body, and a matching
+  ``If-None-Match`` gets an empty 304.
+- Errors are ``{"error": message}`` with a 4xx status.
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, jsonify, request
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class Resource:
+    """
+    ``fields`` maps a name to ``fn(record)``; ``deferred`` maps a name to
+    ``fn(records)`` returning one value per record, in order.
+    """
+
+    def __init__(self, fields, deferred=None):
+        self.fields = fields
+        self.deferred = deferred or {}
+
+    def requested(self):
+        """The names in ``?fields=``, or every field that isn't deferred."""
+        raw = request.args.get('fields')
+        if not raw:
+            return tuple(self.fields)
+        names = tuple(dict.fromkeys(n.strip() for n in raw.split(',') if n.strip()))
+        unknown = [n for n in names if n not in self.fields and n not in self.deferred]
+        if unknown or not names:
+            raise ApiError(f'Unknown fields: {", ".join(unknown)}' if unknown else 'No fields requested')
+        return names
+
+    def dump(self, records, names=None):
+        names = names or self.requested()
+        if not records:
+            return []
+        columns = [self.deferred[n](records) if n in self.deferred
+                   else [self.fields[n](r) for r in records] for n in names]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def dump_one(self, record, names=None):
+        return self.dump([record], names)[0]
+
+
+# ── Arguments ────────────────────────────────────────────────────────────────
+def ids_arg(name='ids', cast=int):
+    """The comma-separated ``?ids=`` list, or None when absent."""
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    try:
+        values = list(dict.fromkeys(cast(v.strip()) for v in raw.split(',') if v.strip()))
+    except ValueError:
+        raise ApiError(f'Invalid {name}') from None
+    limit = current_app.config.get('API_BATCH_MAX', 100)
+    if len(values) > limit:
+        raise ApiError(f'At most {limit} {name} per request')
+    return values
+
+
+def limit_arg():
+    config = current_app.config
+    limit = request.args.get('limit', config.get('API_PAGE_SIZE', 24), type=int)
+    return min(max(limit, 1), config.get('API_MAX_PAGE_SIZE', 100))
+
+
+def encode_cursor(key):
+    key = [v.isoformat() if isinstance(v, datetime) else v for v in key]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(types):
+    """The key in ``?after=`` as ``types`` (e.g. ``(datetime, int)``), or None."""
+    cursor = request.args.get('after')
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(key, list) or len(key) != len(types):
+            raise ValueError(cursor)
+        return tuple(datetime.fromisoformat(v) if t is datetime else t(v) for t, v in zip(types, key))
+    except (ValueError, TypeError):
+        raise ApiError('Invalid cursor') from None
+
+
+# ── Responses ────────────────────────────────────────────────────────────────
+def respond(payload, status=200):
+    """``payload`` as JSON; GETs get an ETag and a 304 when it matches."""
+    response = jsonify(payload)
+    response.status_code = status
+    if request.method == 'GET' and status == 200:
+        response.add_etag()
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.make_conditional(request)
+    return response
+
+
+def page(data, next_key=None):
+    return {'data': data, 'next': encode_cursor(next_key) if next_key is not None else None}
+
+
+def batch(data, wanted, found):
+    return {'data': data, 'missing': [key for key in wanted if key not in found]}
+
+
+def error(e):
+    return jsonify({'error': e.message}), e.status
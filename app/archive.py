@@ -0,0 +1,312 @@
+"""
+Order archive.
+
+Finished orders (delivered or cancelled) older than
+``ORDER_ARCHIVE_AFTER_DAYS`` are moved with their items from ``orders`` /
+``order_items`` into ``orders_archive`` / ``order_items_archive``: same
+database, same columns, same ids. The live tables keep only recent and open
+orders, which is all that checkout, the outbox handlers and the dashboards'
+counts have to touch.
+
+``flask orders archive`` moves ``ORDER_ARCHIVE_BATCH`` orders per short
+transaction (copy, delete, add to the running totals), so each batch holds
+its locks briefly and a run can be stopped at any point.
+
+Views read orders through this module rather than the models:
+
+- ``find`` / ``get_or_404`` fall back to the archive
+- ``paginate`` lists both tables as one, newest first: a UNION ALL picks
+  the page's ids, then each table loads its own rows. With ``stream=True``
+  the rows are read with ``yield_per`` and loaded chunk by chunk, with
+  their lines, while a streamed page renders (app/streaming.py)
+- ``totals`` adds ``order_archive_totals`` to the live counts, so revenue
+  never sums the archive
+- ``page_for_user`` pages the same list by keyset (``(created_at, id)``
+  of the last order shown) for the JSON API; ``find_many`` and
+  ``lines_for`` load a batch of orders and their lines
+- ``account_summary`` / ``recent_for_user`` give the account dashboard its
+  counts and latest orders in one statement each, using the ``item_count``
+  stored on every order at checkout instead of loading its lines
+
+Archived orders are read-only. Recommendations and search popularity only
+read the live order items, i.e. recent purchases.
+"""
+from datetime import datetime, timedelta
+from itertools import islice
+
+from flask import abort, current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import literal, select, tuple_, union_all
+from sqlalchemy.orm import selectinload
+
+from app.dbutil import upsert_insert
+from app.models import (db, Order, OrderItem, ArchivedOrder, ArchivedOrderItem,
+                        OrderArchiveTotals, Product, Wishlist)
+
+FINAL_STATUSES = ('delivered', 'cancelled')
+
+
+# ── Reading ──────────────────────────────────────────────────────────────────
+def find(order_number, user_id=None):
+    """The live or archived order ``order_number`` (of ``user_id``, if given), or None."""
+    for model in (Order, ArchivedOrder):
+        query = model.query.filter_by(order_number=order_number)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        order = query.first()
+        if order is not None:
+            return order
+    return None
+
+
+def find_or_404(order_number, user_id=None):
+    return find(order_number, user_id) or abort(404)
+
+
+def get_or_404(order_id):
+    return db.session.get(Order, order_id) or db.session.get(ArchivedOrder, order_id) or abort(404)
+
+
+def _filtered(model, user_id, status):
+    query = select(model.id, model.created_at, literal(model.archived).label('archived'))
+    if user_id is not None:
+        query = query.where(model.user_id == user_id)
+    if status:
+        query = query.where(model.status == status)
+    return query
+
+
+def _load(rows, with_items=False):
+    """The orders for ``(id, archived)`` rows, in the same order."""
+    loaded = {}
+    for model in (Order, ArchivedOrder):
+        ids = [oid for oid, archived in rows if bool(archived) == model.archived]
+        if ids:
+            query = model.query.filter(model.id.in_(ids))
+            if with_items:
+                query = query.options(selectinload(model.items))
+            loaded.update(((model.archived, o.id), o) for o in query)
+    return [loaded[(bool(archived), oid)] for oid, archived in rows]
+
+
+class OrderPagination(Pagination):
+    """Live and archived orders as one list, newest first."""
+
+    def _selects(self):
+        user_id, status = self._query_args['user_id'], self._query_args['status']
+        selects = [_filtered(Order, user_id, status)]
+        if not status or status in FINAL_STATUSES:
+            selects.append(_filtered(ArchivedOrder, user_id, status))
+        return selects
+
+    def _listing(self):
+        listing = union_all(*self._selects()).subquery()
+        return (select(listing.c.id, listing.c.archived)
+                .order_by(listing.c.created_at.desc(), listing.c.id.desc())
+                .limit(self.per_page).offset(self._query_offset))
+
+    def _query_items(self):
+        return _load(db.session.execute(self._listing()).all())
+
+    def _query_count(self):
+        return sum(db.session.execute(select(db.func.count()).select_from(s.subquery())).scalar()
+                   for s in self._selects())
+
+
+class LazyRows:
+    """Iterates ``source()`` once, when first needed; a truth test reads only the first row."""
+
+    def __init__(self, source):
+        self._source = source
+        self._rows = None
+        self._head = []
+
+    def _iter(self):
+        if self._rows is None:
+            self._rows = iter(self._source())
+        return self._rows
+
+    def __bool__(self):
+        if not self._head:
+            self._head = list(islice(self._iter(), 1))
+        return bool(self._head)
+
+    def __iter__(self):
+        rows = self._iter()
+        head, self._head = self._head, []
+        yield from head
+        yield from rows
+
+
+class OrderStream(OrderPagination):
+    """
+    An OrderPagination that runs no query until rendered: ``items`` reads
+    the page with ``yield_per`` and loads ``chunk`` orders (and their lines)
+    at a time, and ``total`` is counted on first use.
+    """
+
+    def __init__(self, page=None, per_page=20, chunk=100, **kwargs):
+        self._query_args = kwargs
+        self.page, self.per_page = self._prepare_page_args(page=page, per_page=per_page,
+                                                           max_per_page=None, error_out=False)
+        self.max_per_page = None
+        self.chunk = chunk
+        self.items = LazyRows(self._stream)
+        self._total = None
+
+    def _stream(self):
+        result = db.session.execute(self._listing().execution_options(yield_per=self.chunk))
+        for rows in result.partitions():
+            yield from _load(rows, with_items=True)
+
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = self._query_count()
+        return self._total
+
+
+def paginate(user_id=None, status=None, page=None, per_page=20, count=True, stream=False):
+    if stream:
+        return OrderStream(page=page, per_page=per_page, user_id=user_id, status=status,
+                           chunk=current_app.config.get('STREAM_CHUNK_SIZE', 100))
+    return OrderPagination(page=page, per_page=per_page, error_out=False, count=count,
+                           user_id=user_id, status=status)
+
+
+def page_for_user(user_id, before=None, limit=20):
+    """
+    Up to ``limit`` orders of ``user_id``, newest first, created before the
+    ``(created_at, id)`` key ``before``. Returns ``(orders, more)``.
+    """
+    selects = []
+    for model in (Order, ArchivedOrder):
+        query = _filtered(model, user_id, None)
+        if before is not None:
+            query = query.where(tuple_(model.created_at, model.id) < tuple_(*before))
+        selects.append(query)
+    listing = union_all(*selects).subquery()
+    rows = db.session.execute(select(listing.c.id, listing.c.archived)
+                              .order_by(listing.c.created_at.desc(), listing.c.id.desc())
+                              .limit(limit + 1)).all()
+    return _load(rows[:limit]), len(rows) > limit
+
+
+def find_many(order_numbers, user_id):
+    """``user_id``'s live or archived orders among ``order_numbers``."""
+    orders = []
+    for model in (Order, ArchivedOrder):
+        orders.extend(model.query.filter(model.order_number.in_(order_numbers),
+                                         model.user_id == user_id))
+    return orders
+
+
+def lines_for(orders):
+    """``{(archived, order_id): [line rows]}`` for ``orders``, one query per table."""
+    lines = {}
+    for model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        ids = [o.id for o in orders if o.archived == model.archived]
+        if not ids:
+            continue
+        rows = db.session.query(item_model.order_id, item_model.product_id, Product.name, Product.slug,
+                                item_model.quantity, item_model.unit_price, item_model.subtotal)\
+            .join(Product, Product.id == item_model.product_id)\
+            .filter(item_model.order_id.in_(ids)).order_by(item_model.id)
+        for row in rows:
+            lines.setdefault((model.archived, row.order_id), []).append(row)
+    return lines
+
+
+def account_summary(user_id):
+    """``(orders, pending orders, wishlist entries)`` of ``user_id``."""
+    def count(model, *where):
+        return select(db.func.count()).select_from(model)\
+            .where(model.user_id == user_id, *where).scalar_subquery()
+    return tuple(db.session.execute(select(
+        count(Order) + count(ArchivedOrder),
+        count(Order, Order.status == 'pending'),
+        count(Wishlist))).one())
+
+
+SUMMARY_COLUMNS = ('id', 'order_number', 'created_at', 'item_count', 'total', 'status')
+
+
+def recent_for_user(user_id, limit=5):
+    """The newest ``limit`` orders of ``user_id``, live or archived, as rows of SUMMARY_COLUMNS."""
+    branches = []
+    for model in (Order, ArchivedOrder):
+        newest = select(*[model.__table__.c[name] for name in SUMMARY_COLUMNS])\
+            .where(model.user_id == user_id)\
+            .order_by(model.created_at.desc(), model.id.desc()).limit(limit).subquery()
+        branches.append(select(newest))
+    listing = union_all(*branches).subquery()
+    return db.session.execute(select(listing)
+                              .order_by(listing.c.created_at.desc(), listing.c.id.desc())
+                              .limit(limit)).all()
+
+
+def totals():
+    """``(orders, paid revenue)`` across live and archived orders."""
+    live_count = db.session.query(db.func.count(Order.id)).scalar()
+    live_revenue = db.session.query(db.func.sum(Order.total))\
+        .filter(Order.payment_status == 'paid').scalar() or 0
+    archived = db.session.get(OrderArchiveTotals, 1)
+    if archived is None:
+        return live_count, live_revenue
+    return live_count + archived.order_count, live_revenue + archived.paid_revenue
+
+
+# ── Archiving ────────────────────────────────────────────────────────────────
+def _copy(source, target, where):
+    names = [c.name for c in target.c]
+    return target.insert().from_select(names, select(*[source.c[n] for n in names]).where(where))
+
+
+def archive_batch(cutoff, limit):
+    """Move up to ``limit`` finished orders created before ``cutoff``; returns how many."""
+    orders, items = Order.__table__, OrderItem.__table__
+    due = (orders.c.status.in_(FINAL_STATUSES)) & (orders.c.created_at < cutoff)
+    ids = [oid for oid, in db.session.execute(
+        select(orders.c.id).where(due).order_by(orders.c.id).limit(limit).with_for_update())]
+    if not ids:
+        db.session.commit()
+        return 0
+    batch = due & orders.c.id.in_(ids)
+    archived = ArchivedOrder.__table__
+    try:
+        db.session.execute(_copy(orders, archived, batch))
+        # totals of exactly what was copied
+        moved, revenue = db.session.execute(select(
+            db.func.count(), db.func.coalesce(db.func.sum(
+                db.case((archived.c.payment_status == 'paid', archived.c.total), else_=0)), 0)
+        ).where(archived.c.id.in_(ids))).one()
+        moving = select(orders.c.id).where(batch)
+        db.session.execute(_copy(items, ArchivedOrderItem.__table__, items.c.order_id.in_(moving)))
+        db.session.execute(items.delete().where(items.c.order_id.in_(moving)))
+        db.session.execute(orders.delete().where(batch))
+        stmt = upsert_insert(OrderArchiveTotals).values(id=1, order_count=moved, paid_revenue=revenue)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={'order_count': OrderArchiveTotals.order_count + moved,
+                  'paid_revenue': OrderArchiveTotals.paid_revenue + revenue}))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return moved
+
+
+def archive(older_than_days=None, batch_size=None, max_batches=None):
+    """Archive finished orders in batches until none are due; returns how many moved."""
+    config = current_app.config
+    days = older_than_days if older_than_days is not None else config.get('ORDER_ARCHIVE_AFTER_DAYS', 180)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    batch_size = batch_size or config.get('ORDER_ARCHIVE_BATCH', 500)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        moved += count
+        batches += 1
+        if count < batch_size:
+            break
+    return moved
@@ -1,16 +1,16 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
-from app.models import Order, Wishlist, Product, db, User
+from app.models import Order, Wishlist, db
+from app import archive, streaming
+from app.ratelimit import rate_limited
 
 account_bp = Blueprint('account', __name__)
 
 @account_bp.route('/')
 @login_required
 def dashboard():
-    recent_orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).limit(5).all()
-    order_count = Order.query.filter_by(user_id=current_user.id).count()
-    wishlist_count = Wishlist.query.filter_by(user_id=current_user.id).count()
-    pending_count = Order.query.filter_by(user_id=current_user.id, status='pending').count()
+    order_count, pending_count, wishlist_count = archive.account_summary(current_user.id)
+    recent_orders = archive.recent_for_user(current_user.id, limit=5)
     return render_template('account/dashboard.html',
                            recent_orders=recent_orders, order_count=order_count,
                            wishlist_count=wishlist_count, pending_count=pending_count)
@@ -18,13 +18,14 @@ def dashboard():
 @account_bp.route('/orders')
 @login_required
 def orders():
-    all_orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template('account/orders.html', orders=all_orders)
+    page = request.args.get('page', 1, type=int)
+    orders = archive.paginate(user_id=current_user.id, page=page, stream=streaming.enabled())
+    return streaming.render('account/orders.html', orders=orders)
 
 @account_bp.route('/orders/<order_number>')
 @login_required
 def order_detail(order_number):
-    order = Order.query.filter_by(order_number=order_number, user_id=current_user.id).first_or_404()
+    order = archive.find_or_404(order_number, current_user.id)
     return render_template('account/order_detail.html', order=order)
 
 @account_bp.route('/wishlist')
@@ -51,6 +52,7 @@ def profile():
 
 @account_bp.route('/change-password', methods=['POST'])
 @login_required
+@rate_limited(template='account/profile.html')
 def change_password():
     current_pw = request.form.get('current_password', '')
     new_pw = request.form.get('new_password', '')
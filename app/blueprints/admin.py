@@ -3,7 +3,8 @@ from flask_login import login_required, current_user
 from functools import wraps
 from app.models import (Product, Category, Order, User, Discount, Review,
                         Newsletter, SiteSettings, NavigationItem, ProductImage, db)
-from slugify import slugify
+from app import slugs, archive, streaming, discounts as discount_engine
+from app.routing import use_replica
 import os, uuid
 from config import Config
 
@@ -22,14 +23,15 @@ def admin_required(f):
 @admin_bp.route('/')
 @login_required
 @admin_required
+@use_replica
 def dashboard():
+    order_count, revenue = archive.totals()
     stats = {
         'products': Product.query.filter_by(is_active=True).count(),
         'categories': Category.query.filter_by(is_active=True).count(),
-        'orders': Order.query.count(),
+        'orders': order_count,
         'users': User.query.filter_by(is_admin=False).count(),
-        'revenue': db.session.query(db.func.sum(Order.total)).filter(
-            Order.payment_status == 'paid').scalar() or 0,
+        'revenue': revenue,
         'pending_orders': Order.query.filter_by(status='pending').count(),
     }
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(8).all()
@@ -41,11 +43,16 @@ def dashboard():
 @admin_bp.route('/products')
 @login_required
 @admin_required
+@use_replica
 def products():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('q', '')
     query = Product.query
     if search:
+        # an exact SKU goes straight to that product
+        pid = slugs.product_id_for_sku(search)
+        if pid is not None:
+            return redirect(url_for('admin.edit_product', pid=pid))
         query = query.filter(Product.name.ilike(f'%{search}%'))
     products = query.order_by(Product.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
     return render_template('admin/products.html', products=products, search=search)
@@ -62,13 +69,7 @@ def new_product():
             flash('Product name is required.', 'danger')
             return render_template('admin/product_form.html', categories=categories, product=None)
 
-        slug = slugify(name)
-        # Ensure unique slug
-        base_slug = slug
-        counter = 1
-        while Product.query.filter_by(slug=slug).first():
-            slug = f'{base_slug}-{counter}'
-            counter += 1
+        slug = slugs.allocate_product_slug(name)
 
         orig_price = f.get('original_price', '').strip()
         p = Product(
@@ -120,7 +121,10 @@ def edit_product(pid):
     categories = Category.query.filter_by(is_active=True).all()
     if request.method == 'POST':
         f = request.form
-        p.name = f.get('name', '').strip()
+        name = f.get('name', '').strip()
+        if name and name != p.name:
+            slugs.rename_product(p, name)
+        p.name = name
         p.subtitle = f.get('subtitle', '')
         p.description = f.get('description', '')
         p.price = float(f.get('price', 0))
@@ -181,6 +185,7 @@ def delete_product(pid):
 @admin_bp.route('/categories')
 @login_required
 @admin_required
+@use_replica
 def categories():
     cats = Category.query.order_by(Category.display_order).all()
     return render_template('admin/categories.html', categories=cats)
@@ -192,12 +197,7 @@ def new_category():
     if request.method == 'POST':
         f = request.form
         name = f.get('name', '').strip()
-        slug = slugify(name)
-        base_slug = slug
-        counter = 1
-        while Category.query.filter_by(slug=slug).first():
-            slug = f'{base_slug}-{counter}'
-            counter += 1
+        slug = slugs.allocate_category_slug(name)
         cat = Category(
             name=name, slug=slug,
             description=f.get('description', ''),
@@ -241,20 +241,24 @@ def delete_category(cid):
 @admin_bp.route('/orders')
 @login_required
 @admin_required
+@use_replica
 def orders():
     page = request.args.get('page', 1, type=int)
     status = request.args.get('status', '')
-    query = Order.query
-    if status:
-        query = query.filter_by(status=status)
-    orders = query.order_by(Order.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
-    return render_template('admin/orders.html', orders=orders, status=status)
+    per_page = request.args.get('per_page', type=int)
+    stream = streaming.enabled()
+    # a streamed listing holds one chunk of orders at a time, so it can be longer
+    limit = Config.ADMIN_ORDERS_MAX_PER_PAGE if stream else 100
+    orders = archive.paginate(status=status or None, page=page, stream=stream,
+                              per_page=min(max(per_page or Config.ADMIN_ORDERS_PER_PAGE, 1), limit))
+    return streaming.render('admin/orders.html', orders=orders, status=status, per_page=per_page)
 
 @admin_bp.route('/orders/<int:oid>')
 @login_required
 @admin_required
+@use_replica
 def order_detail(oid):
-    order = Order.query.get_or_404(oid)
+    order = archive.get_or_404(oid)
     return render_template('admin/order_detail.html', order=order)
 
 @admin_bp.route('/orders/<int:oid>/status', methods=['POST'])
@@ -272,9 +276,23 @@ def update_order_status(oid):
 @admin_bp.route('/discounts')
 @login_required
 @admin_required
+@use_replica
 def discounts():
     all_discounts = Discount.query.order_by(Discount.created_at.desc()).all()
-    return render_template('admin/discounts.html', discounts=all_discounts)
+    used = discount_engine.usage([d.id for d in all_discounts])
+    return render_template('admin/discounts.html', discounts=all_discounts, used=used)
+
+def discount_rule_fields(f):
+    """Scope, tiers and per-user limit from the discount form."""
+    per_user_raw = f.get('per_user_limit', '').strip()
+    scope = f.get('scope', 'order')
+    return {
+        'per_user_limit': int(per_user_raw) if per_user_raw else None,
+        'scope': scope,
+        'scope_ids': ','.join(str(i) for i in sorted(discount_engine.parse_ids(f.get('scope_ids'))))
+                     if scope != 'order' else None,
+        'tiers': discount_engine.parse_tiers(f.get('tiers')),
+    }
 
 @admin_bp.route('/discounts/new', methods=['GET', 'POST'])
 @login_required
@@ -294,7 +312,8 @@ def new_discount():
             min_order_amount=float(f.get('min_order_amount', 0)),
             max_uses=int(max_uses_raw) if max_uses_raw else None,
             is_active=f.get('is_active') == 'on',
-            expires_at=expires
+            expires_at=expires,
+            **discount_rule_fields(f)
         )
         db.session.add(d)
         db.session.commit()
@@ -320,10 +339,13 @@ def edit_discount(did):
         d.max_uses = int(max_uses_raw) if max_uses_raw else None
         d.is_active = f.get('is_active') == 'on'
         d.expires_at = datetime.strptime(expires_raw, '%Y-%m-%d') if expires_raw else None
+        for field, value in discount_rule_fields(f).items():
+            setattr(d, field, value)
         db.session.commit()
         flash('Discount updated!', 'success')
         return redirect(url_for('admin.discounts'))
-    return render_template('admin/discount_form.html', discount=d)
+    return render_template('admin/discount_form.html', discount=d,
+                           tiers=discount_engine.format_tiers(d.tiers))
 
 @admin_bp.route('/discounts/<int:did>/delete', methods=['POST'])
 @login_required
@@ -338,6 +360,7 @@ def delete_discount(did):
 @admin_bp.route('/users')
 @login_required
 @admin_required
+@use_replica
 def users():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('q', '')
@@ -377,6 +400,7 @@ def toggle_user_active(uid):
 @admin_bp.route('/reviews')
 @login_required
 @admin_required
+@use_replica
 def reviews():
     page = request.args.get('page', 1, type=int)
     all_reviews = Review.query.order_by(Review.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
@@ -404,6 +428,7 @@ def delete_review(rid):
 @admin_bp.route('/newsletter')
 @login_required
 @admin_required
+@use_replica
 def newsletter_list():
     page = request.args.get('page', 1, type=int)
     subs = Newsletter.query.filter_by(is_active=True).order_by(Newsletter.created_at.desc()).paginate(page=page, per_page=50, error_out=False)
@@ -427,6 +452,7 @@ def settings():
 @admin_bp.route('/navigation')
 @login_required
 @admin_required
+@use_replica
 def navigation():
     items = NavigationItem.query.order_by(NavigationItem.display_order.asc()).all()
     return render_template('admin/navigation.html', items=items)
@@ -0,0 +1,324 @@
+from bisect import bisect_right
+from datetime import datetime
+from functools import wraps
+from operator import attrgetter
+
+from flask import Blueprint, current_app, request, session, url_for
+from flask_login import current_user
+from flask_wtf.csrf import CSRFError, generate_csrf
+from sqlalchemy import delete
+from sqlalchemy.orm import joinedload
+
+from app import api, archive, reservations, reviews, snapshot
+from app.api import ApiError, Resource
+from app.blueprints.cart import (get_cart_items, get_cart_total, get_guest_cart, save_guest_cart,
+                                 recalculate_discount)
+from app.dbutil import upsert_insert
+from app.models import db, CartItem, Product, ProductImage, SiteSettings
+from app.ratelimit import rate_limited
+from app.routing import use_replica
+
+api_bp = Blueprint('api', __name__)
+api_bp.register_error_handler(ApiError, api.error)
+
+
+@api_bp.errorhandler(CSRFError)
+def csrf_error(e):
+    return api.error(ApiError(e.description, 400))
+
+
+def signed_in(view):
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError('Sign in required', 401)
+        return view(*args, **kwargs)
+    return decorated
+
+
+def fields(*names):
+    return {name: attrgetter(name) for name in names}
+
+
+def image_url(filename):
+    return url_for('static', filename='images/' + filename) if filename else None
+
+
+# ── Resources ────────────────────────────────────────────────────────────────
+def product_descriptions(records):
+    found = dict(db.session.query(Product.id, Product.description)
+                 .filter(Product.id.in_([r.id for r in records])))
+    return [found.get(r.id) for r in records]
+
+
+def product_galleries(records):
+    gallery = {}
+    for pid, filename in (db.session.query(ProductImage.product_id, ProductImage.filename)
+                          .filter(ProductImage.product_id.in_([r.id for r in records]))
+                          .order_by(ProductImage.display_order, ProductImage.id)):
+        gallery.setdefault(pid, []).append(image_url(filename))
+    return [([image_url(r.image_filename)] if r.image_filename else []) + gallery.get(r.id, [])
+            for r in records]
+
+
+def product_stock(records):
+    # live: the snapshot's stock ignores holds and isn't refreshed on sales
+    levels = reservations.available_many([r.id for r in records])
+    return [r.id in levels and (levels[r.id] is None or levels[r.id] > 0) for r in records]
+
+
+products = Resource({
+    **fields('id', 'name', 'slug', 'subtitle', 'price', 'original_price', 'sku',
+             'badge', 'material', 'gemstone', 'review_count'),
+    'on_sale': attrgetter('is_on_sale'),
+    'category': lambda p: p.category.slug if p.category else None,
+    'image': lambda p: image_url(p.image_filename),
+    'featured': attrgetter('is_featured'),
+    'rating': attrgetter('average_rating'),
+    'created_at': lambda p: p.created_at.isoformat() if p.created_at else None,
+    'url': lambda p: url_for('shop.product_detail', slug=p.slug),
+}, deferred={'description': product_descriptions, 'images': product_galleries,
+             'in_stock': product_stock})
+
+categories = Resource({
+    **fields('id', 'name', 'slug', 'description', 'icon_svg', 'product_count'),
+    'url': lambda c: url_for('shop.products', category=c.slug),
+})
+
+review_records = Resource({
+    **fields('id', 'rating', 'title', 'body', 'helpful_count'),
+    'verified': attrgetter('is_verified'),
+    'author': attrgetter('author_name'),
+    'created_at': lambda r: r.created_at.isoformat(),
+})
+
+cart_items = Resource({
+    **fields('product_id', 'quantity', 'subtotal'),
+    'name': lambda i: i.product.name,
+    'slug': lambda i: i.product.slug,
+    'unit_price': lambda i: i.product.price,
+    'image': lambda i: image_url(i.product.image_filename),
+})
+
+
+def order_lines(orders):
+    lines = archive.lines_for(orders)
+    return [[{'product_id': line.product_id, 'name': line.name, 'slug': line.slug,
+              'quantity': line.quantity, 'unit_price': line.unit_price, 'subtotal': line.subtotal}
+             for line in lines.get((o.archived, o.id), [])] for o in orders]
+
+
+orders = Resource({
+    **fields('order_number', 'status', 'payment_status', 'item_count', 'subtotal',
+             'shipping_cost', 'discount_amount', 'total', 'archived'),
+    'discount_code': lambda o: o.discount_code or None,
+    'created_at': lambda o: o.created_at.isoformat(),
+    'shipping': lambda o: {'name': o.shipping_name, 'email': o.shipping_email, 'phone': o.shipping_phone,
+                           'address1': o.shipping_address1, 'address2': o.shipping_address2,
+                           'city': o.shipping_city, 'postcode': o.shipping_postcode,
+                           'country': o.shipping_country},
+    'url': lambda o: url_for('account.order_detail', order_number=o.order_number),
+}, deferred={'items': order_lines})
+
+
+# ── Session ──────────────────────────────────────────────────────────────────
+@api_bp.route('/session')
+def session_info():
+    user = None
+    if current_user.is_authenticated:
+        user = {'id': current_user.id, 'first_name': current_user.first_name,
+                'last_name': current_user.last_name, 'email': current_user.email}
+    # writes (the cart) send this back as X-CSRFToken
+    return api.respond({'data': {'user': user, 'csrf_token': generate_csrf()}})
+
+
+# ── Catalogue ────────────────────────────────────────────────────────────────
+@api_bp.route('/categories')
+def category_list():
+    snap = snapshot.get()
+    ids = api.ids_arg()
+    if ids is not None:
+        by_id = {c.id: c for c in snap.categories}
+        found = [by_id[i] for i in ids if i in by_id]
+        return api.respond(api.batch(categories.dump(found), ids, by_id))
+    return api.respond({'data': categories.dump(snap.categories)})
+
+
+@api_bp.route('/products')
+@use_replica
+def product_list():
+    names = products.requested()
+    snap = snapshot.get()
+    ids = api.ids_arg()
+    if ids is not None:
+        found = [snap.by_id[i] for i in ids if i in snap.by_id]
+        return api.respond(api.batch(products.dump(found, names), ids, snap.by_id))
+
+    records = snap.products
+    slug = request.args.get('category')
+    if slug:
+        category = snap.categories_by_slug.get(slug)
+        if category is None:
+            raise ApiError(f'Unknown category {slug!r}')
+        records = snap.by_category.get(category.id, ())
+    # snapshot lists are in id order
+    after = api.decode_cursor((int,))
+    start = bisect_right(records, after[0], key=attrgetter('id')) if after else 0
+    limit = api.limit_arg()
+    chunk = records[start:start + limit]
+    more = start + limit < len(records)
+    return api.respond(api.page(products.dump(chunk, names), (chunk[-1].id,) if more else None))
+
+
+@api_bp.route('/products/<int:product_id>')
+@use_replica
+def product_get(product_id):
+    record = snapshot.get().by_id.get(product_id)
+    if record is None:
+        raise ApiError('Product not found', 404)
+    return api.respond({'data': products.dump_one(record)})
+
+
+@api_bp.route('/products/<int:product_id>/reviews')
+@use_replica
+def product_reviews(product_id):
+    if product_id not in snapshot.get().by_id:
+        raise ApiError('Product not found', 404)
+    names = review_records.requested()
+    sort = request.args.get('sort', reviews.DEFAULT_SORT)
+    if sort not in reviews.SORTS:
+        raise ApiError(f'Unknown sort {sort!r}')
+    rating = request.args.get('rating', type=int)
+    if rating is not None and rating not in range(1, 6):
+        raise ApiError('rating must be 1-5')
+    limit = min(api.limit_arg(), reviews.MAX_PAGE_SIZE)
+    try:
+        records, next_cursor = reviews.page(product_id, sort=sort, rating=rating,
+                                            cursor=request.args.get('after') or None, limit=limit)
+    except ValueError:
+        raise ApiError('Invalid cursor') from None
+    return api.respond({'data': review_records.dump(records, names), 'next': next_cursor})
+
+
+# ── Cart ─────────────────────────────────────────────────────────────────────
+def load_cart():
+    if current_user.is_authenticated:
+        return (CartItem.query.options(joinedload(CartItem.product))
+                .filter_by(user_id=current_user.id).order_by(CartItem.id).all())
+    return get_cart_items()
+
+
+def cart_payload(items, names):
+    subtotal = get_cart_total(items)
+    threshold = float(SiteSettings.get('free_shipping_threshold', 200))
+    shipping_cost = float(SiteSettings.get('shipping_cost', 9.95))
+    shipping = 0 if subtotal >= threshold else shipping_cost
+    discount_amount = recalculate_discount(items, subtotal)
+    return {'items': cart_items.dump(items, names), 'count': len(items),
+            'subtotal': subtotal, 'shipping': shipping, 'free_shipping_threshold': threshold,
+            'discount_code': session.get('discount_code') or None, 'discount_amount': discount_amount,
+            'total': max(0, subtotal + shipping - discount_amount)}
+
+
+def parse_changes(body):
+    """``{product_id: quantity}`` from ``{"items": [{"product_id": .., "quantity": ..}, ..]}``."""
+    changes = body.get('items') if isinstance(body, dict) else None
+    if not isinstance(changes, list) or not changes:
+        raise ApiError('Expected {"items": [{"product_id": ..., "quantity": ...}, ...]}')
+    limit = current_app.config.get('API_BATCH_MAX', 100)
+    if len(changes) > limit:
+        raise ApiError(f'At most {limit} items per request')
+    wanted = {}
+    for change in changes:
+        try:
+            wanted[int(change['product_id'])] = max(0, int(change['quantity']))
+        except (KeyError, TypeError, ValueError):
+            raise ApiError('Each item needs an integer product_id and quantity') from None
+    return wanted
+
+
+@api_bp.route('/cart')
+def cart_get():
+    names = cart_items.requested()
+    return api.respond({'data': cart_payload(load_cart(), names)})
+
+
+@api_bp.route('/cart/batch', methods=['POST'])
+@rate_limited
+def cart_batch():
+    """
+    Set the quantities of many cart lines at once (0 removes a line). Every
+    change is applied in one transaction, or none is; quantities above what
+    can be bought are lowered and listed in ``adjusted``.
+    """
+    names = cart_items.requested()
+    wanted = parse_changes(request.get_json(silent=True))
+    adding = [pid for pid, qty in wanted.items() if qty > 0]
+    found = {p.id: p for p in Product.query.filter(Product.id.in_(adding), Product.is_active.is_(True))} \
+        if adding else {}
+    missing = [pid for pid in adding if pid not in found]
+    if missing:
+        raise ApiError(f'Unknown products: {", ".join(map(str, missing))}', 404)
+
+    held = reservations.held_many(current_user.id, adding) \
+        if current_user.is_authenticated and adding else {}
+    quantities, adjusted = {}, []
+    for pid, qty in wanted.items():
+        if qty > 0:
+            limit = found[pid].available + held.get(pid, 0)
+            if qty > limit:
+                adjusted.append({'product_id': pid, 'requested': qty, 'quantity': limit})
+            qty = min(qty, limit)
+        quantities[pid] = qty
+
+    removed = [pid for pid, qty in quantities.items() if qty == 0]
+    kept = {pid: qty for pid, qty in quantities.items() if qty > 0}
+    if current_user.is_authenticated:
+        try:
+            if removed:
+                db.session.execute(delete(CartItem).where(CartItem.user_id == current_user.id,
+                                                          CartItem.product_id.in_(removed)))
+            if kept:
+                now = datetime.utcnow()
+                stmt = upsert_insert(CartItem).values([
+                    {'user_id': current_user.id, 'product_id': pid, 'quantity': qty, 'added_at': now}
+                    for pid, qty in kept.items()])
+                db.session.execute(stmt.on_conflict_do_update(
+                    index_elements=['user_id', 'product_id'], set_={'quantity': stmt.excluded.quantity}))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    else:
+        cart = get_guest_cart()
+        for pid in removed:
+            cart.pop(str(pid), None)
+        cart.update((str(pid), qty) for pid, qty in kept.items())
+        save_guest_cart(cart)
+    return api.respond({'data': cart_payload(load_cart(), names), 'adjusted': adjusted})
+
+
+# ── Orders ───────────────────────────────────────────────────────────────────
+@api_bp.route('/orders')
+@signed_in
+def order_list():
+    names = orders.requested()
+    numbers = api.ids_arg(cast=str)
+    if numbers is not None:
+        found = archive.find_many(numbers, current_user.id)
+        found.sort(key=lambda o: numbers.index(o.order_number))
+        return api.respond(api.batch(orders.dump(found, names), numbers,
+                                     {o.order_number for o in found}))
+    page, more = archive.page_for_user(current_user.id, before=api.decode_cursor((datetime, int)),
+                                       limit=api.limit_arg())
+    last = page[-1] if page else None
+    return api.respond(api.page(orders.dump(page, names), (last.created_at, last.id) if more else None))
+
+
+@api_bp.route('/orders/<order_number>')
+@signed_in
+def order_get(order_number):
+    order = archive.find(order_number, current_user.id)
+    if order is None:
+        raise ApiError('Order not found', 404)
+    return api.respond({'data': orders.dump_one(order)})
@@ -1,11 +1,14 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from app import db, bcrypt
+from app import db, passwords, sessions
 from app.models import User
+from app.blueprints.cart import merge_guest_cart
+from app.ratelimit import rate_limited
 
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@rate_limited(template='auth/login.html')
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -14,8 +17,15 @@ def login():
         password = request.form.get('password', '')
         remember = request.form.get('remember') == 'on'
         user = User.query.filter_by(email=email).first()
-        if user and user.check_password(password) and user.is_active:
+        if user is None:
+            passwords.check_missing_user(password)
+        elif user.check_password(password) and user.is_active:
+            if passwords.needs_rehash(user.password_hash):
+                user.set_password(password)
+                db.session.commit()
+            sessions.regenerate()
             login_user(user, remember=remember)
+            merge_guest_cart(user)
             next_page = request.args.get('next')
             if user.is_admin:
                 return redirect(next_page or url_for('admin.dashboard'))
@@ -24,6 +34,7 @@ def login():
     return render_template('auth/login.html')
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
+@rate_limited(template='auth/register.html')
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -46,7 +57,9 @@ def register():
             user.set_password(password)
             db.session.add(user)
             db.session.commit()
+            sessions.regenerate()
             login_user(user)
+            merge_guest_cart(user)
             flash(f'Welcome to ORIAL, {first_name}!', 'success')
             return redirect(url_for('main.index'))
     return render_template('auth/register.html')
@@ -55,5 +68,6 @@ def register():
 @login_required
 def logout():
     logout_user()
+    sessions.regenerate()
     flash('You have been logged out.', 'info')
     return redirect(url_for('main.index'))
@@ -1,54 +1,143 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, abort, current_app
 from flask_login import login_required, current_user
-from app.models import CartItem, Product, Order, OrderItem, Discount, SiteSettings, db
+from app.models import CartItem, Product, Order, OrderItem, SiteSettings, db
 from app import db
+from app import reservations, outbox, idempotency, discounts
+from app.dbutil import upsert_insert
+from app.ratelimit import rate_limited
+from sqlalchemy import case, select
 import uuid
 from datetime import datetime
 from config import Config
 
 cart_bp = Blueprint('cart', __name__)
 
+# Anonymous carts live in the (server-side) session as {product_id: quantity}
+GUEST_CART_KEY = 'guest_cart'
+
+class GuestCartItem:
+    """Stands in for CartItem in an anonymous cart; ``id`` is the product id."""
+    __slots__ = ('id', 'product_id', 'product', 'quantity')
+
+    def __init__(self, product, quantity):
+        self.id = self.product_id = product.id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def subtotal(self):
+        return self.product.price * self.quantity
+
+def get_guest_cart():
+    return dict(session.get(GUEST_CART_KEY, {}))
+
+def save_guest_cart(cart):
+    if cart:
+        session[GUEST_CART_KEY] = cart
+    else:
+        session.pop(GUEST_CART_KEY, None)
+
 def get_cart_items():
-    return CartItem.query.filter_by(user_id=current_user.id).all()
+    if current_user.is_authenticated:
+        return CartItem.query.filter_by(user_id=current_user.id).all()
+    cart = get_guest_cart()
+    if not cart:
+        return []
+    products = Product.query.filter(Product.id.in_([int(pid) for pid in cart]),
+                                    Product.is_active.is_(True)).all()
+    return [GuestCartItem(p, cart[str(p.id)]) for p in products]
+
+def get_cart_count():
+    if current_user.is_authenticated:
+        return CartItem.query.filter_by(user_id=current_user.id).count()
+    return len(session.get(GUEST_CART_KEY, {}))
+
+def purchasable(product):
+    """Units this shopper may have in their cart: free stock plus their own holds."""
+    limit = product.available
+    if current_user.is_authenticated:
+        limit += reservations.held(current_user.id, product.id)
+    return limit
+
+def get_cart_item_or_404(item_id):
+    if current_user.is_authenticated:
+        return CartItem.query.filter_by(id=item_id, user_id=current_user.id).first_or_404()
+    qty = get_guest_cart().get(str(item_id))
+    if not qty:
+        abort(404)
+    return GuestCartItem(Product.query.get_or_404(item_id), qty)
+
+def set_cart_quantity(item, qty):
+    """Set ``item``'s quantity, clamped to stock; 0 or less removes it."""
+    if isinstance(item, CartItem):
+        if qty <= 0:
+            db.session.delete(item)
+        else:
+            item.quantity = min(qty, purchasable(item.product))
+        db.session.commit()
+        return
+    cart = get_guest_cart()
+    if qty <= 0:
+        cart.pop(str(item.id), None)
+    else:
+        item.quantity = cart[str(item.id)] = min(qty, purchasable(item.product))
+    save_guest_cart(cart)
+
+def merge_guest_cart(user):
+    """
+    Fold the session's guest cart into ``user``'s CartItem rows with one
+    batched upsert; quantities add up and are clamped to available stock.
+    """
+    cart = session.pop(GUEST_CART_KEY, None)
+    if not cart:
+        return
+    stmt = upsert_insert(CartItem).values([
+        {'user_id': user.id, 'product_id': int(pid), 'quantity': qty, 'added_at': datetime.utcnow()}
+        for pid, qty in cart.items()
+    ])
+    combined = CartItem.quantity + stmt.excluded.quantity
+    stock = select(Product.stock - Product.reserved).where(Product.id == CartItem.product_id)\
+        .correlate_except(Product).scalar_subquery()
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'product_id'],
+        set_={'quantity': case((combined > stock, stock), else_=combined)},
+    )
+    db.session.execute(stmt)
+    db.session.commit()
 
 def get_cart_total(items):
     return sum(i.subtotal for i in items)
 
-def recalculate_discount(subtotal):
-    discount_id = session.get('discount_id')
-    if not discount_id:
-        session.pop('discount_amount', None)
-        session.pop('discount_code', None)
-        return 0
-    
-    discount = Discount.query.get(discount_id)
-    if not discount:
-        session.pop('discount_id', None)
-        session.pop('discount_amount', None)
-        session.pop('discount_code', None)
-        return 0
-    
-    valid, msg = discount.is_valid(subtotal)
-    if not valid:
-        # If no longer valid (e.g. subtotal < min_order), remove discount
-        session.pop('discount_id', None)
-        session.pop('discount_amount', None)
-        session.pop('discount_code', None)
-        return 0
-    
-    amount = discount.apply(subtotal)
+def clear_discount():
+    session.pop('discount_code', None)
+    session.pop('discount_amount', None)
+
+def price_discount(items, subtotal):
+    """``(rule, amount)`` for the session's coupon on the cart (no database reads); drops it if it no longer applies."""
+    code = session.get('discount_code')
+    if not code:
+        clear_discount()
+        return None, 0
+    try:
+        rule, amount = discounts.evaluate(code, items, subtotal)
+    except discounts.DiscountError:
+        clear_discount()
+        return None, 0
     session['discount_amount'] = amount
-    return amount
+    return rule, amount
+
+def recalculate_discount(items, subtotal):
+    """Re-price the session's coupon for the cart; returns the amount."""
+    return price_discount(items, subtotal)[1]
 
 @cart_bp.route('/')
-@login_required
 def view_cart():
     items = get_cart_items()
     subtotal = get_cart_total(items)
     threshold = float(SiteSettings.get('free_shipping_threshold', 200))
     shipping_cost = float(SiteSettings.get('shipping_cost', 9.95))
     shipping = 0 if subtotal >= threshold else shipping_cost
-    discount_amount = float(session.get('discount_amount', 0))
+    discount_amount = recalculate_discount(items, subtotal)
     discount_code = session.get('discount_code', '')
     total = max(0, subtotal + shipping - discount_amount)
     return render_template('shop/cart.html',
@@ -58,38 +147,45 @@ def view_cart():
                            threshold=threshold)
 
 @cart_bp.route('/add/<int:product_id>', methods=['POST'])
-@login_required
+@rate_limited
 def add_to_cart(product_id):
     product = Product.query.get_or_404(product_id)
     qty = int(request.form.get('quantity', 1))
-    existing = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
-    if existing:
-        existing.quantity = min(existing.quantity + qty, product.stock)
+    limit = purchasable(product)
+    if current_user.is_authenticated:
+        existing = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
+        if existing:
+            existing.quantity = min(existing.quantity + qty, limit)
+        else:
+            if limit < qty:
+                return jsonify({'error': 'Insufficient stock'}), 400
+            item = CartItem(user_id=current_user.id, product_id=product_id, quantity=qty)
+            db.session.add(item)
+        db.session.commit()
     else:
-        if product.stock < qty:
-            return jsonify({'error': 'Insufficient stock'}), 400
-        item = CartItem(user_id=current_user.id, product_id=product_id, quantity=qty)
-        db.session.add(item)
-    db.session.commit()
-    cart_count = CartItem.query.filter_by(user_id=current_user.id).count()
+        cart = get_guest_cart()
+        key = str(product_id)
+        if key in cart:
+            cart[key] = min(cart[key] + qty, limit)
+        else:
+            if limit < qty:
+                return jsonify({'error': 'Insufficient stock'}), 400
+            cart[key] = qty
+        save_guest_cart(cart)
+    cart_count = get_cart_count()
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return jsonify({'success': True, 'cart_count': cart_count, 'message': f'{product.name} added to cart!'})
     flash(f'{product.name} added to your cart!', 'success')
     return redirect(url_for('cart.view_cart'))
 
 @cart_bp.route('/update/<int:item_id>', methods=['POST'])
-@login_required
 def update_cart(item_id):
-    item = CartItem.query.filter_by(id=item_id, user_id=current_user.id).first_or_404()
+    item = get_cart_item_or_404(item_id)
     qty = int(request.form.get('quantity', 1))
-    if qty <= 0:
-        db.session.delete(item)
-    else:
-        item.quantity = min(qty, item.product.stock)
-    db.session.commit()
+    set_cart_quantity(item, qty)
     items = get_cart_items()
     subtotal = get_cart_total(items)
-    discount_amount = recalculate_discount(subtotal)
+    discount_amount = recalculate_discount(items, subtotal)
     threshold = float(SiteSettings.get('free_shipping_threshold', 200))
     shipping_cost = float(SiteSettings.get('shipping_cost', 9.95))
     shipping = 0 if subtotal >= threshold else shipping_cost
@@ -106,18 +202,16 @@ def update_cart(item_id):
         'item_subtotal': item.subtotal if qty > 0 else 0,
         'threshold': threshold,
         'actual_quantity': item.quantity if qty > 0 else 0,
-        'stock_limit_reached': qty > item.product.stock
+        'stock_limit_reached': qty > item.quantity
     })
 
 @cart_bp.route('/remove/<int:item_id>', methods=['POST'])
-@login_required
 def remove_from_cart(item_id):
-    item = CartItem.query.filter_by(id=item_id, user_id=current_user.id).first_or_404()
-    db.session.delete(item)
-    db.session.commit()
+    item = get_cart_item_or_404(item_id)
+    set_cart_quantity(item, 0)
     items = get_cart_items()
     subtotal = get_cart_total(items)
-    discount_amount = recalculate_discount(subtotal)
+    discount_amount = recalculate_discount(items, subtotal)
     threshold = float(SiteSettings.get('free_shipping_threshold', 200))
     shipping_cost = float(SiteSettings.get('shipping_cost', 9.95))
     shipping = 0 if subtotal >= threshold else shipping_cost
@@ -134,21 +228,16 @@ def remove_from_cart(item_id):
     })
 
 @cart_bp.route('/apply-coupon', methods=['POST'])
-@login_required
 def apply_coupon():
     code = request.form.get('code', '').strip().upper()
     items = get_cart_items()
     subtotal = get_cart_total(items)
-    discount = Discount.query.filter_by(code=code).first()
-    if not discount:
-        return jsonify({'success': False, 'message': 'Invalid discount code.'})
-    valid, msg = discount.is_valid(subtotal)
-    if not valid:
-        return jsonify({'success': False, 'message': msg})
-    amount = discount.apply(subtotal)
+    try:
+        rule, amount = discounts.evaluate(code, items, subtotal, check_usage=True)
+    except discounts.DiscountError as e:
+        return jsonify({'success': False, 'message': str(e)})
     session['discount_code'] = code
     session['discount_amount'] = amount
-    session['discount_id'] = discount.id
     threshold = float(SiteSettings.get('free_shipping_threshold', 200))
     shipping_cost = float(SiteSettings.get('shipping_cost', 9.95))
     shipping = 0 if subtotal >= threshold else shipping_cost
@@ -157,33 +246,60 @@ def apply_coupon():
                     'total': total, 'message': f'Code "{code}" applied! You saved Rs{amount:.2f}'})
 
 @cart_bp.route('/remove-coupon', methods=['POST'])
-@login_required
 def remove_coupon():
-    session.pop('discount_code', None)
-    session.pop('discount_amount', None)
-    session.pop('discount_id', None)
+    clear_discount()
     return jsonify({'success': True})
 
 @cart_bp.route('/count')
-@login_required
 def cart_count():
-    count = CartItem.query.filter_by(user_id=current_user.id).count()
-    return jsonify({'count': count})
+    return jsonify({'count': get_cart_count()})
 
 @cart_bp.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
+    if request.method == 'POST':
+        # a repeated submission goes straight to the first one's confirmation
+        checkout_key = request.form.get('checkout_key') or idempotency.issue()
+        first, order_number = idempotency.claim(checkout_key, current_user.id)
+        if not first:
+            if order_number:
+                return redirect(url_for('cart.order_confirmation', order_number=order_number))
+            flash('Your order is still being placed. Please check your orders in a moment.', 'info')
+            return redirect(url_for('account.orders'))
+        try:
+            return place_order(checkout_key)
+        except Exception:
+            idempotency.release(checkout_key)
+            raise
+    return place_order(None)
+
+def place_order(checkout_key):
+    """
+    The checkout page (GET) or the order for ``checkout_key`` (POST). Every
+    POST branch that doesn't place the order gives the key back, so the
+    shopper can resubmit once the cart is fixed.
+    """
     items = get_cart_items()
     if not items:
+        if checkout_key:
+            idempotency.release(checkout_key)
         flash('Your cart is empty.', 'warning')
         return redirect(url_for('cart.view_cart'))
     subtotal = get_cart_total(items)
     threshold = float(SiteSettings.get('free_shipping_threshold', 200))
     shipping_cost = float(SiteSettings.get('shipping_cost', 9.95))
     shipping = 0 if subtotal >= threshold else shipping_cost
-    discount_amount = float(session.get('discount_amount', 0))
+    discount_rule, discount_amount = price_discount(items, subtotal)
+    discount_code = session.get('discount_code')
     total = max(0, subtotal + shipping - discount_amount)
 
+    if request.method == 'GET':
+        # hold the cart's units while the shopper fills in the form
+        try:
+            reservations.hold_cart(current_user.id, items)
+        except reservations.OutOfStockError as e:
+            return sold_out(items, e)
+
     if request.method == 'POST':
         # Build order
         order_number = 'ORD-' + uuid.uuid4().hex[:8].upper()
@@ -194,7 +310,8 @@ def checkout():
             shipping_cost=shipping,
             discount_amount=discount_amount,
             total=total,
-            discount_code=session.get('discount_code', ''),
+            item_count=len(items),
+            discount_code=discount_code or '',
             shipping_name=request.form.get('full_name'),
             shipping_email=request.form.get('email'),
             shipping_phone=request.form.get('phone'),
@@ -211,6 +328,12 @@ def checkout():
         db.session.add(order)
         db.session.flush()
 
+        try:
+            reservations.purchase(current_user.id, items)
+        except reservations.OutOfStockError as e:
+            idempotency.release(checkout_key)
+            return sold_out(get_cart_items(), e)
+
         for item in items:
             oi = OrderItem(
                 order_id=order.id,
@@ -219,27 +342,46 @@ def checkout():
                 unit_price=item.product.price,
                 subtotal=item.subtotal
             )
-            item.product.stock = max(0, item.product.stock - item.quantity)
             db.session.add(oi)
             db.session.delete(item)
 
-        # Mark discount used
-        discount_id = session.get('discount_id')
-        if discount_id:
-            d = Discount.query.get(discount_id)
-            if d:
-                d.used_count += 1
+        if discount_rule is not None:
+            try:
+                # the rule priced above: the code may be gone from the map by now
+                discounts.redeem(discount_rule, current_user.id)
+            except discounts.DiscountError as e:
+                idempotency.release(checkout_key)
+                clear_discount()
+                flash(f'{e} It has been removed from your cart.', 'warning')
+                return redirect(url_for('cart.view_cart'))
 
+        # confirmation email, sales rollup etc. run after the commit, off the request
+        outbox.enqueue('order.placed', {'order_id': order.id, 'order_number': order_number},
+                       key=f'order.placed:{order_number}')
+        idempotency.record(checkout_key, order_number)
         db.session.commit()
-        session.pop('discount_code', None)
-        session.pop('discount_amount', None)
-        session.pop('discount_id', None)
+        outbox.notify()
+        clear_discount()
         return redirect(url_for('cart.order_confirmation', order_number=order_number))
 
     return render_template('shop/checkout.html',
                            items=items, subtotal=subtotal,
                            shipping=shipping, discount_amount=discount_amount,
-                           total=total, user=current_user)
+                           total=total, user=current_user,
+                           hold_minutes=current_app.config.get('STOCK_HOLD_SECONDS', 600) // 60,
+                           checkout_key=idempotency.issue())
+
+def sold_out(items, error):
+    """Trim the cart line that can't be covered and send the shopper back to the cart."""
+    item = next((i for i in items if i.product_id == error.product_id), None)
+    if item is not None:
+        set_cart_quantity(item, error.available)
+        name = item.product.name
+        if error.available:
+            flash(f'Only {error.available} of "{name}" left; we updated your cart.', 'warning')
+        else:
+            flash(f'"{name}" just sold out and was removed from your cart.', 'warning')
+    return redirect(url_for('cart.view_cart'))
 
 @cart_bp.route('/confirmation/<order_number>')
 @login_required
@@ -1,16 +1,22 @@
 from flask import Blueprint, render_template, redirect, url_for, request, jsonify
-from app.models import Product, Category, Review, Newsletter, db
-from sqlalchemy import func
+from app.models import Newsletter, db
+from app.routing import use_replica
+from flask_login import current_user
+from app import snapshot, wishlists
+from app.ratelimit import rate_limited
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
+@use_replica
 def index():
-    featured = Product.query.filter_by(is_featured=True, is_active=True).limit(6).all()
-    categories = Category.query.filter_by(is_active=True).order_by(Category.display_order).all()
-    return render_template('main/index.html', featured=featured, categories=categories)
+    snap = snapshot.get()
+    featured = snap.featured[:6]
+    return render_template('main/index.html', featured=featured, categories=snap.categories,
+                           wished=wishlists.get(current_user).members(p.id for p in featured))
 
 @main_bp.route('/newsletter', methods=['POST'])
+@rate_limited
 def newsletter():
     email = request.form.get('email', '').strip()
     if email:
@@ -1,66 +1,134 @@
-from flask import Blueprint, render_template, request, abort, jsonify
+from flask import Blueprint, render_template, request, abort, jsonify, url_for, redirect
 from flask_login import login_required, current_user
-from app.models import Product, Category, Review, db, Wishlist
+from app.models import Product, Review, ProductReviewStats, db
+from app import catalogue, facets, typeahead, slugs, snapshot, product_pages, reviews, wishlists, streaming
+from app.routing import use_replica
+from app.ratelimit import rate_limited
 
 shop_bp = Blueprint('shop', __name__)
 
 @shop_bp.route('/')
+@use_replica
 def products():
     page = request.args.get('page', 1, type=int)
-    category_slug = request.args.get('category', '')
     sort = request.args.get('sort', 'newest')
     search = request.args.get('q', '').strip()
+    selected = facets.parse_filters(request.args)
 
-    query = Product.query.filter_by(is_active=True)
-    categories = Category.query.filter_by(is_active=True).order_by(Category.display_order).all()
+    index = facets.get_index()
+    categories = index.snapshot.categories
     active_category = None
+    if len(selected.get('category', ())) == 1:
+        slug = next(iter(selected['category']))
+        active_category = next((c for c in categories if c.slug == slug), None)
 
-    if category_slug:
-        cat = Category.query.filter_by(slug=category_slug, is_active=True).first()
-        if cat:
-            query = query.filter_by(category_id=cat.id)
-            active_category = cat
-
+    # Free text stays in SQL; its matches restrict the in-memory facet search
+    restrict_ids = None
     if search:
-        query = query.filter(
+        restrict_ids = [pid for (pid,) in db.session.query(Product.id).filter(
+            Product.is_active.is_(True),
             (Product.name.ilike(f'%{search}%')) |
             (Product.subtitle.ilike(f'%{search}%')) |
             (Product.description.ilike(f'%{search}%'))
-        )
+        )]
 
-    if sort == 'price_asc':
-        query = query.order_by(Product.price.asc())
-    elif sort == 'price_desc':
-        query = query.order_by(Product.price.desc())
-    elif sort == 'name':
-        query = query.order_by(Product.name.asc())
-    else:
-        query = query.order_by(Product.created_at.desc())
+    result = index.search(selected, sort=sort, restrict_ids=restrict_ids)
+    pagination = facets.FacetPagination(page=page, per_page=12, error_out=False,
+                                        result=result, index=index)
+
+    filter_args = {facet: sorted(values) for facet, values in selected.items()}
+    if search:
+        filter_args['q'] = search
+
+    def toggle_url(facet, value):
+        args = {k: list(v) for k, v in filter_args.items()}
+        values = args.setdefault(facet, [])
+        if value in values:
+            values.remove(value)
+        else:
+            values.append(value)
+        return url_for('shop.products', sort=sort, **args)
 
-    pagination = query.paginate(page=page, per_page=12, error_out=False)
-    return render_template('shop/products.html',
+    return streaming.render('shop/products.html',
                            products=pagination.items,
+                           wished=wishlists.get(current_user).members(p.id for p in pagination.items),
                            pagination=pagination,
                            categories=categories,
+                           category_counts=result.counts.get('category', {}),
+                           facet_options=[f for f in index.options(result, selected) if f[0] != 'category'],
+                           filter_args=filter_args,
+                           toggle_url=toggle_url,
                            active_category=active_category,
                            sort=sort,
                            search=search)
 
+@shop_bp.route('/suggest')
+def suggest():
+    q = request.args.get('q', '')[:100]
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 10)
+    results = typeahead.get_index().lookup(q, limit=limit)
+    return jsonify({'query': q, 'suggestions': [s.to_dict() for s in results]})
+
 @shop_bp.route('/product/<slug>')
+@use_replica
 def product_detail(slug):
-    product = Product.query.filter_by(slug=slug, is_active=True).first_or_404()
-    reviews = Review.query.filter_by(product_id=product.id, is_approved=True).order_by(Review.created_at.desc()).all()
-    related = Product.query.filter_by(category_id=product.category_id, is_active=True)\
-                     .filter(Product.id != product.id).limit(4).all()
-    in_wishlist = False
-    if current_user.is_authenticated:
-        in_wishlist = Wishlist.query.filter_by(user_id=current_user.id, product_id=product.id).first() is not None
+    pid, canonical = slugs.resolve_product(slug)
+    if pid is None:
+        abort(404)
+    if canonical is not None:
+        return redirect(url_for('shop.product_detail', slug=canonical), 301)
+    page, stock = product_pages.get(pid)
+    if page is None or not page.is_active:
+        abort(404)
+    if page.slug != slug:
+        # renamed since this worker's slug index was built: the slug is an old one
+        catalogue.invalidate()
+        return redirect(url_for('shop.product_detail', slug=page.slug), 301)
+    snap = snapshot.get()
+    related = [snap.by_id[i] for i in page.related_ids if i in snap.by_id]
+    wishlist = wishlists.get(current_user)
     return render_template('shop/product_detail.html',
-                           product=product, reviews=reviews,
-                           related=related, in_wishlist=in_wishlist)
+                           product=page, stock=stock, reviews=page.reviews,
+                           related=related, in_wishlist=page.id in wishlist,
+                           wished=wishlist.members(p.id for p in related))
+
+@shop_bp.route('/product/<int:product_id>/reviews')
+@use_replica
+def product_reviews(product_id):
+    sort = request.args.get('sort', reviews.DEFAULT_SORT)
+    if sort not in reviews.SORTS:
+        sort = reviews.DEFAULT_SORT
+    rating = request.args.get('rating', type=int)
+    if rating not in range(1, 6):
+        rating = None
+    limit = min(max(request.args.get('limit', 6, type=int), 1), reviews.MAX_PAGE_SIZE)
+    cursor = request.args.get('after') or None
+    try:
+        records, next_cursor = reviews.page(product_id, sort=sort, rating=rating,
+                                            cursor=cursor, limit=limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    data = {'reviews': [r.to_dict() for r in records], 'next': next_cursor,
+            'sort': sort, 'rating': rating}
+    if cursor is None:
+        stats = db.session.get(ProductReviewStats, product_id)
+        data['count'] = stats.review_count if stats else 0
+        data['average'] = stats.average_rating if stats else 0
+        data['histogram'] = stats.histogram if stats else {s: 0 for s in range(5, 0, -1)}
+    return jsonify(data)
+
+@shop_bp.route('/review/<int:review_id>/helpful', methods=['POST'])
+@login_required
+def mark_review_helpful(review_id):
+    review = Review.query.get_or_404(review_id)
+    counted = reviews.mark_helpful(review.id, current_user.id)
+    db.session.commit()
+    db.session.refresh(review)
+    return jsonify({'success': counted, 'helpful_count': review.helpful_count})
 
 @shop_bp.route('/review/<int:product_id>', methods=['POST'])
 @login_required
+@rate_limited
 def add_review(product_id):
     product = Product.query.get_or_404(product_id)
     rating = request.form.get('rating', type=int)
@@ -82,14 +150,11 @@ def add_review(product_id):
 
 @shop_bp.route('/wishlist/toggle/<int:product_id>', methods=['POST'])
 @login_required
+@rate_limited
 def toggle_wishlist(product_id):
-    Product.query.get_or_404(product_id)
-    existing = Wishlist.query.filter_by(user_id=current_user.id, product_id=product_id).first()
-    if existing:
-        db.session.delete(existing)
-        db.session.commit()
-        return jsonify({'in_wishlist': False})
-    w = Wishlist(user_id=current_user.id, product_id=product_id)
-    db.session.add(w)
-    db.session.commit()
-    return jsonify({'in_wishlist': True})
+    if product_id not in snapshot.get().by_id and db.session.get(Product, product_id) is None:
+        abort(404)
+    in_wishlist = wishlists.toggle(current_user.id, product_id)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({'in_wishlist': in_wishlist})
+    return redirect(request.referrer or url_for('account.wishlist'))
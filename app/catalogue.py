@@ -0,0 +1,113 @@
+"""
+Catalogue version stamp.
+
+Every flush that creates, deletes or edits a Product, Category,
+ProductImage, ProductSlugRedirect, NavigationItem or SiteSettings row
+bumps the ``catalogue_version`` row (id ``CATALOGUE``) in the same
+transaction. Per-worker structures built from the catalogue (snapshot,
+facet bitmaps, typeahead and slug indexes, ...) compare their build
+version with ``current_version()`` and rebuild when it moves.
+
+Discounts have a stamp of their own (row ``DISCOUNTS``), so editing a
+coupon only rebuilds the discount rules, not every catalogue structure.
+
+Workers re-read the stamp at most every ``CATALOGUE_VERSION_TTL`` seconds;
+a worker that commits a catalogue change sees it immediately.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import (db, Product, Category, ProductImage, ProductSlugRedirect,
+                        NavigationItem, SiteSettings, Discount, CatalogueVersion)
+
+# catalogue_version rows
+CATALOGUE = 1
+DISCOUNTS = 2
+
+TRACKED_MODELS = (Product, Category, ProductImage, ProductSlugRedirect, NavigationItem,
+                  SiteSettings)
+
+# Product columns that change without affecting what the catalogue shows
+# (stock and reservations move on every checkout). Stock still counts when
+# it crosses zero, since listings mark sold-out pieces.
+IGNORED_PRODUCT_ATTRS = {'stock', 'reserved'}
+
+_lock = threading.Lock()
+_state = {}  # stamp -> (version, checked_at)
+
+
+def current_version(stamp=CATALOGUE):
+    """The version of ``stamp``, cached per worker for ``CATALOGUE_VERSION_TTL`` seconds."""
+    ttl = current_app.config.get('CATALOGUE_VERSION_TTL', 2)
+    now = time.monotonic()
+    cached = _state.get(stamp)
+    if cached is not None and now - cached[1] < ttl:
+        return cached[0]
+    version = db.session.query(CatalogueVersion.version).filter_by(id=stamp).scalar() or 0
+    with _lock:
+        _state[stamp] = (version, now)
+    return version
+
+
+def invalidate(stamp=None):
+    """Force the next ``current_version()`` call to re-read ``stamp`` (default: all)."""
+    with _lock:
+        if stamp is None:
+            _state.clear()
+        else:
+            _state.pop(stamp, None)
+
+
+def _crosses_zero(history):
+    if not history.deleted or not history.added:
+        return False
+    old, new = history.deleted[0] or 0, history.added[0] or 0
+    return (old > 0) != (new > 0)
+
+
+def _changes_catalogue(obj):
+    if not isinstance(obj, Product):
+        return True
+    state = inspect(obj)
+    if _crosses_zero(state.attrs.stock.history):
+        return True
+    return any(attr.history.has_changes() for attr in state.attrs
+               if attr.key not in IGNORED_PRODUCT_ATTRS)
+
+
+def bump(session, stamp=CATALOGUE):
+    """Move the version of ``stamp`` on in ``session``'s transaction."""
+    table = CatalogueVersion.__table__
+    conn = session.connection()
+    now = datetime.utcnow()
+    result = conn.execute(table.update().where(table.c.id == stamp)
+                          .values(version=table.c.version + 1, updated_at=now))
+    if result.rowcount == 0:
+        conn.execute(table.insert().values(id=stamp, version=1, updated_at=now))
+    session.info.setdefault('stamps_changed', set()).add(stamp)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_catalogue_change(session, flush_context):
+    changed = session.new | session.deleted | session.dirty
+    if any(isinstance(o, TRACKED_MODELS) and (o not in session.dirty or _changes_catalogue(o))
+           for o in changed):
+        bump(session)
+    if any(isinstance(o, Discount) for o in changed):
+        bump(session, DISCOUNTS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    for stamp in session.info.pop('stamps_changed', ()):
+        invalidate(stamp)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('stamps_changed', None)
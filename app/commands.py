@@ -0,0 +1,187 @@
+"""
+Flask CLI commands, registered on the app in ``create_app``.
+
+    flask recommendations refresh [--full] [--top-k N]
+    flask engine report
+    flask engine bench [--writers N] [--seconds S]
+    flask replicas sync
+    flask reviews rebuild-stats
+    flask outbox drain | status | purge
+    flask checkout compact-keys
+    flask startup report | bench
+    flask passwords calibrate
+
+Schema migrations are Flask-Migrate's ``flask db upgrade`` (see migrations/).
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+recommendations_cli = AppGroup('recommendations', help='Related-product neighbour lists.')
+engine_cli = AppGroup('engine', help='Database engine profiles.')
+replicas_cli = AppGroup('replicas', help='Local read-replica stand-in.')
+reviews_cli = AppGroup('reviews', help='Stored review aggregates.')
+outbox_cli = AppGroup('outbox', help='Deferred side effects of checkout.')
+checkout_cli = AppGroup('checkout', help='Checkout housekeeping.')
+startup_cli = AppGroup('startup', help='Startup warm-up and timings.')
+ratelimit_cli = AppGroup('ratelimit', help='Request rate limits.')
+orders_cli = AppGroup('orders', help='Order history archive.')
+passwords_cli = AppGroup('passwords', help='Password hashing.')
+
+
+@recommendations_cli.command('refresh')
+@click.option('--full', is_flag=True, help='Rebuild every product, not just stale ones.')
+@click.option('--top-k', type=int, default=None, help='Neighbours to keep per product.')
+def refresh_recommendations(full, top_k):
+    """Recompute neighbour lists from orders, wishlists and attributes."""
+    from app import recommendations
+    product_ids = None if full else recommendations.stale_product_ids()
+    if product_ids is not None and not product_ids:
+        click.echo('Recommendations are up to date.')
+        return
+    count = recommendations.refresh(product_ids, k=top_k)
+    click.echo(f'Refreshed neighbour lists for {count} products.')
+
+
+@engine_cli.command('report')
+def engine_report():
+    """Show the settings in effect on a live connection."""
+    from app import db, engine
+    click.echo(f"profile: {current_app.config.get('DB_PROFILE')}")
+    for name, bind in db.engines.items():
+        click.echo(f'[{name or "primary"}]')
+        for key, value in engine.report(bind).items():
+            click.echo(f'  {key}: {value}')
+
+
+@engine_cli.command('bench')
+@click.option('--writers', type=int, default=8, help='Concurrent writer threads.')
+@click.option('--seconds', type=float, default=5.0, help='Duration per profile.')
+def engine_bench(writers, seconds):
+    """Compare SQLite write throughput across engine profiles."""
+    from app import engine
+    click.echo(f'{"profile":<12} {"commits/s":>10} {"commits":>8} {"locked":>7}')
+    for profile in engine.PROFILES:
+        r = engine.benchmark(current_app.config, profile, writers=writers, seconds=seconds)
+        click.echo(f'{profile:<12} {r["commits_per_sec"]:>10} {r["commits"]:>8} {r["locked_errors"]:>7}')
+
+
+@replicas_cli.command('sync')
+def replicas_sync():
+    """Copy the primary SQLite database onto each SQLite replica."""
+    from app import db, routing
+    synced = routing.sync_replicas(db)
+    click.echo(f'Synced {", ".join(synced)}.' if synced else 'No replicas configured.')
+
+
+@reviews_cli.command('rebuild-stats')
+def reviews_rebuild_stats():
+    """Recompute rating counts and histograms for every product."""
+    from app import reviews
+    count = reviews.rebuild_all()
+    click.echo(f'Rebuilt review stats for {count} products.')
+
+
+@outbox_cli.command('drain')
+def outbox_drain():
+    """Process every due outbox event."""
+    from app import outbox
+    done = failed = 0
+    while True:
+        d, f = outbox.drain()
+        done, failed = done + d, failed + f
+        if d + f < outbox.BATCH_SIZE:
+            break
+    click.echo(f'Processed {done} events, {failed} failed.')
+
+
+@outbox_cli.command('status')
+def outbox_status():
+    """Count outbox events by status."""
+    from app.models import db, OutboxEvent
+    rows = db.session.query(OutboxEvent.status, db.func.count(OutboxEvent.id))\
+        .group_by(OutboxEvent.status).all()
+    for status, count in rows:
+        click.echo(f'{status:<12} {count}')
+    if not rows:
+        click.echo('The outbox is empty.')
+
+
+@outbox_cli.command('purge')
+def outbox_purge():
+    """Delete events processed longer ago than OUTBOX_RETENTION_DAYS."""
+    from app import outbox
+    click.echo(f'Deleted {outbox.purge()} processed events.')
+
+
+@checkout_cli.command('compact-keys')
+def checkout_compact_keys():
+    """Delete checkout idempotency keys older than CHECKOUT_KEY_TTL."""
+    from app import idempotency
+    click.echo(f'Deleted {idempotency.compact()} checkout keys.')
+
+
+@startup_cli.command('report')
+def startup_report():
+    """Show how long each phase of create_app took in this process."""
+    for phase, ms in current_app.extensions['startup_timings'].items():
+        click.echo(f'{phase:<20} {ms:>8} ms')
+
+
+@startup_cli.command('bench')
+def startup_bench():
+    """Time cold start to first responses, with and without the warm-up."""
+    from app import warmup
+    for enabled in (False, True):
+        r = warmup.measure_cold_start(enabled)
+        click.echo(f'[warm-up {"on" if enabled else "off"}] create_app {r["create_app_ms"]} ms, '
+                   f'first response after {r["to_first_response_ms"]} ms')
+        for path in warmup.PROBE_PATHS:
+            click.echo(f'  {path:<14} first {r["first"][path]:>7} ms   second {r["second"][path]:>7} ms')
+
+
+@ratelimit_cli.command('stats')
+def ratelimit_stats():
+    """Show how many requests each limit has rejected."""
+    from app import ratelimit
+    rejected = ratelimit.metrics(current_app)
+    if not rejected:
+        click.echo('No requests rejected.')
+    for name, count in sorted(rejected.items()):
+        click.echo(f'{name:<32} {count:>8}')
+
+
+@orders_cli.command('archive')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive finished orders older than this (default ORDER_ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, default=None, help='Orders per transaction (default ORDER_ARCHIVE_BATCH).')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches.')
+def orders_archive(older_than_days, batch_size, max_batches):
+    """Move delivered and cancelled orders into the archive tables."""
+    from app import archive
+    moved = archive.archive(older_than_days, batch_size, max_batches)
+    click.echo(f'Archived {moved} orders.')
+
+
+@passwords_cli.command('calibrate')
+def passwords_calibrate():
+    """Measure this host and save the bcrypt cost every worker uses."""
+    from app import passwords
+    pinned = current_app.config.get('PASSWORD_HASH_ROUNDS')
+    rounds = passwords.save_rounds(passwords.calibrate_for_app())
+    click.echo(f'Saved bcrypt cost {rounds} to {passwords.rounds_path()}; restart workers to use it.')
+    if pinned:
+        click.echo(f'PASSWORD_HASH_ROUNDS pins the cost to {pinned}, so the saved value is not used.')
+
+
+def register_commands(app):
+    app.cli.add_command(recommendations_cli)
+    app.cli.add_command(engine_cli)
+    app.cli.add_command(replicas_cli)
+    app.cli.add_command(reviews_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(checkout_cli)
+    app.cli.add_command(startup_cli)
+    app.cli.add_command(ratelimit_cli)
+    app.cli.add_command(orders_cli)
+    app.cli.add_command(passwords_cli)
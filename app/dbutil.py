@@ -0,0 +1,36 @@
+"""
+Small SQL helpers shared by the blueprints.
+"""
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import db
+
+_UPSERT_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def upsert_insert(model):
+    """
+    An INSERT for ``model`` that supports ``.on_conflict_do_update()`` /
+    ``.on_conflict_do_nothing()`` on the session's database.
+    """
+    dialect = db.session.get_bind().dialect.name
+    try:
+        return _UPSERT_DIALECTS[dialect](model)
+    except KeyError:
+        raise NotImplementedError(f'Upserts are not supported on {dialect}') from None
+
+
+def sync_id_sequence(table):
+    """
+    Move ``table``'s id sequence past the highest id, after rows were
+    inserted with explicit ids. SQLite needs nothing: it picks max(id) + 1.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), MAX(id)) "
+                            f"FROM {table.name}"))
+    db.session.commit()
@@ -0,0 +1,226 @@
+"""
+Discount engine.
+
+Codes are checked and priced against a per-worker map of code ->
+``DiscountRule``, built from the discounts table and rebuilt when the
+discounts stamp moves (every Discount change bumps it, see
+app/catalogue.py), so recalculating the cart after every change reads no
+database.
+
+A rule is an amount (``percent`` or ``fixed``, optionally tiered by
+subtotal) and a scope that decides which cart lines it applies to. Scopes
+are registered with ``@scope``: ``order`` (everything), ``category`` and
+``product``.
+
+Limits are enforced when the order is placed, in its transaction:
+
+- ``per_user_limit``: a (code, user) counter incremented by an upsert that
+  only applies while it is below the limit.
+- ``max_uses``: the allowance is split over ``DISCOUNT_USAGE_SHARDS``
+  counter rows. A redemption increments a random shard that still has
+  room (``... WHERE used < share``) and moves to the next one if it is
+  full, so a rush on one code spreads over several rows instead of queueing
+  on one, and the total can never pass ``max_uses``.
+
+Applying a code (``evaluate(..., check_usage=True)``) also sums its
+shards, so a used-up code is refused then rather than at checkout. A
+worker that finds a code used up refuses it at validation until the map
+is next rebuilt. A ``max_uses`` of 0 means unlimited, as it always has.
+"""
+import json
+import random
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from app import catalogue
+from app.dbutil import upsert_insert
+from app.models import db, Discount, DiscountUsage, DiscountUserUsage
+
+
+class DiscountError(Exception):
+    """A code that can't be used; the message is shown to the shopper."""
+
+
+# ── Scopes ───────────────────────────────────────────────────────────────────
+_scopes = {}
+
+
+def scope(name):
+    """Register ``fn(rule, item)``: whether a cart line counts towards ``name`` rules."""
+    def register(fn):
+        _scopes[name] = fn
+        return fn
+    return register
+
+
+@scope('order')
+def _whole_order(rule, item):
+    return True
+
+
+@scope('category')
+def _in_categories(rule, item):
+    return item.product.category_id in rule.scope_ids
+
+
+@scope('product')
+def _in_products(rule, item):
+    return item.product_id in rule.scope_ids
+
+
+# ── Rules ────────────────────────────────────────────────────────────────────
+def parse_ids(text):
+    return frozenset(int(part) for part in (text or '').replace(' ', '').split(',') if part)
+
+
+def parse_tiers(text):
+    """``'5000:10, 10000:15'`` -> JSON for ``Discount.tiers`` (None when empty)."""
+    tiers = []
+    for part in (text or '').split(','):
+        if part.strip():
+            threshold, value = part.split(':')
+            tiers.append([float(threshold), float(value)])
+    return json.dumps(sorted(tiers)) if tiers else None
+
+
+def format_tiers(stored):
+    return ', '.join(f'{t:g}:{v:g}' for t, v in json.loads(stored)) if stored else ''
+
+
+class DiscountRule:
+    __slots__ = ('id', 'code', 'percent', 'value', 'tiers', 'min_order', 'max_uses',
+                 'per_user_limit', 'scope', 'scope_ids', 'active', 'expires_at')
+
+    def __init__(self, discount):
+        self.id = discount.id
+        self.code = discount.code
+        self.percent = discount.discount_type in ('percent', 'percentage')
+        self.value = discount.value
+        # highest threshold first
+        self.tiers = tuple(sorted((tuple(t) for t in json.loads(discount.tiers)), reverse=True)) \
+            if discount.tiers else ()
+        self.min_order = discount.min_order_amount or 0
+        self.max_uses = discount.max_uses or None  # 0 has always meant unlimited
+        self.per_user_limit = discount.per_user_limit
+        self.scope = discount.scope if discount.scope in _scopes else 'order'
+        self.scope_ids = parse_ids(discount.scope_ids)
+        self.active = discount.is_active
+        self.expires_at = discount.expires_at
+
+    def rate(self, eligible):
+        for threshold, value in self.tiers:
+            if eligible >= threshold:
+                return value
+        return self.value
+
+    def amount(self, items, subtotal):
+        """The discount on ``items``; raises DiscountError if it doesn't apply."""
+        if not self.active:
+            raise DiscountError('This discount code is inactive.')
+        if self.expires_at and datetime.utcnow() > self.expires_at:
+            raise DiscountError('This discount code has expired.')
+        if self.id in _state['exhausted']:
+            raise DiscountError('This discount code has reached its usage limit.')
+        if subtotal < self.min_order:
+            raise DiscountError(f'Minimum order of Rs{self.min_order:.0f} required.')
+        applies = _scopes[self.scope]
+        eligible = sum(i.subtotal for i in items if applies(self, i))
+        if not eligible:
+            raise DiscountError("This code doesn't apply to anything in your cart.")
+        rate = self.rate(eligible)
+        if self.percent:
+            return round(eligible * rate / 100, 2)
+        return min(rate, eligible)
+
+
+# ── Cached map ───────────────────────────────────────────────────────────────
+_lock = threading.Lock()
+_state = {'version': None, 'rules': {}, 'exhausted': set()}
+
+
+def rules():
+    version = catalogue.current_version(catalogue.DISCOUNTS)
+    if _state['version'] != version:
+        with _lock:
+            if _state['version'] != version:
+                _state['rules'] = {d.code: DiscountRule(d) for d in Discount.query.all()}
+                _state['exhausted'] = set()
+                _state['version'] = version
+    return _state['rules']
+
+
+def lookup(code):
+    return rules().get((code or '').strip().upper())
+
+
+def evaluate(code, items, subtotal, check_usage=False):
+    """
+    ``(rule, amount)`` for ``code`` on ``items``; raises DiscountError.
+    ``check_usage`` also counts the code's redemptions (one query).
+    """
+    rule = lookup(code)
+    if rule is None:
+        raise DiscountError('Invalid discount code.')
+    amount = rule.amount(items, subtotal)
+    if check_usage and rule.max_uses is not None and \
+            usage([rule.id]).get(rule.id, 0) >= rule.max_uses:
+        _state['exhausted'].add(rule.id)
+        raise DiscountError('This discount code has reached its usage limit.')
+    return rule, amount
+
+
+# ── Redemption ───────────────────────────────────────────────────────────────
+def _shares(max_uses, shards):
+    base, extra = divmod(max_uses, shards)
+    return [base + (1 if n < extra else 0) for n in range(shards)]
+
+
+def _count_use(rule):
+    shards = current_app.config.get('DISCOUNT_USAGE_SHARDS', 8)
+    stmt = upsert_insert(DiscountUsage)
+    if rule.max_uses is None:
+        row = stmt.values(discount_id=rule.id, shard=random.randrange(shards), used=1)
+        db.session.execute(row.on_conflict_do_update(
+            index_elements=['discount_id', 'shard'], set_={'used': DiscountUsage.used + 1}))
+        return True
+    shares = _shares(rule.max_uses, shards)
+    order = [n for n in range(shards) if shares[n]]
+    random.shuffle(order)
+    for n in order:
+        row = stmt.values(discount_id=rule.id, shard=n, used=1)
+        result = db.session.execute(row.on_conflict_do_update(
+            index_elements=['discount_id', 'shard'], set_={'used': DiscountUsage.used + 1},
+            where=DiscountUsage.used < shares[n]))
+        if result.rowcount:
+            return True
+    return False
+
+
+def redeem(rule, user_id):
+    """
+    Count one use of ``rule`` by ``user_id`` in the caller's transaction.
+    Raises DiscountError when a limit has been reached; the caller should
+    roll back.
+    """
+    if rule.per_user_limit is not None:
+        row = upsert_insert(DiscountUserUsage).values(discount_id=rule.id, user_id=user_id, used=1)
+        result = db.session.execute(row.on_conflict_do_update(
+            index_elements=['discount_id', 'user_id'], set_={'used': DiscountUserUsage.used + 1},
+            where=DiscountUserUsage.used < rule.per_user_limit))
+        if rule.per_user_limit < 1 or not result.rowcount:
+            raise DiscountError("You've already used this discount code.")
+    if not _count_use(rule):
+        _state['exhausted'].add(rule.id)
+        raise DiscountError('This discount code has reached its usage limit.')
+
+
+def usage(discount_ids):
+    """``{discount_id: times used}``."""
+    if not discount_ids:
+        return {}
+    rows = db.session.query(DiscountUsage.discount_id, db.func.sum(DiscountUsage.used))\
+        .filter(DiscountUsage.discount_id.in_(discount_ids))\
+        .group_by(DiscountUsage.discount_id)
+    return {did: int(used) for did, used in rows}
@@ -0,0 +1,154 @@
+"""
+Database engine profiles.
+
+``DB_PROFILE`` picks how engines are configured:
+
+- ``default``     SQLAlchemy's defaults (what the app used originally)
+- ``production``  SQLite: WAL journal, busy_timeout, synchronous=NORMAL,
+                  mmap and page cache sizes, applied on every new connection.
+                  Server databases: a sized pool with pre-ping and recycle.
+
+``report()`` returns the settings a live connection actually ended up with,
+and ``benchmark()`` measures concurrent write throughput for a profile on a
+scratch SQLite file (see ``flask engine report`` / ``flask engine bench``).
+"""
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+PROFILES = ('default', 'production')
+
+
+def is_sqlite(uri):
+    return uri.startswith('sqlite')
+
+
+def engine_options(config, uri=None, profile=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``uri`` under ``profile``."""
+    uri = uri or config['SQLALCHEMY_DATABASE_URI']
+    profile = profile or config.get('DB_PROFILE', 'default')
+    if profile == 'default':
+        return {}
+    if is_sqlite(uri):
+        # busy waiting is handled by PRAGMA busy_timeout in the connect hook
+        return {'connect_args': {'timeout': config.get('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}}
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_pragmas(config, profile=None):
+    profile = profile or config.get('DB_PROFILE', 'default')
+    if profile == 'default':
+        return {}
+    return {
+        'journal_mode': 'WAL',
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'synchronous': 'NORMAL',
+        'mmap_size': config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': -config.get('SQLITE_CACHE_SIZE_KB', 64000),  # negative = KiB
+        'temp_store': 'MEMORY',
+    }
+
+
+def install_pragmas(engine, pragmas):
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _apply(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def init_app(app, db):
+    """Apply the profile's connect hooks to every engine the app uses."""
+    with app.app_context():
+        for engine in db.engines.values():
+            install_pragmas(engine, sqlite_pragmas(app.config))
+
+
+def report(engine):
+    """The settings in effect on a fresh connection from ``engine``."""
+    out = {'url': engine.url.render_as_string(hide_password=True),
+           'pool': type(engine.pool).__name__}
+    if hasattr(engine.pool, 'size'):
+        out['pool_size'] = engine.pool.size()
+        out['pool_max_overflow'] = engine.pool._max_overflow
+        out['pool_timeout'] = engine.pool.timeout()
+    out['pool_recycle'] = engine.pool._recycle
+    out['pool_pre_ping'] = engine.pool._pre_ping
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            for name in ('journal_mode', 'busy_timeout', 'synchronous',
+                         'mmap_size', 'cache_size', 'temp_store'):
+                out[name] = conn.execute(text(f'PRAGMA {name}')).scalar()
+    return out
+
+
+def benchmark(config, profile, writers=4, seconds=5.0):
+    """
+    Concurrent write throughput for ``profile`` on a scratch SQLite file.
+
+    Each writer thread loops over short read-then-write transactions (the
+    shape of a checkout) on its own connection. Returns commits/s and the
+    number of "database is locked" failures.
+    """
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='engine-bench-')
+    os.close(fd)
+    uri = f'sqlite:///{path}'
+    engine = create_engine(uri, **engine_options(config, uri, profile))
+    install_pragmas(engine, sqlite_pragmas(config, profile))
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE stock (id INTEGER PRIMARY KEY, qty INTEGER)'))
+        conn.execute(text('CREATE TABLE orders (id INTEGER PRIMARY KEY, product_id INTEGER, '
+                          'payload TEXT, created_at REAL)'))
+        conn.execute(text('INSERT INTO stock (id, qty) VALUES (1, 1000000)'))
+
+    counts = {'commits': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def writer():
+        commits = locked = 0
+        with engine.connect() as conn:
+            while time.monotonic() < deadline:
+                try:
+                    with conn.begin():
+                        conn.execute(text('SELECT qty FROM stock WHERE id = 1')).scalar()
+                        conn.execute(text('INSERT INTO orders (product_id, payload, created_at) '
+                                          'VALUES (1, :p, :t)'), {'p': 'x' * 200, 't': time.time()})
+                        conn.execute(text('UPDATE stock SET qty = qty - 1 WHERE id = 1'))
+                    commits += 1
+                except OperationalError as e:
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        raise
+                    locked += 1
+        with lock:
+            counts['commits'] += commits
+            counts['locked'] += locked
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    engine.dispose()
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return {'profile': profile, 'writers': writers, 'seconds': round(elapsed, 2),
+            'commits': counts['commits'], 'commits_per_sec': round(counts['commits'] / elapsed, 1),
+            'locked_errors': counts['locked']}
@@ -0,0 +1,255 @@
+"""
+Faceted filtering for the shop listing.
+
+The index holds, per worker, one bitmap (a Python int) per facet value over
+the active products. A product's bit position is its rank in the chosen
+sort order, so there is one set of bitmaps per sort ("universe"): filtering
+is a handful of ``&``/``|`` operations, counts are ``int.bit_count()``, and
+a page of results is read straight off the low bits in display order.
+
+The index is built from the catalogue snapshot and rebuilt whenever the
+snapshot is replaced (a catalogue version change or the snapshot's age
+limit), so its records are always the snapshot's own.
+"""
+import bisect
+import re
+import threading
+
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+
+from app import snapshot
+
+SORTS = {
+    'newest': lambda p: (-p.created_at.timestamp() if p.created_at else 0, -p.id),
+    'price_asc': lambda p: (p.price, p.id),
+    'price_desc': lambda p: (-p.price, p.id),
+    'name': lambda p: ((p.name or '').lower(), p.id),
+}
+
+# Facet key -> label, in display order
+FACETS = {
+    'category': 'Category',
+    'material': 'Material',
+    'gemstone': 'Gemstone',
+    'price': 'Price',
+    'sale': 'Offers',
+    'badge': 'Collection',
+}
+
+# Options shown per facet (selected values are always shown)
+MAX_OPTIONS = 12
+
+
+def _clean(text):
+    return re.sub(r'\s*\(.*?\)', '', text or '').strip()
+
+
+def _price_bands():
+    bounds = current_app.config.get('SHOP_PRICE_BANDS', (1000, 2500, 5000))
+    bands = []
+    lower = 0
+    for upper in bounds:
+        bands.append((f'{lower}-{upper}', f'Rs. {lower:,} – {upper:,}' if lower else f'Under Rs. {upper:,}'))
+        lower = upper
+    bands.append((f'{lower}-', f'Rs. {lower:,} and above'))
+    return bounds, bands
+
+
+def _bitmap(positions, size):
+    buf = bytearray((size + 7) // 8)
+    for pos in positions:
+        buf[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _iter_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _nth_bit(bits, n):
+    """Position of the n-th (0-based) set bit, by binary search on prefix counts."""
+    lo, hi = 0, bits.bit_length()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if (bits & ((1 << (mid + 1)) - 1)).bit_count() > n:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class _Universe:
+    __slots__ = ('ids', 'position', 'all', 'bitmaps')
+
+    def __init__(self, ids, values):
+        self.ids = ids
+        self.position = {pid: pos for pos, pid in enumerate(ids)}
+        self.all = (1 << len(ids)) - 1
+        self.bitmaps = {
+            facet: {value: _bitmap((self.position[pid] for pid in pids), len(ids))
+                    for value, pids in by_value.items()}
+            for facet, by_value in values.items()
+        }
+
+    def restrict(self, product_ids):
+        return _bitmap((self.position[pid] for pid in product_ids if pid in self.position),
+                       len(self.ids))
+
+
+class FacetResult:
+    __slots__ = ('universe', 'bits', 'counts', 'total')
+
+    def __init__(self, universe, bits, counts):
+        self.universe = universe
+        self.bits = bits
+        self.counts = counts
+        self.total = bits.bit_count()
+
+    def page_ids(self, offset, limit):
+        bits = self.bits
+        if offset:
+            if offset >= self.total:
+                return []
+            start = _nth_bit(bits, offset)
+            bits = (bits >> start) << start
+        ids = []
+        for pos in _iter_bits(bits):
+            ids.append(self.universe.ids[pos])
+            if len(ids) == limit:
+                break
+        return ids
+
+    @property
+    def ids(self):
+        return [self.universe.ids[pos] for pos in _iter_bits(self.bits)]
+
+
+class FacetIndex:
+    def __init__(self, snap):
+        self.version = snap.version
+        self.snapshot = snap
+        rows = snap.products
+        bounds, self.price_bands = _price_bands()
+
+        values = {facet: {} for facet in FACETS}
+        labels = {facet: {} for facet in FACETS}
+
+        def add(facet, value, label, pid):
+            if value:
+                values[facet].setdefault(value, []).append(pid)
+                labels[facet].setdefault(value, label)
+
+        for r in rows:
+            if r.category is not None:
+                add('category', r.category.slug, r.category.name, r.id)
+            material = _clean(r.material)
+            add('material', material.lower(), material, r.id)
+            gemstone = _clean(r.gemstone)
+            add('gemstone', gemstone.lower(), gemstone, r.id)
+            band = bisect.bisect_right(bounds, r.price or 0)
+            add('price', self.price_bands[band][0], self.price_bands[band][1], r.id)
+            if r.original_price is not None and r.original_price > r.price:
+                add('sale', '1', 'On Sale', r.id)
+            add('badge', (r.badge or '').strip().lower(), (r.badge or '').strip(), r.id)
+
+        self.labels = labels
+        self.universes = {
+            sort: _Universe([r.id for r in sorted(rows, key=key)], values)
+            for sort, key in SORTS.items()
+        }
+
+    def search(self, selected, sort='newest', restrict_ids=None):
+        """
+        Filter by ``selected`` ({facet: set(values)}) and count every facet value.
+
+        Values within a facet are OR'd, facets are AND'd. Each facet's counts
+        are computed with every *other* facet applied, so sibling options stay
+        visible with the number of results they would give.
+        """
+        universe = self.universes.get(sort) or self.universes['newest']
+        base = universe.all
+        if restrict_ids is not None:
+            base &= universe.restrict(restrict_ids)
+
+        masks = {}
+        for facet, chosen in selected.items():
+            bitmaps = universe.bitmaps.get(facet)
+            if bitmaps is None or not chosen:
+                continue
+            mask = 0
+            for value in chosen:
+                mask |= bitmaps.get(value, 0)
+            masks[facet] = mask
+
+        bits = base
+        for mask in masks.values():
+            bits &= mask
+
+        counts = {}
+        for facet, bitmaps in universe.bitmaps.items():
+            others = base
+            for other, mask in masks.items():
+                if other != facet:
+                    others &= mask
+            counts[facet] = {value: (others & bm).bit_count() for value, bm in bitmaps.items()}
+        return FacetResult(universe, bits, counts)
+
+    def options(self, result, selected):
+        """Facet options for the template: [(facet, label, [(value, label, count, active)])]."""
+        out = []
+        for facet, facet_label in FACETS.items():
+            counts = result.counts.get(facet, {})
+            chosen = selected.get(facet, set())
+            if facet == 'price':
+                order = [key for key, _ in self.price_bands if key in counts]
+            else:
+                order = sorted(counts, key=lambda v: (-counts[v], self.labels[facet][v].lower()))
+            order = [v for v in order if counts[v] or v in chosen]
+            order = order[:MAX_OPTIONS] + [v for v in order[MAX_OPTIONS:] if v in chosen]
+            opts = [(v, self.labels[facet][v], counts[v], v in chosen) for v in order]
+            if opts:
+                out.append((facet, facet_label, opts))
+        return out
+
+
+_index = {'current': None}
+_build_lock = threading.Lock()
+
+
+def get_index():
+    """The worker's facet index, rebuilt if the snapshot has been replaced."""
+    snap = snapshot.get()
+    index = _index['current']
+    if index is None or index.snapshot is not snap:
+        with _build_lock:
+            index = _index['current']
+            if index is None or index.snapshot is not snap:
+                index = FacetIndex(snap)
+                _index['current'] = index
+    return index
+
+
+def parse_filters(args):
+    """Read facet selections from request args (repeated keys select several values)."""
+    selected = {}
+    for facet in FACETS:
+        chosen = {v.strip().lower() for v in args.getlist(facet) if v.strip()}
+        if chosen:
+            selected[facet] = chosen
+    return selected
+
+
+class FacetPagination(Pagination):
+    """Pagination over a FacetResult; items are snapshot product records."""
+
+    def _query_items(self):
+        result = self._query_args['result']
+        by_id = self._query_args['index'].snapshot.by_id
+        return [by_id[i] for i in result.page_ids(self._query_offset, self.per_page)]
+
+    def _query_count(self):
+        return self._query_args['result'].total
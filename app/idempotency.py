@@ -0,0 +1,97 @@
+"""
+Idempotent checkout submissions.
+
+The checkout page carries a random key. The first POST with that key
+claims it (an INSERT that only one request can win) and records the
+resulting order number in the order's own transaction. A repeated POST,
+from a double click or a retried request, finds the key and redirects to
+the original confirmation without doing any of the work again; if the
+first request is still running it waits briefly for its result.
+
+Keys are deleted ``CHECKOUT_KEY_TTL`` seconds after they were claimed by a
+periodic compaction (``flask checkout compact-keys``, or every
+``CHECKOUT_KEY_COMPACT_INTERVAL`` seconds in the background).
+"""
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.dbutil import upsert_insert
+from app.models import db, CheckoutKey
+
+# how long a repeat waits for the first submission to finish
+WAIT_SECONDS = 5.0
+POLL_SECONDS = 0.1
+
+
+def issue():
+    return secrets.token_urlsafe(24)
+
+
+def claim(key, user_id):
+    """
+    Claim ``key`` for ``user_id``. Returns ``(True, None)`` when this request
+    should place the order, or ``(False, order_number)`` for a repeat;
+    ``order_number`` is None if the first request hasn't finished in time.
+    """
+    stmt = upsert_insert(CheckoutKey).values(key=key, user_id=user_id, created_at=datetime.utcnow())
+    won = db.session.execute(stmt.on_conflict_do_nothing(index_elements=['key'])).rowcount == 1
+    db.session.commit()
+    if won:
+        return True, None
+    deadline = time.monotonic() + WAIT_SECONDS
+    while True:
+        order_number = db.session.query(CheckoutKey.order_number)\
+            .filter_by(key=key, user_id=user_id).scalar()
+        db.session.commit()
+        if order_number or time.monotonic() >= deadline:
+            return False, order_number
+        time.sleep(POLL_SECONDS)
+
+
+def record(key, order_number):
+    """Attach the order to its key, inside the order's transaction."""
+    db.session.execute(db.update(CheckoutKey).where(CheckoutKey.key == key)
+                       .values(order_number=order_number))
+
+
+def release(key):
+    """Give up a claim whose order was not placed, so the key can be retried."""
+    db.session.rollback()
+    db.session.execute(db.delete(CheckoutKey).where(CheckoutKey.key == key,
+                                                    CheckoutKey.order_number.is_(None)))
+    db.session.commit()
+
+
+def compact():
+    """Delete keys older than CHECKOUT_KEY_TTL; returns how many."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('CHECKOUT_KEY_TTL', 86400))
+    removed = db.session.execute(db.delete(CheckoutKey).where(CheckoutKey.created_at < cutoff)).rowcount
+    db.session.commit()
+    return removed
+
+
+_compactor = {'pid': None}
+
+
+def start_compactor(app):
+    """Run ``compact`` every CHECKOUT_KEY_COMPACT_INTERVAL seconds in this process."""
+    interval = app.config.get('CHECKOUT_KEY_COMPACT_INTERVAL', 0)
+    if not interval or _compactor['pid'] == os.getpid():
+        return
+    _compactor['pid'] = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    compact()
+            except Exception as e:
+                app.logger.warning('Checkout key compaction failed: %s', e)
+
+    threading.Thread(target=loop, name='checkout-key-compactor', daemon=True).start()
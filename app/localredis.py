@@ -0,0 +1,97 @@
+"""
+In-process stand-in for the subset of the redis-py client the app uses.
+
+Lets the Redis-backed code paths run (and be exercised locally) without a
+Redis server: select it with a ``local://`` URL wherever a Redis URL is
+configured. State lives in this process only, so it is not a substitute
+for a real server across workers.
+"""
+import threading
+import time
+
+
+class LocalRedis:
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _alive(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key) if self._alive(key) else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            if isinstance(value, str):
+                value = value.encode()
+            self._data[key] = value
+            if ex is not None:
+                self._expires[key] = time.time() + ex
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def setex(self, key, ex, value):
+        return self.set(key, value, ex=ex)
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._alive(key):
+                    removed += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return removed
+
+    def exists(self, key):
+        with self._lock:
+            return int(self._alive(key))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if not self._alive(key):
+                return False
+            self._expires[key] = time.time() + seconds
+            return True
+
+    def ttl(self, key):
+        with self._lock:
+            if not self._alive(key):
+                return -2
+            expires = self._expires.get(key)
+            return -1 if expires is None else max(0, int(expires - time.time()))
+
+    def incrby(self, key, amount=1):
+        with self._lock:
+            value = int(self._data[key]) + amount if self._alive(key) else amount
+            self._data[key] = str(value).encode()
+            return value
+
+    def incr(self, key, amount=1):
+        return self.incrby(key, amount)
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+
+_shared = {}
+
+
+def from_url(url):
+    """A redis client for ``url``; ``local://name`` gives a shared in-process stand-in."""
+    if url.startswith('local://'):
+        return _shared.setdefault(url, LocalRedis())
+    import redis  # optional dependency, only needed for a real server
+    return redis.Redis.from_url(url)
@@ -1,6 +1,7 @@
 from datetime import datetime
-from app import db, login_manager, bcrypt
+from app import db, login_manager, passwords
 from flask_login import UserMixin
+from sqlalchemy.orm import declared_attr
 
 
 @login_manager.user_loader
@@ -24,6 +25,7 @@ class User(db.Model, UserMixin):
     country = db.Column(db.String(100), default='United Kingdom')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    wishlist_version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every wishlist change
 
     orders = db.relationship('Order', backref='customer', lazy=True)
     reviews = db.relationship('Review', backref='author', lazy=True)
@@ -31,10 +33,10 @@ class User(db.Model, UserMixin):
     cart_items = db.relationship('CartItem', backref='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return passwords.check_password(self.password_hash, password)
 
     @property
     def full_name(self):
@@ -65,7 +67,29 @@ class Category(db.Model):
         return f'<Category {self.name}>'
 
 
-class Product(db.Model):
+class ProductDisplayMixin:
+    """Display helpers shared by Product and its in-memory snapshot record."""
+    __slots__ = ()
+
+    @property
+    def is_on_sale(self):
+        return self.original_price is not None and self.original_price > self.price
+
+    @property
+    def discount_percent(self):
+        if self.is_on_sale:
+            return int((1 - self.price / self.original_price) * 100)
+        return 0
+
+    @property
+    def star_display(self):
+        full = int(self.average_rating)
+        half = 1 if self.average_rating - full >= 0.5 else 0
+        empty = 5 - full - half
+        return '★' * full + '☆' * half + '☆' * empty
+
+
+class Product(ProductDisplayMixin, db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -75,6 +99,7 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     original_price = db.Column(db.Float)       # For sale items
     stock = db.Column(db.Integer, default=0)
+    reserved = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # units under checkout holds
     sku = db.Column(db.String(80))
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     image_filename = db.Column(db.String(200))  # main image
@@ -91,6 +116,7 @@ class Product(db.Model):
 
     gallery_images = db.relationship('ProductImage', backref='product', lazy=True, cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='product', lazy=True)
+    review_stats = db.relationship('ProductReviewStats', uselist=False, lazy=True)
     cart_items = db.relationship('CartItem', backref='product', lazy=True)
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
     wishlist_entries = db.relationship('Wishlist', backref='product', lazy=True)
@@ -103,37 +129,50 @@ class Product(db.Model):
         return images
     @property
     def average_rating(self):
-        if not self.reviews:
-            return 0
-        return round(sum(r.rating for r in self.reviews) / len(self.reviews), 1)
+        return self.review_stats.average_rating if self.review_stats else 0
 
     @property
     def review_count(self):
-        return len(self.reviews)
+        return self.review_stats.review_count if self.review_stats else 0
 
     @property
-    def is_on_sale(self):
-        return self.original_price is not None and self.original_price > self.price
+    def available(self):
+        """Units neither sold nor held by a shopper at checkout."""
+        return max(0, (self.stock or 0) - (self.reserved or 0))
 
-    @property
-    def discount_percent(self):
-        if self.is_on_sale:
-            return int((1 - self.price / self.original_price) * 100)
-        return 0
+    def __repr__(self):
+        return f'<Product {self.name}>'
 
-    @property
-    def star_display(self):
-        full = int(self.average_rating)
-        half = 1 if self.average_rating - full >= 0.5 else 0
-        empty = 5 - full - half
-        return '★' * full + '☆' * half + '☆' * empty
+
+class ProductSlugRedirect(db.Model):
+    __tablename__ = 'product_slug_redirects'
+    id = db.Column(db.Integer, primary_key=True)
+    old_slug = db.Column(db.String(220), unique=True, nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
-        return f'<Product {self.name}>'
+        return f'<ProductSlugRedirect {self.old_slug} -> {self.product_id}>'
+
+
+class ProductRecommendation(db.Model):
+    __tablename__ = 'product_recommendations'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)      # 0 = closest neighbour
+    score = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    related = db.relationship('Product', foreign_keys=[related_id])
+
+    def __repr__(self):
+        return f'<ProductRecommendation {self.product_id} -> {self.related_id}>'
 
 
 class CartItem(db.Model):
     __tablename__ = 'cart_items'
+    __table_args__ = (db.UniqueConstraint('user_id', 'product_id', name='uq_cart_items_user_product'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -145,8 +184,21 @@ class CartItem(db.Model):
         return self.product.price * self.quantity
 
 
+class StockHold(db.Model):
+    """Units held for a shopper while they check out; see app.reservations."""
+    __tablename__ = 'stock_holds'
+    __table_args__ = (db.UniqueConstraint('user_id', 'product_id', name='uq_stock_holds_user_product'),)
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Wishlist(db.Model):
     __tablename__ = 'wishlist'
+    __table_args__ = (db.UniqueConstraint('user_id', 'product_id', name='uq_wishlist_user_product'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -162,41 +214,52 @@ class Discount(db.Model):
     value = db.Column(db.Float, nullable=False)              # e.g. 10 for 10% or Rs10 off
     min_order_amount = db.Column(db.Float, default=0)
     max_uses = db.Column(db.Integer)                         # None = unlimited
-    used_count = db.Column(db.Integer, default=0)
+    per_user_limit = db.Column(db.Integer)                   # None = unlimited
+    scope = db.Column(db.String(20), default='order')       # 'order', 'category' or 'product'
+    scope_ids = db.Column(db.String(500))                    # comma-separated category/product ids
+    tiers = db.Column(db.Text)                               # JSON [[min_subtotal, value], ...]
     is_active = db.Column(db.Boolean, default=True)
     expires_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    def is_valid(self, order_total):
-        if not self.is_active:
-            return False, 'This discount code is inactive.'
-        if self.expires_at and datetime.utcnow() > self.expires_at:
-            return False, 'This discount code has expired.'
-        if self.max_uses and self.used_count >= self.max_uses:
-            return False, 'This discount code has reached its usage limit.'
-        if order_total < self.min_order_amount:
-            return False, f'Minimum order of Rs{self.min_order_amount:.0f} required.'
-        return True, ''
-
-    def apply(self, order_total):
-        if self.discount_type in ['percent', 'percentage']:
-            return round(order_total * self.value / 100, 2)
-        return min(self.value, order_total)
+    usage_shards = db.relationship('DiscountUsage', lazy=True, cascade='all, delete-orphan')
+    user_usage = db.relationship('DiscountUserUsage', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Discount {self.code}>'
 
 
-class Order(db.Model):
-    __tablename__ = 'orders'
+class DiscountUsage(db.Model):
+    """One of a code's redemption counters; see app/discounts.py."""
+    __tablename__ = 'discount_usage'
+    discount_id = db.Column(db.Integer, db.ForeignKey('discounts.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    used = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DiscountUserUsage(db.Model):
+    __tablename__ = 'discount_user_usage'
+    discount_id = db.Column(db.Integer, db.ForeignKey('discounts.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, autoincrement=False)
+    used = db.Column(db.Integer, nullable=False, default=0)
+
+
+class OrderColumns:
+    """Columns shared by ``orders`` and ``orders_archive`` (see app/archive.py)."""
+    archived = False
+
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(20), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    @declared_attr
+    def user_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
     status = db.Column(db.String(30), default='pending')  # pending/confirmed/shipped/delivered/cancelled
     subtotal = db.Column(db.Float, nullable=False)
     shipping_cost = db.Column(db.Float, default=0)
     discount_amount = db.Column(db.Float, default=0)
     total = db.Column(db.Float, nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0)  # order lines, set at checkout
     discount_code = db.Column(db.String(50))
     # Shipping address snapshot
     shipping_name = db.Column(db.String(160))
@@ -214,8 +277,6 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    items = db.relationship('OrderItem', backref='order', lazy=True)
-
     @property
     def status_badge_class(self):
         return {
@@ -230,18 +291,101 @@ class Order(db.Model):
         return f'<Order {self.order_number}>'
 
 
-class OrderItem(db.Model):
-    __tablename__ = 'order_items'
+class Order(OrderColumns, db.Model):
+    __tablename__ = 'orders'
+    # ids are never reused, so they stay unique across the archive too
+    __table_args__ = (db.Index('ix_orders_user_created', 'user_id', 'created_at'),
+                      {'sqlite_autoincrement': True})
+
+    items = db.relationship('OrderItem', backref='order', lazy=True)
+
+
+class ArchivedOrder(OrderColumns, db.Model):
+    """A delivered or cancelled order moved out of ``orders``; read-only."""
+    __tablename__ = 'orders_archive'
+    __table_args__ = (db.Index('ix_orders_archive_user_created', 'user_id', 'created_at'),)
+    archived = True
+
+    items = db.relationship('ArchivedOrderItem', backref='order', lazy=True)
+
+
+class OrderItemColumns:
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+
+    @declared_attr
+    def product_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)   # price at time of order
     subtotal = db.Column(db.Float, nullable=False)
 
 
+class OrderItem(OrderItemColumns, db.Model):
+    __tablename__ = 'order_items'
+    __table_args__ = {'sqlite_autoincrement': True}
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+
+
+class ArchivedOrderItem(OrderItemColumns, db.Model):
+    __tablename__ = 'order_items_archive'
+    order_id = db.Column(db.Integer, db.ForeignKey('orders_archive.id'), nullable=False, index=True)
+    product = db.relationship('Product', lazy=True)
+
+
+class OrderArchiveTotals(db.Model):
+    """Running totals of the archived orders, so counts and revenue don't scan them."""
+    __tablename__ = 'order_archive_totals'
+    id = db.Column(db.Integer, primary_key=True)  # always 1
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    paid_revenue = db.Column(db.Float, nullable=False, default=0)
+
+
+class CheckoutKey(db.Model):
+    """Idempotency key of a checkout submission; see app.idempotency."""
+    __tablename__ = 'checkout_keys'
+    key = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    order_number = db.Column(db.String(20))  # None while the first submission runs
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class OutboxEvent(db.Model):
+    """A side effect to run after the transaction that wrote it; see app.outbox."""
+    __tablename__ = 'outbox_events'
+    __table_args__ = (db.Index('ix_outbox_events_due', 'status', 'available_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(80), nullable=False)
+    idempotency_key = db.Column(db.String(200), unique=True, nullable=False)
+    payload = db.Column(db.Text, nullable=False)       # JSON
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending/processing/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.kind} {self.idempotency_key} {self.status}>'
+
+
+class SalesDaily(db.Model):
+    """Per-day order rollup, maintained from the outbox."""
+    __tablename__ = 'sales_daily'
+    day = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+
 class Review(db.Model):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        # keyset pagination on the product page (app.reviews.page)
+        db.Index('ix_reviews_product_newest', 'product_id', 'created_at', 'id'),
+        db.Index('ix_reviews_product_helpful', 'product_id', 'helpful_count', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -250,12 +394,48 @@ class Review(db.Model):
     body = db.Column(db.Text)
     is_verified = db.Column(db.Boolean, default=False)
     is_approved = db.Column(db.Boolean, default=True)
+    helpful_count = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    helpful_votes = db.relationship('ReviewHelpfulVote', backref='review', lazy=True,
+                                    cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Review {self.id} Product {self.product_id}>'
 
 
+class ReviewHelpfulVote(db.Model):
+    __tablename__ = 'review_helpful_votes'
+    __table_args__ = (db.UniqueConstraint('review_id', 'user_id', name='uq_review_helpful_votes'),)
+    id = db.Column(db.Integer, primary_key=True)
+    review_id = db.Column(db.Integer, db.ForeignKey('reviews.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ProductReviewStats(db.Model):
+    """Approved-review aggregates per product, kept current by app.reviews."""
+    __tablename__ = 'product_review_stats'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_total = db.Column(db.Integer, nullable=False, default=0)
+    stars_1 = db.Column(db.Integer, nullable=False, default=0)
+    stars_2 = db.Column(db.Integer, nullable=False, default=0)
+    stars_3 = db.Column(db.Integer, nullable=False, default=0)
+    stars_4 = db.Column(db.Integer, nullable=False, default=0)
+    stars_5 = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every change
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def average_rating(self):
+        return round(self.rating_total / self.review_count, 1) if self.review_count else 0
+
+    @property
+    def histogram(self):
+        """{5: n, 4: n, ..., 1: n}"""
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(5, 0, -1)}
+
+
 class Newsletter(db.Model):
     __tablename__ = 'newsletter'
     id = db.Column(db.Integer, primary_key=True)
@@ -273,8 +453,9 @@ class SiteSettings(db.Model):
 
     @staticmethod
     def get(key, default=None):
-        s = SiteSettings.query.filter_by(key=key).first()
-        return s.value if s else default
+        from app import snapshot  # snapshot imports this module
+        value = snapshot.get().settings.get(key)
+        return value if value is not None else default
 
     @staticmethod
     def set(key, value):
@@ -301,6 +482,13 @@ class NavigationItem(db.Model):
         return f'<NavigationItem {self.label}>'
 
 
+class CatalogueVersion(db.Model):
+    __tablename__ = 'catalogue_version'
+    id = db.Column(db.Integer, primary_key=True)       # 1 = catalogue, 2 = discounts
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class ProductImage(db.Model):
     __tablename__ = 'product_images'
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,56 @@
+"""
+Outbox handlers for ``order.placed``, enqueued by ``cart.checkout``.
+
+- render the confirmation email into ``OUTBOX_MAIL_DIR`` (one file per
+  order, rewritten if the event is retried)
+- add the order to the ``sales_daily`` rollup
+- bump the catalogue version when the order sold out a product, so
+  listings everywhere mark it
+"""
+import os
+
+from flask import current_app
+
+from app import catalogue, outbox
+from app.dbutil import upsert_insert
+from app.models import db, Order, Product, SalesDaily
+
+
+def mail_dir():
+    return current_app.config.get('OUTBOX_MAIL_DIR') or os.path.join(current_app.instance_path, 'mail')
+
+
+@outbox.handler('order.placed')
+def render_confirmation(payload, key):
+    order = db.session.get(Order, payload['order_id'])
+    html = current_app.jinja_env.get_template('emails/order_confirmation.html').render(order=order)
+    directory = mail_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{order.order_number}.html')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(tmp, path)
+
+
+@outbox.handler('order.placed')
+def roll_up_sales(payload, key):
+    order = db.session.get(Order, payload['order_id'])
+    units = sum(i.quantity for i in order.items)
+    stmt = upsert_insert(SalesDaily).values(day=order.created_at.date(), order_count=1,
+                                            units=units, revenue=order.total)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['day'],
+        set_={'order_count': SalesDaily.order_count + 1,
+              'units': SalesDaily.units + units,
+              'revenue': SalesDaily.revenue + order.total}))
+
+
+@outbox.handler('order.placed')
+def refresh_sold_out(payload, key):
+    order = db.session.get(Order, payload['order_id'])
+    product_ids = [i.product_id for i in order.items]
+    sold_out = db.session.query(Product.id).filter(Product.id.in_(product_ids),
+                                                   Product.stock <= 0).first()
+    if sold_out is not None:
+        catalogue.bump(db.session)
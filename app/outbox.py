@@ -0,0 +1,158 @@
+"""
+Transactional outbox.
+
+Requests record side effects with ``enqueue()`` in the same transaction as
+the data they describe (an order and its ``order.placed`` event commit or
+roll back together). A worker thread in each process drains due events and
+runs the handlers registered for their kind with ``@handler``.
+
+- Every event has an idempotency key; enqueueing the same key twice is a
+  no-op.
+- An event is claimed with a conditional UPDATE, so two workers never run
+  it at once. A claim older than ``OUTBOX_CLAIM_TIMEOUT`` (a worker that
+  died mid-event) is picked up again.
+- Handlers run in one transaction that also marks the event done, so their
+  database writes happen exactly once. Anything outside the database
+  (files, mail) must be safe to repeat.
+- A failing event is retried with exponential backoff from
+  ``OUTBOX_RETRY_BASE`` and marked ``failed`` after ``OUTBOX_MAX_ATTEMPTS``.
+
+``notify()`` wakes this process's worker straight after a commit; otherwise
+it polls every ``OUTBOX_POLL_INTERVAL`` seconds. ``flask outbox drain``
+processes due events from the command line.
+"""
+import json
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app.dbutil import upsert_insert
+from app.models import db, OutboxEvent
+
+BATCH_SIZE = 50
+
+_handlers = {}
+
+
+def handler(kind):
+    """Register ``fn(payload, key)`` to run for every ``kind`` event."""
+    def register(fn):
+        _handlers.setdefault(kind, []).append(fn)
+        return fn
+    return register
+
+
+def enqueue(kind, payload, key):
+    """Add an event to the current transaction; a repeated ``key`` is ignored."""
+    stmt = upsert_insert(OutboxEvent).values(
+        kind=kind, idempotency_key=key, payload=json.dumps(payload),
+        status='pending', attempts=0, available_at=datetime.utcnow(), created_at=datetime.utcnow())
+    db.session.execute(stmt.on_conflict_do_nothing(index_elements=['idempotency_key']))
+
+
+def _claim(event_id, now, stale_before):
+    table = OutboxEvent.__table__
+    stmt = (table.update()
+            .where(table.c.id == event_id,
+                   or_(table.c.status == 'pending',
+                       (table.c.status == 'processing') & (table.c.claimed_at < stale_before)))
+            .values(status='processing', claimed_at=now, attempts=table.c.attempts + 1))
+    claimed = db.session.execute(stmt).rowcount == 1
+    db.session.commit()
+    return claimed
+
+
+def _process(event):
+    config = current_app.config
+    payload = json.loads(event.payload)
+    try:
+        for fn in _handlers.get(event.kind, ()):
+            fn(payload, event.idempotency_key)
+        event.status = 'done'
+        event.processed_at = datetime.utcnow()
+        event.last_error = None
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)
+        current_app.logger.warning('Outbox event %s (%s) failed: %s',
+                                   event.idempotency_key, event.kind, error.strip().splitlines()[-1])
+        event = db.session.get(OutboxEvent, event.id)
+        if event.attempts >= config.get('OUTBOX_MAX_ATTEMPTS', 8):
+            event.status = 'failed'
+        else:
+            event.status = 'pending'
+            delay = config.get('OUTBOX_RETRY_BASE', 5) * 2 ** (event.attempts - 1)
+            event.available_at = datetime.utcnow() + timedelta(seconds=delay)
+        event.last_error = error
+        db.session.commit()
+        return False
+
+
+def drain(limit=BATCH_SIZE):
+    """Claim and process up to ``limit`` due events; returns (done, failed)."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config.get('OUTBOX_CLAIM_TIMEOUT', 300))
+    due = [eid for eid, in db.session.query(OutboxEvent.id)
+           .filter(or_((OutboxEvent.status == 'pending') & (OutboxEvent.available_at <= now),
+                       (OutboxEvent.status == 'processing') & (OutboxEvent.claimed_at < stale_before)))
+           .order_by(OutboxEvent.id).limit(limit)]
+    db.session.commit()
+    done = failed = 0
+    for event_id in due:
+        if not _claim(event_id, now, stale_before):
+            continue
+        if _process(db.session.get(OutboxEvent, event_id)):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def purge():
+    """Delete events processed more than OUTBOX_RETENTION_DAYS ago."""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config.get('OUTBOX_RETENTION_DAYS', 7))
+    removed = OutboxEvent.query.filter(OutboxEvent.status == 'done',
+                                       OutboxEvent.processed_at < cutoff).delete()
+    db.session.commit()
+    return removed
+
+
+# ── Worker thread ────────────────────────────────────────────────────────────
+_worker = {'pid': None, 'wake': threading.Event()}
+
+
+def notify():
+    """Wake this process's worker, e.g. right after committing an event."""
+    _worker['wake'].set()
+
+
+def start_worker(app):
+    """Drain the outbox in a background thread of this process."""
+    interval = app.config.get('OUTBOX_POLL_INTERVAL', 0)
+    if not interval or _worker['pid'] == os.getpid():
+        return
+    _worker['pid'] = os.getpid()
+    wake = _worker['wake'] = threading.Event()
+
+    def loop():
+        last_purge = datetime.utcnow()
+        while True:
+            wake.wait(interval)
+            wake.clear()
+            try:
+                with app.app_context():
+                    while sum(drain()) == BATCH_SIZE:
+                        pass
+                    if datetime.utcnow() - last_purge > timedelta(hours=1):
+                        purge()
+                        last_purge = datetime.utcnow()
+            except Exception as e:
+                app.logger.warning('Outbox worker failed: %s', e)
+
+    threading.Thread(target=loop, name='outbox-worker', daemon=True).start()
@@ -0,0 +1,157 @@
+"""
+Password hashing service.
+
+- The bcrypt cost is calibrated so one hash takes about
+  ``PASSWORD_HASH_TARGET_MS``, unless ``PASSWORD_HASH_ROUNDS`` pins it.
+  Calibration only ever raises the cost above a floor: the larger of
+  ``PASSWORD_HASH_MIN_ROUNDS`` and ``BCRYPT_LOG_ROUNDS`` (Flask-Bcrypt's
+  cost, 12 by default), so a fast host never hashes weaker than that. Calibration runs once per
+  deployment, not per process: the first process to calibrate saves the
+  cost to ``PASSWORD_HASH_ROUNDS_FILE`` and every other one reads it from
+  there, so all workers hash at the same cost. ``flask passwords
+  calibrate`` re-runs it (e.g. on new hardware); on several hosts, pin the
+  cost or share the file.
+- Hashes below the current cost are upgraded on the next successful login
+  (``needs_rehash``). The cost only ever goes up, so a host that ends up
+  with a lower cost never weakens hashes made elsewhere.
+- Hashing runs on a bounded thread pool (bcrypt releases the GIL), so at
+  most ``PASSWORD_HASH_WORKERS`` hashes burn CPU per worker process and
+  the rest queue instead of starving request threads.
+- Sign-in, registration and password changes are rate limited per
+  client and per email (``RATE_LIMITS``, app/ratelimit.py), so
+  credential-stuffing bursts are turned away before any bcrypt work.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app import bcrypt
+
+
+_lock = threading.Lock()
+_state = {'rounds': None, 'pool': None}
+
+# Hash checked when the account does not exist, so response time doesn't
+# reveal which emails are registered. Built on first use at the current cost.
+_dummy = {'hash': None}
+
+
+def _pool():
+    pool = _state['pool']
+    if pool is None:
+        with _lock:
+            pool = _state['pool']
+            if pool is None:
+                pool = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('PASSWORD_HASH_WORKERS', 2),
+                    thread_name_prefix='password-hash')
+                _state['pool'] = pool
+    return pool
+
+
+def calibrate(target_ms, min_rounds=12, max_rounds=16, samples=3):
+    """Highest bcrypt cost whose hash time stays within ``target_ms``."""
+    rounds = min_rounds
+    elapsed = None
+    # best of a few: the first hash on a cold process runs slow
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.generate_password_hash('calibration', rounds)
+        took = (time.perf_counter() - start) * 1000
+        elapsed = took if elapsed is None else min(elapsed, took)
+    # each extra round doubles the work
+    while rounds < max_rounds and elapsed * 2 <= target_ms:
+        rounds += 1
+        elapsed *= 2
+    return rounds
+
+
+def min_rounds():
+    config = current_app.config
+    return max(config.get('PASSWORD_HASH_MIN_ROUNDS', 12), config.get('BCRYPT_LOG_ROUNDS', 12))
+
+
+def calibrate_for_app():
+    return calibrate(current_app.config.get('PASSWORD_HASH_TARGET_MS', 250), min_rounds=min_rounds())
+
+
+def rounds_path():
+    return current_app.config.get('PASSWORD_HASH_ROUNDS_FILE') or \
+        os.path.join(current_app.instance_path, 'password-rounds')
+
+
+def load_rounds():
+    """The saved cost, or None if nothing has been calibrated yet."""
+    try:
+        with open(rounds_path()) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def save_rounds(rounds, replace=True):
+    """
+    Save ``rounds`` for every process to use. With ``replace=False`` an
+    existing value wins; returns the cost now saved.
+    """
+    path = rounds_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(f'{rounds}\n')
+    try:
+        if replace:
+            os.replace(tmp, path)
+            return rounds
+        try:
+            os.link(tmp, path)  # atomic, and fails if another process got there first
+            return rounds
+        except FileExistsError:
+            return load_rounds() or rounds
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def current_rounds():
+    rounds = _state['rounds']
+    if rounds is None:
+        rounds = current_app.config.get('PASSWORD_HASH_ROUNDS')
+        if not rounds:
+            saved = load_rounds() or save_rounds(calibrate_for_app(), replace=False)
+            # a value saved before the floor was raised still counts as the floor
+            rounds = max(saved, min_rounds())
+        _state['rounds'] = rounds
+    return rounds
+
+
+def hash_rounds(pw_hash):
+    """The cost stored in a ``$2b$12$...`` hash, or None if it isn't bcrypt."""
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def hash_password(password):
+    rounds = current_rounds()
+    return _pool().submit(bcrypt.generate_password_hash, password, rounds).result().decode('utf-8')
+
+
+def check_password(pw_hash, password):
+    return _pool().submit(bcrypt.check_password_hash, pw_hash, password).result()
+
+
+def check_missing_user(password):
+    """Spend the same time as a real check when no account matched."""
+    if _dummy['hash'] is None:
+        _dummy['hash'] = hash_password('not-a-real-password')
+    check_password(_dummy['hash'], password)
+    return False
+
+
+def needs_rehash(pw_hash):
+    return (hash_rounds(pw_hash) or 0) < current_rounds()
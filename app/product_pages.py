@@ -0,0 +1,92 @@
+"""
+Cached product page bundles.
+
+A ``ProductPage`` holds everything the product detail page shows that is
+the same for every visitor: the product's fields, its ordered image list,
+the first page of approved reviews, the rating aggregates and the related
+product ids. Each worker keeps an LRU of them (``PRODUCT_PAGE_CACHE_SIZE``).
+
+A bundle is stamped with the catalogue version (product edits and image
+changes bump it) and the product's ``product_review_stats.version`` (any
+review change or moderation bumps it). ``get()`` checks both with a single
+primary-key query that also returns the live available stock and slug, so
+a cached view costs that one query. A bundle whose slug no longer matches
+is rebuilt: a product renamed in another worker is seen before the new
+catalogue version is.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from app import catalogue, recommendations, reviews
+from app.models import db, Product, ProductImage, ProductReviewStats, ProductDisplayMixin
+
+
+class ProductPage(ProductDisplayMixin):
+    FIELDS = ('id', 'name', 'slug', 'subtitle', 'description', 'price', 'original_price',
+              'sku', 'category_id', 'image_filename', 'badge', 'badge_color', 'material',
+              'gemstone', 'weight', 'dimensions', 'is_active')
+    __slots__ = FIELDS + ('category_name', 'images', 'reviews', 'reviews_cursor', 'review_count',
+                          'average_rating', 'histogram', 'related_ids', 'catalogue_version',
+                          'reviews_version', 'built_at')
+
+    def __init__(self, product, catalogue_version, reviews_version):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(product, name))
+        self.category_name = product.category.name if product.category else ''
+        self.catalogue_version = catalogue_version
+        self.reviews_version = reviews_version
+        self.built_at = time.monotonic()
+
+        gallery = [f for f, in db.session.query(ProductImage.filename)
+                   .filter_by(product_id=product.id)
+                   .order_by(ProductImage.display_order, ProductImage.id)]
+        self.images = tuple(([product.image_filename] if product.image_filename else []) + gallery)
+
+        stats = product.review_stats
+        self.review_count = stats.review_count if stats else 0
+        self.average_rating = stats.average_rating if stats else 0
+        self.histogram = stats.histogram if stats else {s: 0 for s in range(5, 0, -1)}
+
+        first, self.reviews_cursor = reviews.page(
+            product.id, limit=current_app.config.get('PRODUCT_PAGE_REVIEWS', 6))
+        self.reviews = tuple(first)
+        self.related_ids = tuple(recommendations.related_ids(product.id, product.category_id))
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _fresh(page, catalogue_version, reviews_version, slug, max_age):
+    return (page is not None and page.catalogue_version == catalogue_version
+            and page.reviews_version == reviews_version and page.slug == slug
+            and time.monotonic() - page.built_at <= max_age)
+
+
+def get(product_id):
+    """``(page, available)`` for ``product_id``, or ``(None, 0)`` if it doesn't exist."""
+    row = (db.session.query(Product.stock - Product.reserved, ProductReviewStats.version, Product.slug)
+           .outerjoin(ProductReviewStats, ProductReviewStats.product_id == Product.id)
+           .filter(Product.id == product_id).first())
+    if row is None:
+        return None, 0
+    stock, reviews_version = max(0, row[0] or 0), row[1] or 0
+    version = catalogue.current_version()
+    config = current_app.config
+    max_age = config.get('PRODUCT_PAGE_MAX_AGE', 600)
+
+    with _lock:
+        page = _cache.get(product_id)
+        if page is not None:
+            _cache.move_to_end(product_id)
+    if not _fresh(page, version, reviews_version, row[2], max_age):
+        page = ProductPage(db.session.get(Product, product_id), version, reviews_version)
+        with _lock:
+            _cache[product_id] = page
+            _cache.move_to_end(product_id)
+            while len(_cache) > config.get('PRODUCT_PAGE_CACHE_SIZE', 1000):
+                _cache.popitem(last=False)
+    return page, stock
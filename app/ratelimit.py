@@ -0,0 +1,242 @@
+"""
+Request rate limits for public write endpoints.
+
+Views decorated with ``@rate_limited`` are limited by the rules in
+``RATE_LIMITS`` for their endpoint: ``(key, requests, seconds)`` tuples,
+where ``key`` is what the count is kept per:
+
+- ``ip``     the client address (``request.remote_addr``)
+- ``user``   the signed-in user (the client address for visitors)
+- ``email``  the ``email`` field of the submitted form
+
+Each rule is a sliding window estimated from two fixed windows: the count
+in the current window plus the previous window's count, weighted by how
+much of it still overlaps. Rejected requests count as well, so a client
+that keeps hammering stays limited. Only ``RATE_LIMIT_METHODS`` are
+counted.
+
+Counters live in a backend chosen by ``RATE_LIMIT_BACKEND``:
+
+- ``memory``  this process only
+- ``sqlite``  a local SQLite file (``RATE_LIMIT_SQLITE_PATH``), shared by
+              the workers on one host
+- ``redis``   any redis-py compatible server at ``RATE_LIMIT_REDIS_URL``
+              (``local://`` uses the in-process stand-in)
+
+Behind a reverse proxy, every request comes from the proxy's address, so
+all clients would share one ``ip`` count. Set ``PROXY_FIX_HOPS`` to the
+number of proxies in front of the app. Werkzeug's ``ProxyFix`` then takes
+the client address from ``X-Forwarded-For``, trusting only that many
+entries from the right, so a client can't pick its own address by sending
+the header itself.
+
+Over the limit, the view is not run: the client gets a 429 with
+``Retry-After``. Rejections are counted per endpoint and key in the same
+backend (``flask ratelimit stats``).
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, flash, jsonify, render_template, request
+from flask_login import current_user
+
+from app import localredis
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._counts = {}
+        self._rejected = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, bucket, ttl):
+        """Count a request in ``bucket``; returns (previous bucket, this bucket)."""
+        with self._lock:
+            current = self._counts[(key, bucket)] = self._counts.get((key, bucket), 0) + 1
+            previous = self._counts.get((key, bucket - 1), 0)
+            if len(self._counts) > 10000:
+                self._prune(bucket)
+            return previous, current
+
+    def _prune(self, bucket):
+        for k in [k for k in self._counts if k[1] < bucket - 1]:
+            del self._counts[k]
+
+    def reject(self, name):
+        with self._lock:
+            self._rejected[name] = self._rejected.get(name, 0) + 1
+
+    def rejected(self, names):
+        with self._lock:
+            return {name: self._rejected[name] for name in names if name in self._rejected}
+
+
+class SQLiteBackend:
+    SWEEP_EVERY = 1000  # hits between deletions of expired counters
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_counts ('
+                     'key TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL, '
+                     'expires_at REAL NOT NULL, PRIMARY KEY (key, bucket))')
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_rejections ('
+                     'name TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+
+    def _conn(self):
+        # one connection per thread, re-opened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def hit(self, key, bucket, ttl):
+        conn = self._conn()
+        now = time.time()
+        current, = conn.execute(
+            'INSERT INTO rate_counts (key, bucket, count, expires_at) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (key, bucket) DO UPDATE SET count = count + 1 RETURNING count',
+            (key, bucket, now + ttl)).fetchone()
+        row = conn.execute('SELECT count FROM rate_counts WHERE key = ? AND bucket = ?',
+                           (key, bucket - 1)).fetchone()
+        self._hits += 1
+        if self._hits % self.SWEEP_EVERY == 0:
+            conn.execute('DELETE FROM rate_counts WHERE expires_at <= ?', (now,))
+        return (row[0] if row else 0), current
+
+    def reject(self, name):
+        self._conn().execute('INSERT INTO rate_rejections (name, count) VALUES (?, 1) '
+                             'ON CONFLICT (name) DO UPDATE SET count = count + 1', (name,))
+
+    def rejected(self, names):
+        rows = self._conn().execute('SELECT name, count FROM rate_rejections').fetchall()
+        return {name: count for name, count in rows if name in names}
+
+
+class RedisBackend:
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key, bucket, ttl):
+        name = f'{self.prefix}{key}:{bucket}'
+        current = self.client.incr(name)
+        if current == 1:
+            self.client.expire(name, int(ttl))
+        previous = self.client.get(f'{self.prefix}{key}:{bucket - 1}')
+        return int(previous or 0), current
+
+    def reject(self, name):
+        self.client.incr(f'{self.prefix}rejected:{name}')
+
+    def rejected(self, names):
+        counts = {name: self.client.get(f'{self.prefix}rejected:{name}') for name in names}
+        return {name: int(count) for name, count in counts.items() if count}
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Too many requests')
+        self.retry_after = retry_after
+
+
+def retry_after(limit, window, previous, current, elapsed):
+    """Seconds until the sliding count drops back to ``limit`` with no more requests."""
+    if current > limit:
+        # wait out this window, then until enough of it has slid past
+        wait = (window - elapsed) + window * (1 - limit / current)
+    else:
+        wait = window * (1 - (limit - current) / previous) - elapsed
+    return max(1, math.ceil(wait))
+
+
+def _key_value(kind):
+    if kind == 'ip':
+        return request.remote_addr
+    if kind == 'user':
+        if current_user.is_authenticated:
+            return f'user:{current_user.id}'
+        return f'ip:{request.remote_addr}'
+    if kind == 'email':
+        return request.form.get('email', '').strip().lower() or None
+    raise ValueError(f'Unknown rate limit key {kind!r}')
+
+
+def check(endpoint):
+    """Count this request against ``endpoint``'s rules; raises RateLimited."""
+    backend = current_app.extensions['ratelimit']
+    now = time.time()
+    wait = 0
+    for kind, limit, window in current_app.config.get('RATE_LIMITS', {}).get(endpoint, ()):
+        value = _key_value(kind)
+        if value is None:
+            continue
+        bucket, elapsed = divmod(now, window)
+        previous, current = backend.hit(f'{endpoint}:{kind}:{value}', int(bucket), window * 2)
+        if previous * (1 - elapsed / window) + current > limit:
+            backend.reject(f'{endpoint}:{kind}')
+            wait = max(wait, retry_after(limit, window, previous, current, elapsed))
+    if wait:
+        raise RateLimited(wait)
+
+
+def rate_limited(view=None, template=None):
+    """
+    Apply ``RATE_LIMITS`` to this view. Form pages pass ``template`` to be
+    re-rendered with a message when the client is limited.
+    """
+    if view is None:
+        return lambda v: rate_limited(v, template)
+
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        config = current_app.config
+        if config.get('RATE_LIMIT_ENABLED') and request.method in config.get('RATE_LIMIT_METHODS', ('POST',)):
+            try:
+                check(request.endpoint)
+            except RateLimited as e:
+                return too_many_requests(e.retry_after, template)
+        return view(*args, **kwargs)
+    return decorated
+
+
+def too_many_requests(wait, template=None):
+    headers = {'Retry-After': str(wait)}
+    message = 'Too many requests. Please try again shortly.'
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.is_json:
+        return jsonify({'error': message, 'retry_after': wait}), 429, headers
+    if template:
+        flash(message, 'danger')
+        return render_template(template), 429, headers
+    return message, 429, {**headers, 'Content-Type': 'text/plain; charset=utf-8'}
+
+
+def metrics(app):
+    """Rejections so far, per endpoint and key: ``{'auth.login:ip': 3, ...}``."""
+    names = [f'{endpoint}:{kind}' for endpoint, rules in app.config.get('RATE_LIMITS', {}).items()
+             for kind, _, _ in rules]
+    return app.extensions['ratelimit'].rejected(names)
+
+
+def init_app(app):
+    kind = app.config.get('RATE_LIMIT_BACKEND', 'sqlite')
+    if kind == 'memory':
+        backend = MemoryBackend()
+    elif kind == 'redis':
+        backend = RedisBackend(localredis.from_url(app.config['RATE_LIMIT_REDIS_URL']))
+    elif kind == 'sqlite':
+        path = app.config.get('RATE_LIMIT_SQLITE_PATH') or os.path.join(app.instance_path, 'ratelimit.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend = SQLiteBackend(path)
+    else:
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND {kind!r}')
+    app.extensions['ratelimit'] = backend
@@ -0,0 +1,253 @@
+"""
+Related-product recommendations.
+
+Neighbour lists are built offline from three sparse signals and stored in
+``product_recommendations`` so the product page reads one precomputed list:
+
+- co-purchases   (product x order matrix from OrderItem)
+- wishlists      (product x user matrix from Wishlist)
+- attributes     (product x token matrix from category, material, gemstone
+                  and price band, IDF weighted)
+
+Each matrix is kept as sparse rows ({column: value}) plus an inverted index
+({column: [(product_id, value), ...]}), so a product's similarity to every
+other product is one sparse row-times-matrix product instead of a dense
+N x N computation.
+
+A column shared by more than ``MAX_POSTINGS`` products (a big category or
+price band) would make that product quadratic. Such a column is not walked
+in full: it scores the products already in the running exactly, plus its
+``MAX_POSTINGS`` strongest postings, so it still shapes every list.
+
+``flask recommendations refresh`` rewrites the lists of products touched
+by new orders or wishlist additions, new products and the products that
+share an attribute with them. Removals (wishlist entries, deactivated
+products) and attribute edits leave no trace to find, so the full rebuild
+is the source of truth: ``refresh`` runs one whenever the oldest list is
+more than ``RECOMMENDATION_FULL_REBUILD_HOURS`` old.
+"""
+import bisect
+import heapq
+import math
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from app.models import (db, Product, Order, OrderItem, Wishlist,
+                        ProductRecommendation)
+
+# Relative weight of each signal in the final score
+WEIGHTS = {'purchase': 3.0, 'wishlist': 2.0, 'attribute': 1.0}
+
+# Upper bounds (Rs) of the price bands used as an attribute feature
+PRICE_BANDS = (500, 1000, 2000, 3000, 5000, 10000)
+
+# Columns shared by more products than this are only partly walked (see above)
+MAX_POSTINGS = 5000
+
+WRITE_BATCH = 500
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_STOPWORDS = {'and', 'the', 'with', 'ct', 'total', 'each'}
+
+
+def _tokens(text):
+    text = re.sub(r'\(.*?\)', ' ', (text or '').lower())  # drop "(0.8ct)" etc.
+    return {t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in _STOPWORDS}
+
+
+def _price_band(price):
+    return bisect.bisect_left(PRICE_BANDS, price or 0)
+
+
+class SparseMatrix:
+    """Row-normalised sparse matrix with an inverted column index."""
+
+    def __init__(self, rows):
+        self.rows = {}
+        self.columns = defaultdict(list)
+        for row_id, row in rows.items():
+            norm = math.sqrt(sum(v * v for v in row.values()))
+            if not norm:
+                continue
+            row = {c: v / norm for c, v in row.items()}
+            self.rows[row_id] = row
+            for col, val in row.items():
+                self.columns[col].append((row_id, val))
+        # wide columns: postings strongest first, plus {row_id: value}
+        self.wide = {}
+        for col, postings in self.columns.items():
+            if len(postings) > MAX_POSTINGS:
+                postings.sort(key=lambda p: (-p[1], p[0]))
+                self.wide[col] = dict(postings)
+
+    def _postings(self, col):
+        postings = self.columns[col]
+        return postings[:MAX_POSTINGS] if col in self.wide else postings
+
+    def accumulate(self, row_id, scores, weight):
+        """Add ``weight * cosine(row_id, other)`` into ``scores`` for the other rows."""
+        row = self.rows.get(row_id)
+        if not row:
+            return
+        wide = []
+        for col, val in row.items():
+            if col in self.wide:
+                wide.append((col, val))
+                continue
+            for other_id, other_val in self.columns[col]:
+                if other_id != row_id:
+                    scores[other_id] += weight * val * other_val
+        if not wide:
+            return
+        candidates = set(scores)
+        for col, _ in wide:
+            candidates.update(r for r, _ in self._postings(col))
+        candidates.discard(row_id)
+        for other_id in candidates:
+            score = sum(val * self.wide[col].get(other_id, 0) for col, val in wide)
+            if score:
+                scores[other_id] += weight * score
+
+    def neighbours(self, row_id):
+        """Row ids whose scores ``accumulate(row_id, ...)`` can reach through a column."""
+        found = set()
+        for col in self.rows.get(row_id, ()):
+            found.update(r for r, _ in self._postings(col))
+        found.discard(row_id)
+        return found
+
+
+def _load_matrices():
+    products = db.session.query(
+        Product.id, Product.category_id, Product.material,
+        Product.gemstone, Product.price,
+    ).filter(Product.is_active.is_(True)).all()
+    active_ids = {p.id for p in products}
+
+    purchases = defaultdict(dict)
+    for product_id, order_id, qty in db.session.query(
+            OrderItem.product_id, OrderItem.order_id, OrderItem.quantity):
+        if product_id in active_ids:
+            # log damping so one bulk order doesn't dominate
+            purchases[product_id][order_id] = 1 + math.log(max(qty or 1, 1))
+
+    wishlists = defaultdict(dict)
+    for product_id, user_id in db.session.query(Wishlist.product_id, Wishlist.user_id):
+        if product_id in active_ids:
+            wishlists[product_id][user_id] = 1.0
+
+    features = {}
+    doc_freq = defaultdict(int)
+    for p in products:
+        feats = {f'cat:{p.category_id}', f'price:{_price_band(p.price)}'}
+        feats.update('mat:' + t for t in _tokens(p.material))
+        feats.update('gem:' + t for t in _tokens(p.gemstone))
+        features[p.id] = feats
+        for f in feats:
+            doc_freq[f] += 1
+    n = len(products) or 1
+    attributes = {
+        pid: {f: math.log(1 + n / doc_freq[f]) for f in feats}
+        for pid, feats in features.items()
+    }
+
+    return active_ids, {
+        'purchase': SparseMatrix(purchases),
+        'wishlist': SparseMatrix(wishlists),
+        'attribute': SparseMatrix(attributes),
+    }
+
+
+def _top_k(product_id, matrices, k):
+    scores = defaultdict(float)
+    for name, matrix in matrices.items():
+        matrix.accumulate(product_id, scores, WEIGHTS[name])
+    return heapq.nlargest(k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+
+
+def stale_product_ids():
+    """
+    Products whose neighbour lists may have changed since the last build:
+    products without a list, plus products touched by orders or wishlist
+    additions since the last build. None when a full rebuild is due.
+    """
+    oldest, built_at = db.session.query(func.min(ProductRecommendation.updated_at),
+                                        func.max(ProductRecommendation.updated_at)).one()
+    hours = current_app.config.get('RECOMMENDATION_FULL_REBUILD_HOURS', 24)
+    if built_at is None or (hours and oldest < datetime.utcnow() - timedelta(hours=hours)):
+        return None
+    active = {pid for (pid,) in db.session.query(Product.id).filter(Product.is_active.is_(True))}
+    built = {pid for (pid,) in db.session.query(ProductRecommendation.product_id).distinct()}
+    stale = active - built
+    stale.update(pid for (pid,) in db.session.query(OrderItem.product_id)
+                 .join(Order, Order.id == OrderItem.order_id)
+                 .filter(Order.created_at > built_at).distinct())
+    stale.update(pid for (pid,) in db.session.query(Wishlist.product_id)
+                 .filter(Wishlist.added_at > built_at).distinct())
+    return stale & active
+
+
+def refresh(product_ids=None, k=None):
+    """
+    Recompute and store neighbour lists.
+
+    With ``product_ids`` given, only those products and the products that
+    share a purchase or wishlist signal with them are rewritten, plus, for
+    products that have no list yet, the products sharing an attribute.
+    Returns the number of products refreshed.
+    """
+    k = k or current_app.config.get('RECOMMENDATION_TOP_K', 8)
+    active_ids, matrices = _load_matrices()
+
+    if product_ids is None:
+        targets = set(active_ids)
+        # drop lists for products that have since been deactivated
+        db.session.query(ProductRecommendation).filter(
+            ProductRecommendation.product_id.notin_(active_ids)
+        ).delete(synchronize_session=False)
+    else:
+        targets = set(product_ids) & active_ids
+        built = {pid for (pid,) in db.session.query(ProductRecommendation.product_id).distinct()}
+        for pid in list(targets):
+            targets |= matrices['purchase'].neighbours(pid)
+            targets |= matrices['wishlist'].neighbours(pid)
+            if pid not in built:
+                # a new product belongs on its attribute neighbours' lists too
+                targets |= matrices['attribute'].neighbours(pid)
+
+    now = datetime.utcnow()
+    targets = sorted(targets)
+    for start in range(0, len(targets), WRITE_BATCH):
+        batch = targets[start:start + WRITE_BATCH]
+        db.session.query(ProductRecommendation).filter(
+            ProductRecommendation.product_id.in_(batch)
+        ).delete(synchronize_session=False)
+        rows = [
+            {'product_id': pid, 'related_id': rid, 'rank': rank,
+             'score': score, 'updated_at': now}
+            for pid in batch
+            for rank, (rid, score) in enumerate(_top_k(pid, matrices, k))
+        ]
+        if rows:
+            db.session.execute(db.insert(ProductRecommendation), rows)
+        db.session.commit()
+    return len(targets)
+
+
+def related_ids(product_id, category_id, limit=4):
+    """Ids of precomputed neighbours, falling back to same-category items."""
+    related = [pid for pid, in db.session.query(Product.id)
+               .join(ProductRecommendation, ProductRecommendation.related_id == Product.id)
+               .filter(ProductRecommendation.product_id == product_id,
+                       Product.is_active.is_(True))
+               .order_by(ProductRecommendation.rank)
+               .limit(limit)]
+    if related:
+        return related
+    return [pid for pid, in db.session.query(Product.id)
+            .filter_by(category_id=category_id, is_active=True)
+            .filter(Product.id != product_id).limit(limit)]
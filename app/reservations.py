@@ -0,0 +1,158 @@
+"""
+Stock reservations.
+
+Opening the checkout page places a hold on every unit in the shopper's cart
+for ``STOCK_HOLD_SECONDS``. ``Product.reserved`` counts the units under
+hold, so what is left to sell is ``stock - reserved``, read from the
+product row with no extra query.
+
+Every change goes through a conditional UPDATE on the product row
+(``... WHERE stock - reserved >= :qty``), which the database applies
+atomically, so concurrent checkouts for the last few units of a
+limited piece cannot oversell. A hold row is only released by whoever
+manages to delete it, so ``reserved`` is decremented exactly once.
+
+Expired holds still count until swept: a background thread does it every
+``STOCK_HOLD_SWEEP_INTERVAL`` seconds, and a hold or purchase that comes up
+short sweeps that product's expired holds and tries once more.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.models import db, Product, StockHold
+
+SWEEP_BATCH = 500
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id, available):
+        super().__init__(f'Only {available} of product {product_id} left')
+        self.product_id = product_id
+        self.available = available
+
+
+def available(product_id):
+    """Units of ``product_id`` neither sold nor held."""
+    return db.session.query(Product.stock - Product.reserved).filter_by(id=product_id).scalar() or 0
+
+
+def available_many(product_ids):
+    """``{product_id: units neither sold nor held}``; None where stock isn't tracked."""
+    return dict(db.session.query(Product.id, Product.stock - Product.reserved)
+                .filter(Product.id.in_(product_ids)))
+
+
+def held(user_id, product_id):
+    """Units of ``product_id`` currently held for ``user_id``."""
+    return db.session.query(StockHold.quantity).filter_by(
+        user_id=user_id, product_id=product_id).scalar() or 0
+
+
+def held_many(user_id, product_ids):
+    """``{product_id: units}`` held for ``user_id``, for those of ``product_ids`` with a hold."""
+    return dict(db.session.query(StockHold.product_id, StockHold.quantity)
+                .filter(StockHold.user_id == user_id, StockHold.product_id.in_(product_ids)))
+
+
+def _take(product_id, quantity, column):
+    """Move ``quantity`` free units into ``column`` (reserved) or out of stock."""
+    values = ({'reserved': Product.reserved + quantity} if column == 'reserved'
+              else {'stock': Product.stock - quantity})
+    stmt = (db.update(Product)
+            .where(Product.id == product_id, Product.stock - Product.reserved >= quantity)
+            .values(**values))
+    if db.session.execute(stmt).rowcount:
+        return True
+    if sweep(product_id=product_id):
+        return bool(db.session.execute(stmt).rowcount)
+    return False
+
+
+def _release(hold_id, product_id, quantity):
+    if db.session.execute(db.delete(StockHold).where(StockHold.id == hold_id)).rowcount:
+        db.session.execute(db.update(Product).where(Product.id == product_id)
+                           .values(reserved=Product.reserved - quantity))
+        return True
+    return False
+
+
+def release_user(user_id, product_ids=None):
+    """Drop ``user_id``'s holds (on ``product_ids`` only, if given)."""
+    query = db.session.query(StockHold.id, StockHold.product_id, StockHold.quantity)\
+        .filter(StockHold.user_id == user_id)
+    if product_ids is not None:
+        query = query.filter(StockHold.product_id.in_(product_ids))
+    for hold_id, product_id, quantity in query.all():
+        _release(hold_id, product_id, quantity)
+
+
+def hold_cart(user_id, items):
+    """
+    Hold every unit in ``items`` (cart items) for ``user_id``, replacing the
+    holds they already had. Raises OutOfStockError, with nothing held, if a
+    line can't be covered. Commits on success.
+    """
+    expires_at = datetime.utcnow() + timedelta(seconds=current_app.config.get('STOCK_HOLD_SECONDS', 600))
+    try:
+        release_user(user_id)
+        for item in sorted(items, key=lambda i: i.product_id):  # fixed lock order
+            if not _take(item.product_id, item.quantity, 'reserved'):
+                raise OutOfStockError(item.product_id, available(item.product_id))
+            db.session.add(StockHold(product_id=item.product_id, user_id=user_id,
+                                     quantity=item.quantity, expires_at=expires_at))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def purchase(user_id, items):
+    """
+    Take the units in ``items`` out of stock for ``user_id``'s order, using
+    their holds where they still have them. Runs inside the caller's
+    transaction; raises OutOfStockError if a line can't be covered.
+    """
+    release_user(user_id, [i.product_id for i in items])
+    for item in sorted(items, key=lambda i: i.product_id):
+        if not _take(item.product_id, item.quantity, 'stock'):
+            raise OutOfStockError(item.product_id, available(item.product_id))
+
+
+def sweep(product_id=None):
+    """Release expired holds (of one product, or all); returns how many."""
+    query = db.session.query(StockHold.id, StockHold.product_id, StockHold.quantity)\
+        .filter(StockHold.expires_at <= datetime.utcnow())
+    if product_id is not None:
+        query = query.filter(StockHold.product_id == product_id)
+    released = 0
+    for hold_id, pid, quantity in query.limit(SWEEP_BATCH).all():
+        released += _release(hold_id, pid, quantity)
+    return released
+
+
+_sweeper = {'pid': None}
+
+
+def start_sweeper(app):
+    """Sweep expired holds every STOCK_HOLD_SWEEP_INTERVAL seconds in this process."""
+    interval = app.config.get('STOCK_HOLD_SWEEP_INTERVAL', 0)
+    if not interval or _sweeper['pid'] == os.getpid():
+        return
+    _sweeper['pid'] = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    while sweep() == SWEEP_BATCH:
+                        db.session.commit()
+                    db.session.commit()
+            except Exception as e:
+                app.logger.warning('Stock hold sweep failed: %s', e)
+
+    threading.Thread(target=loop, name='stock-hold-sweeper', daemon=True).start()
@@ -0,0 +1,156 @@
+"""
+Review aggregates and pagination.
+
+``product_review_stats`` holds, per product, the count, rating total and
+star histogram of its approved reviews, plus a ``version`` that moves on
+every change. Any flush that adds, edits, moderates or deletes a Review
+recomputes the rows for the products it touched in the same transaction,
+so pages read ratings without scanning reviews.
+
+``flask reviews rebuild-stats`` recomputes every product (after bulk
+imports that bypass the session); ``flask db upgrade`` creates and fills
+the table on a database that predates it.
+
+``page()`` lists a product's approved reviews with keyset pagination: the
+cursor carries the sort key of the last review shown, so every page is an
+index range scan no matter how deep the visitor scrolls.
+"""
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import event, func, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.dbutil import upsert_insert
+from app.models import db, Product, Review, ProductReviewStats, ReviewHelpfulVote, User
+
+BATCH_SIZE = 500
+
+# sort name -> review columns, all descending; id breaks ties
+SORTS = {
+    'newest': (Review.created_at, Review.id),
+    'helpful': (Review.helpful_count, Review.created_at, Review.id),
+}
+DEFAULT_SORT = 'newest'
+MAX_PAGE_SIZE = 50
+
+
+class ReviewRecord:
+    __slots__ = ('id', 'rating', 'title', 'body', 'is_verified', 'helpful_count',
+                 'created_at', 'author_name')
+
+    def __init__(self, row):
+        for name in ('id', 'rating', 'title', 'body', 'is_verified', 'helpful_count', 'created_at'):
+            setattr(self, name, getattr(row, name))
+        self.author_name = f'{row.first_name} {row.last_name or ""}'.strip()
+
+    def to_dict(self):
+        return {'id': self.id, 'rating': self.rating, 'title': self.title, 'body': self.body,
+                'is_verified': self.is_verified, 'helpful_count': self.helpful_count,
+                'created_at': self.created_at.isoformat(), 'author': self.author_name}
+
+
+def encode_cursor(record, sort):
+    key = [getattr(record, col.key) for col in SORTS[sort]]
+    key = [v.isoformat() if isinstance(v, datetime) else v for v in key]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """The sort key encoded in ``cursor``; raises ValueError if it is malformed."""
+    columns = SORTS[sort]
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(key, list) or len(key) != len(columns):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(v) if col.key == 'created_at' else int(v)
+                for col, v in zip(columns, key)]
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def page(product_id, sort=DEFAULT_SORT, rating=None, cursor=None, limit=6):
+    """
+    One page of approved reviews for ``product_id``.
+
+    Returns ``(records, next_cursor)``; ``next_cursor`` is None on the last
+    page. ``rating`` (1-5) keeps only reviews with that many stars.
+    """
+    columns = SORTS[sort]
+    query = (db.session.query(Review.id, Review.rating, Review.title, Review.body,
+                              Review.is_verified, Review.helpful_count, Review.created_at,
+                              User.first_name, User.last_name)
+             .join(User, User.id == Review.user_id)
+             .filter(Review.product_id == product_id, Review.is_approved.is_(True)))
+    if rating:
+        query = query.filter(Review.rating == rating)
+    if cursor:
+        query = query.filter(tuple_(*columns) < tuple_(*decode_cursor(cursor, sort)))
+    rows = query.order_by(*[c.desc() for c in columns]).limit(limit + 1).all()
+    records = [ReviewRecord(r) for r in rows[:limit]]
+    next_cursor = encode_cursor(records[-1], sort) if len(rows) > limit else None
+    return records, next_cursor
+
+
+def mark_helpful(review_id, user_id):
+    """Count one helpful vote per user; returns False if they already voted."""
+    stmt = upsert_insert(ReviewHelpfulVote).values(
+        review_id=review_id, user_id=user_id, created_at=datetime.utcnow())
+    result = db.session.execute(stmt.on_conflict_do_nothing(index_elements=['review_id', 'user_id']))
+    if not result.rowcount:
+        return False
+    db.session.execute(db.update(Review).where(Review.id == review_id)
+                       .values(helpful_count=Review.helpful_count + 1))
+    # a Core update: the after_flush listener doesn't see it, so move the
+    # version here or cached product pages keep the old helpful counts
+    product_id = select(Review.product_id).where(Review.id == review_id).scalar_subquery()
+    db.session.execute(db.update(ProductReviewStats)
+                       .where(ProductReviewStats.product_id == product_id)
+                       .values(version=ProductReviewStats.version + 1))
+    return True
+
+
+def refresh_stats(conn, product_ids):
+    """Recompute ``product_review_stats`` for ``product_ids`` on ``conn``."""
+    product_ids = sorted(set(product_ids))
+    table = ProductReviewStats.__table__
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start:start + BATCH_SIZE]
+        stars = {pid: [0] * 5 for pid in batch}
+        rows = conn.execute(select(Review.product_id, Review.rating, func.count(Review.id))
+                            .where(Review.product_id.in_(batch), Review.is_approved.is_(True))
+                            .group_by(Review.product_id, Review.rating))
+        for pid, rating, n in rows:
+            if 1 <= rating <= 5:
+                stars[pid][rating - 1] = n
+        now = datetime.utcnow()
+        values = []
+        for pid, counts in stars.items():
+            row = {'product_id': pid, 'review_count': sum(counts),
+                   'rating_total': sum(n * (i + 1) for i, n in enumerate(counts)),
+                   'version': 1, 'updated_at': now}
+            row.update({f'stars_{i + 1}': n for i, n in enumerate(counts)})
+            values.append(row)
+        stmt = upsert_insert(ProductReviewStats).values(values)
+        changed = {c: stmt.excluded[c] for c in values[0] if c not in ('product_id', 'version')}
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=['product_id'],
+            set_={**changed, 'version': table.c.version + 1}))
+
+
+def rebuild_all():
+    """Recompute the aggregates of every product; returns how many."""
+    product_ids = [pid for pid, in db.session.query(Product.id)]
+    refresh_stats(db.session.connection(), product_ids)
+    db.session.commit()
+    return len(product_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_touched_products(session, flush_context):
+    touched = {o.product_id for o in session.new | session.dirty | session.deleted
+               if isinstance(o, Review)}
+    touched.discard(None)
+    if touched:
+        refresh_stats(session.connection(), touched)
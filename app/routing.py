@@ -0,0 +1,143 @@
+"""
+Read-replica routing.
+
+Replica URLs (``DATABASE_REPLICA_URLS``) become extra engines under the
+bind keys ``replica_0``, ``replica_1``, ... Views decorated with
+``@use_replica`` send their plain SELECTs to one of them; everything else,
+and any statement that writes, locks or follows a flush, goes to the
+primary.
+
+After a request commits a write, that visitor's reads stick to the primary
+for ``DB_STICKY_SECONDS`` so they see their own changes before the
+replicas catch up.
+
+For local testing, ``sync_replicas()`` (``flask replicas sync``, or every
+``REPLICA_SYNC_INTERVAL`` seconds in the background) copies the primary
+SQLite file onto each SQLite replica with the online backup API.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_PREFIX = 'replica_'
+STICKY_KEY = '_db_primary_until'
+
+
+def use_replica(view):
+    """Route this view's reads to a read replica when one is configured."""
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        g.db_use_replica = True
+        return view(*args, **kwargs)
+    return decorated
+
+
+def _reads_may_use_replica():
+    if not has_request_context() or not g.get('db_use_replica'):
+        return False
+    if 'db_sticky' not in g:
+        g.db_sticky = flask_session.get(STICKY_KEY, 0) > time.time()
+    return not g.db_sticky
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if isinstance(clause, UpdateBase):
+            self.info['db_wrote'] = True
+        elif (bind is None and not self._flushing and not self.info.get('db_wrote')
+                and getattr(clause, '_for_update_arg', None) is None
+                and _reads_may_use_replica()):
+            engine = self._replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self):
+        key = self.info.get('db_replica')
+        if key is None:
+            keys = [k for k in self._db.engines if k and k.startswith(REPLICA_PREFIX)]
+            if not keys:
+                return None
+            key = self.info['db_replica'] = random.choice(keys)
+        return self._db.engines[key]
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_wrote(session, flush_context):
+    session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(session):
+    if session.info.pop('db_wrote', False) and has_request_context():
+        from flask import current_app
+        window = current_app.config.get('DB_STICKY_SECONDS', 5)
+        if window:
+            flask_session[STICKY_KEY] = time.time() + window
+            g.db_sticky = True
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_writes(session):
+    session.info.pop('db_wrote', None)
+
+
+def configure_binds(config, engine_options):
+    """Add one bind per replica URL to SQLALCHEMY_BINDS."""
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for i, url in enumerate(config.get('DATABASE_REPLICA_URLS') or []):
+        binds[f'{REPLICA_PREFIX}{i}'] = {'url': url, **engine_options(config, url)}
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+# ── Local stand-in replicator ────────────────────────────────────────────────
+def sync_replicas(db):
+    """Copy the primary SQLite database onto every SQLite replica."""
+    primary = db.engines[None]
+    if primary.dialect.name != 'sqlite':
+        raise RuntimeError('The local replicator only copies SQLite databases.')
+    synced = []
+    src = sqlite3.connect(primary.url.database)
+    try:
+        for key, engine in db.engines.items():
+            if not key or not key.startswith(REPLICA_PREFIX) or engine.dialect.name != 'sqlite':
+                continue
+            dst = sqlite3.connect(engine.url.database, timeout=30)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+            synced.append(key)
+    finally:
+        src.close()
+    return synced
+
+
+_replicator = {'pid': None}
+
+
+def start_replicator(app, db):
+    """Run ``sync_replicas`` every REPLICA_SYNC_INTERVAL seconds in this process."""
+    interval = app.config.get('REPLICA_SYNC_INTERVAL', 0)
+    if not interval or _replicator['pid'] == os.getpid():
+        return
+    _replicator['pid'] = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    sync_replicas(db)
+            except Exception as e:
+                app.logger.warning('Replica sync failed: %s', e)
+
+    threading.Thread(target=loop, name='replica-sync', daemon=True).start()
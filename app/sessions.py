@@ -0,0 +1,228 @@
+"""
+Server-side sessions.
+
+Only an opaque session id travels in the cookie; the data lives in a
+backend chosen by ``SESSION_BACKEND``:
+
+- ``sqlite``  a local SQLite file (``SESSION_SQLITE_PATH``), shared by the
+              workers on one host
+- ``redis``   any redis-py compatible server at ``SESSION_REDIS_URL``
+              (``local://`` uses the in-process stand-in)
+- ``cookie``  Flask's default signed-cookie sessions
+
+Sessions load lazily on first access, are written only when modified, and
+the cookie is only sent when a new session id is issued. Ids are only ever
+issued by the server: a cookie naming a session the backend doesn't have
+gets a fresh id, and ``regenerate()`` moves the session to a new id when
+the visitor signs in or out, so a planted id can't be carried into a
+signed-in session. Expired SQLite
+rows are removed by a background sweep every ``SESSION_SWEEP_INTERVAL``
+seconds; Redis expires keys itself.
+"""
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import current_app, session as flask_session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from app import localredis
+
+_SID_RE = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(SecureCookieSession):
+    """Session dict that fetches its data from the backend on first use."""
+
+    def __init__(self, sid, loader=None, new=False):
+        super().__init__()
+        self.sid = sid
+        self.new = new
+        self.replaced = False  # an old id was dropped by regenerate()
+        self._loader = loader
+
+    def _load(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            data = loader()
+            if data is None:
+                # unknown or expired id: never adopt an id the client chose
+                self.sid, self.new = new_sid(), True
+            else:
+                dict.update(self, data)
+
+
+def _loads_first(name):
+    method = getattr(SecureCookieSession, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('__getitem__', 'get', 'setdefault', '__contains__', '__iter__', '__len__',
+              'keys', 'values', 'items', 'copy', '__setitem__', '__delitem__',
+              'pop', 'popitem', 'update', 'clear', '__repr__'):
+    setattr(ServerSession, _name, _loads_first(_name))
+
+
+class SQLiteSessionBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                     'sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)')
+
+    def _conn(self):
+        # one connection per thread, re-opened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def load(self, sid):
+        row = self._conn().execute('SELECT data FROM sessions WHERE sid = ? AND expires_at > ?',
+                                   (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, data, ttl):
+        self._conn().execute('INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                             (sid, data, time.time() + ttl))
+
+    def delete(self, sid):
+        self._conn().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def sweep(self):
+        return self._conn().execute('DELETE FROM sessions WHERE expires_at <= ?',
+                                    (time.time(),)).rowcount
+
+
+class RedisSessionBackend:
+    def __init__(self, client, prefix='session:'):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        data = self.client.get(self.prefix + sid)
+        return data.decode() if isinstance(data, bytes) else data
+
+    def save(self, sid, data, ttl):
+        self.client.setex(self.prefix + sid, int(ttl), data)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def sweep(self):
+        return 0  # keys carry their own TTL
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, backend, sweep_interval=300):
+        self.backend = backend
+        self.sweep_interval = sweep_interval
+        self._sweeper_pid = None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_RE.match(sid):
+            return ServerSession(sid, loader=lambda: self._fetch(sid))
+        return ServerSession(new_sid(), new=True)
+
+    def _fetch(self, sid):
+        data = self.backend.load(sid)
+        return serializer.loads(data) if data else None
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.modified:
+            return
+
+        self._ensure_sweeper()
+        if not session:
+            if not session.new:
+                self.backend.delete(session.sid)
+            if not session.new or session.replaced:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.backend.save(session.sid, serializer.dumps(dict(session)), ttl)
+        if session.new or session.permanent:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _ensure_sweeper(self):
+        # started lazily so each forked worker runs its own
+        if not self.sweep_interval or self._sweeper_pid == os.getpid():
+            return
+        self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True).start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.backend.sweep()
+            except Exception:
+                pass  # try again next interval
+
+
+def regenerate():
+    """
+    Move the current session's data to a new id: the old row is deleted and
+    the new id's cookie is sent with the response. Call on sign-in and
+    sign-out.
+    """
+    session = flask_session._get_current_object()
+    if not isinstance(session, ServerSession):
+        return  # signed-cookie sessions carry their data, not an id
+    session._load()
+    if not session.new:
+        current_app.session_interface.backend.delete(session.sid)
+        session.replaced = True
+    session.sid, session.new = new_sid(), True
+    session.modified = True
+
+
+def init_app(app):
+    kind = app.config.get('SESSION_BACKEND', 'sqlite')
+    if kind == 'cookie':
+        return
+    if kind == 'redis':
+        backend = RedisSessionBackend(localredis.from_url(app.config['SESSION_REDIS_URL']))
+    elif kind == 'sqlite':
+        path = app.config.get('SESSION_SQLITE_PATH') or os.path.join(app.instance_path, 'sessions.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend = SQLiteSessionBackend(path)
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND {kind!r}')
+    app.session_interface = ServerSessionInterface(
+        backend, sweep_interval=app.config.get('SESSION_SWEEP_INTERVAL', 300))
@@ -0,0 +1,167 @@
+"""
+Slug and SKU lookup index.
+
+Each worker keeps one ``SlugIndex`` with every product slug -> id, id ->
+current slug, SKU -> id, the redirects left behind by renamed products, and
+the taken category slugs. Product detail routing is a dict lookup followed
+by a primary-key fetch, and admin forms allocate new slugs without probing
+the database suffix by suffix.
+
+Allocation tracks the highest numeric suffix per base slug, so a new
+"Rose Ring" next to ``rose-ring`` .. ``rose-ring-40`` is ``rose-ring-41``
+straight away. The index is rebuilt when the catalogue version changes;
+every admin write to products or categories bumps it. Workers only see
+the new version after ``CATALOGUE_VERSION_TTL``, so a slug the index
+doesn't know is looked up in the database before it is called unknown: a
+product just added or renamed elsewhere is found straight away.
+"""
+import re
+import threading
+
+from slugify import slugify
+from sqlalchemy import or_, select
+
+from app import catalogue
+from app.models import db, Product, Category, ProductSlugRedirect
+
+SUFFIX_RE = re.compile(r'^(.+)-(\d+)$')
+
+
+class SlugTable:
+    """Taken slugs plus the highest numeric suffix seen for each base slug."""
+
+    def __init__(self, slugs=()):
+        self.taken = set()
+        self.suffix = {}
+        for slug in slugs:
+            self.add(slug)
+
+    def add(self, slug):
+        self.taken.add(slug)
+        m = SUFFIX_RE.match(slug)
+        if m:
+            base, n = m.group(1), int(m.group(2))
+            if n > self.suffix.get(base, 0):
+                self.suffix[base] = n
+
+    def allocate(self, base):
+        """Reserve and return ``base`` or ``base-<n>`` with the next free suffix."""
+        slug = base
+        if slug in self.taken:
+            n = self.suffix.get(base, 0) + 1
+            slug = f'{base}-{n}'
+            # only loops when a name itself ends in "-<number>"
+            while slug in self.taken:
+                n += 1
+                slug = f'{base}-{n}'
+        self.add(slug)
+        return slug
+
+
+class SlugIndex:
+    def __init__(self, version):
+        self.version = version
+        rows = db.session.query(Product.id, Product.slug, Product.sku).order_by(Product.id).all()
+        self.product_ids = {slug: pid for pid, slug, _ in rows}
+        self.product_slugs = {pid: slug for pid, slug, _ in rows}
+        self.sku_ids = {}
+        for pid, _, sku in rows:
+            if sku:
+                self.sku_ids.setdefault(sku.strip().upper(), pid)
+        self.redirects = dict(db.session.query(ProductSlugRedirect.old_slug,
+                                               ProductSlugRedirect.product_id))
+        self.products = SlugTable(list(self.product_ids) + list(self.redirects))
+        self.categories = SlugTable(slug for slug, in db.session.query(Category.slug))
+
+
+_index = {'current': None}
+_build_lock = threading.Lock()
+_alloc_lock = threading.Lock()
+
+
+def get_index(force=False):
+    version = catalogue.current_version()
+    index = _index['current']
+    if force or index is None or index.version != version:
+        with _build_lock:
+            index = _index['current']
+            if force or index is None or index.version != version:
+                index = SlugIndex(version)
+                _index['current'] = index
+    return index
+
+
+def resolve_product(slug):
+    """
+    ``(product_id, redirect_to)`` for a detail URL slug.
+
+    ``redirect_to`` is the product's current slug when ``slug`` belongs to
+    a renamed product, otherwise None. Unknown slugs give ``(None, None)``.
+    A hit in a stale index can still be a product's old slug; the detail
+    view compares it with the live slug ``product_pages.get`` reads.
+    """
+    index = get_index()
+    pid = index.product_ids.get(slug)
+    if pid is not None:
+        return pid, None
+    pid = index.redirects.get(slug)
+    if pid is not None and pid in index.product_slugs:
+        return pid, index.product_slugs[pid]
+    # not in this worker's index (yet): one query for the slug or a redirect from it
+    row = db.session.query(Product.id, Product.slug).filter(or_(
+        Product.slug == slug,
+        Product.id.in_(select(ProductSlugRedirect.product_id).where(ProductSlugRedirect.old_slug == slug)),
+    )).order_by((Product.slug == slug).desc()).first()
+    if row is None:
+        return None, None
+    # the index is behind: re-read the catalogue version on the next request
+    catalogue.invalidate()
+    return row.id, (None if row.slug == slug else row.slug)
+
+
+def product_id_for_sku(sku):
+    return get_index().sku_ids.get((sku or '').strip().upper())
+
+
+def _allocate(table_name, model, name):
+    base = slugify(name)
+    for attempt in range(2):
+        index = get_index(force=attempt > 0)
+        with _alloc_lock:
+            slug = getattr(index, table_name).allocate(base)
+        # another worker may have taken it since our index was built
+        if db.session.query(model.id).filter_by(slug=slug).first() is None:
+            return slug
+    raise RuntimeError(f'Could not allocate a unique slug for {name!r}')
+
+
+def allocate_product_slug(name):
+    return _allocate('products', Product, name)
+
+
+def allocate_category_slug(name):
+    return _allocate('categories', Category, name)
+
+
+def rename_product(product, name):
+    """
+    Give ``product`` a slug for its new ``name``, keeping a redirect from
+    the old one. Call before committing the rename; a no-op when the name
+    still slugifies to the current base slug.
+    """
+    base = slugify(name)
+    old_slug = product.slug
+    m = SUFFIX_RE.match(old_slug)
+    if old_slug == base or (m and m.group(1) == base):
+        return old_slug
+    reclaimed = ProductSlugRedirect.query.filter_by(old_slug=base, product_id=product.id).first()
+    if reclaimed is not None:
+        # renamed back to an earlier name: take the original slug back
+        db.session.delete(reclaimed)
+        db.session.flush()
+        new_slug = base
+    else:
+        new_slug = allocate_product_slug(name)
+    db.session.add(ProductSlugRedirect(old_slug=old_slug, product_id=product.id))
+    product.slug = new_slug
+    return new_slug
@@ -0,0 +1,127 @@
+"""
+Immutable in-memory catalogue snapshot.
+
+Each worker holds one ``CatalogueSnapshot``: compact ``__slots__`` records
+for the active products, active categories and navigation items, indexed by
+id, slug, category and featured flag, plus the site settings. The home page,
+the shop listing, the navigation bar and ``SiteSettings.get`` read from it
+instead of querying.
+
+A new snapshot is built and swapped in (a single reference assignment) when
+the catalogue version changes, or when the current one is older than
+``SNAPSHOT_MAX_AGE`` seconds so review aggregates stay reasonably fresh.
+"""
+import threading
+import time
+from types import MappingProxyType
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import catalogue
+from app.models import (db, Product, Category, ProductReviewStats, NavigationItem,
+                        SiteSettings, ProductDisplayMixin)
+
+
+class CategoryRecord:
+    __slots__ = ('id', 'name', 'slug', 'description', 'icon_svg', 'display_order', 'product_count')
+
+    def __init__(self, row, product_count):
+        self.id = row.id
+        self.name = row.name
+        self.slug = row.slug
+        self.description = row.description
+        self.icon_svg = row.icon_svg
+        self.display_order = row.display_order
+        self.product_count = product_count
+
+
+class ProductRecord(ProductDisplayMixin):
+    __slots__ = ('id', 'name', 'slug', 'subtitle', 'price', 'original_price', 'stock',
+                 'sku', 'category_id', 'category', 'image_filename', 'badge', 'badge_color',
+                 'material', 'gemstone', 'is_featured', 'created_at',
+                 'average_rating', 'review_count')
+
+    def __init__(self, row, category, rating):
+        for name in ('id', 'name', 'slug', 'subtitle', 'price', 'original_price', 'stock',
+                     'sku', 'category_id', 'image_filename', 'badge', 'badge_color',
+                     'material', 'gemstone', 'is_featured', 'created_at'):
+            setattr(self, name, getattr(row, name))
+        self.category = category
+        count, total = rating
+        self.review_count = count
+        self.average_rating = round(total / count, 1) if count else 0
+
+
+class NavRecord:
+    __slots__ = ('label', 'url', 'is_external')
+
+    def __init__(self, row):
+        self.label = row.label
+        self.url = row.url
+        self.is_external = row.is_external
+
+
+class CatalogueSnapshot:
+    __slots__ = ('version', 'built_at', 'products', 'by_id', 'by_slug', 'by_category',
+                 'featured', 'categories', 'categories_by_slug', 'nav_items', 'settings')
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+
+        categories = (Category.query.filter_by(is_active=True)
+                      .order_by(Category.display_order).all())
+        counts = dict(db.session.query(Product.category_id, func.count(Product.id))
+                      .filter(Product.is_active.is_(True))
+                      .group_by(Product.category_id).all())
+        cats = tuple(CategoryRecord(c, counts.get(c.id, 0)) for c in categories)
+        cats_by_id = {c.id: c for c in cats}
+
+        ratings = {pid: (n, total) for pid, n, total in
+                   db.session.query(ProductReviewStats.product_id, ProductReviewStats.review_count,
+                                    ProductReviewStats.rating_total)}
+        columns = [getattr(Product, name) for name in ProductRecord.__slots__
+                   if name not in ('category', 'average_rating', 'review_count')]
+        rows = (db.session.query(*columns)
+                .filter(Product.is_active.is_(True))
+                .order_by(Product.id).all())
+        products = tuple(ProductRecord(r, cats_by_id.get(r.category_id), ratings.get(r.id, (0, 0)))
+                         for r in rows)
+
+        by_category = {}
+        for p in products:
+            by_category.setdefault(p.category_id, []).append(p)
+
+        self.products = products
+        self.by_id = MappingProxyType({p.id: p for p in products})
+        self.by_slug = MappingProxyType({p.slug: p for p in products})
+        self.by_category = MappingProxyType({k: tuple(v) for k, v in by_category.items()})
+        self.featured = tuple(p for p in products if p.is_featured)
+        self.categories = cats
+        self.categories_by_slug = MappingProxyType({c.slug: c for c in cats})
+        self.nav_items = tuple(NavRecord(n) for n in NavigationItem.query.filter_by(is_active=True)
+                               .order_by(NavigationItem.display_order.asc()))
+        self.settings = MappingProxyType(dict(db.session.query(SiteSettings.key, SiteSettings.value)))
+
+
+_current = {'snapshot': None}
+_build_lock = threading.Lock()
+
+
+def _stale(snap, version, max_age):
+    return snap is None or snap.version != version or time.monotonic() - snap.built_at > max_age
+
+
+def get():
+    """The worker's current snapshot, rebuilt if the catalogue has moved on."""
+    version = catalogue.current_version()
+    max_age = current_app.config.get('SNAPSHOT_MAX_AGE', 300)
+    snap = _current['snapshot']
+    if _stale(snap, version, max_age):
+        with _build_lock:
+            snap = _current['snapshot']
+            if _stale(snap, version, max_age):
+                snap = CatalogueSnapshot(version)
+                _current['snapshot'] = snap
+    return snap
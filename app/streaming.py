@@ -0,0 +1,69 @@
+"""
+Opt-in streaming rendering.
+
+With ``STREAM_TEMPLATES`` on, views that render through ``render()`` send
+the page while it is being rendered (``stream_template``) instead of
+building it in memory first. Jinja produces many small pieces, so they are
+gathered and sent at each ``{{ flush() }}`` in a template, or once
+``STREAM_BUFFER_SIZE`` characters have built up. base.html flushes right
+after ``</head>``, so the browser starts on the stylesheet while the
+rest of the page renders.
+
+Listings that stream (the order lists, see ``archive.paginate(stream=True)``)
+query their rows with ``yield_per`` as the template reaches them, so a
+long admin listing holds one chunk of orders in memory at a time, and the
+count for the page links is only run when the pager is rendered.
+
+The response headers, and the session with them, are sent before the body
+is rendered, so anything a template would otherwise write to the session
+(the CSRF token, flashed messages) is settled first.
+"""
+from flask import current_app, g, get_flashed_messages, render_template, stream_template
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+FLUSH = Markup('\x00flush\x00')
+
+
+def enabled():
+    return bool(current_app.config.get('STREAM_TEMPLATES'))
+
+
+def flush():
+    """Template global: send what has been rendered so far (when streaming)."""
+    return FLUSH if g.get('streaming') else ''
+
+
+def buffered(chunks, size):
+    """Join ``chunks`` into pieces of about ``size`` characters, split at FLUSH."""
+    pending, length = [], 0
+    for chunk in chunks:
+        if FLUSH in chunk:
+            *parts, chunk = chunk.split(FLUSH)
+            pending.extend(parts)
+            yield ''.join(pending)
+            pending, length = [], 0
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(pending)
+            pending, length = [], 0
+    if pending:
+        yield ''.join(pending)
+
+
+def render(template_name, **context):
+    """``render_template``, or a streamed response when STREAM_TEMPLATES is on."""
+    if not enabled():
+        return render_template(template_name, **context)
+    # written to the session now: it is saved before the body is rendered
+    generate_csrf()
+    get_flashed_messages()
+    g.streaming = True
+    chunks = stream_template(template_name, **context)
+    return current_app.response_class(
+        buffered(chunks, current_app.config.get('STREAM_BUFFER_SIZE', 16384)), mimetype='text/html')
+
+
+def init_app(app):
+    app.jinja_env.globals['flush'] = flush
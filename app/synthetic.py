@@ -0,0 +1,314 @@
+"""
+Synthetic data for capacity planning (``python seed.py --synthetic``).
+
+Generates users, products with gallery images, reviews, orders with line
+items, wishlists and carts in volumes given on the command line, using
+bulk Core INSERTs committed every ``batch_size`` rows. Every value is drawn
+from one ``random.Random(seed)``, so the same volumes and seed give the
+same data (dates are relative to when it runs).
+
+- product popularity follows a power law: a few pieces take most of the
+  orders, reviews and wishlists; customers' order counts are skewed too
+- ratings are J-shaped: mostly five and four stars, with a bump at one
+- dates lean towards the recent end of the ``days`` window, and order
+  status follows age (old orders delivered or cancelled, recent ones still
+  moving)
+
+With ``append`` the new rows take ids after the existing ones and also
+draw on existing users, categories and products, so a database can be
+grown in steps. Ids are assigned here (order lines need their order's id
+without a round trip), so on PostgreSQL each table's id sequence is moved
+past them afterwards.
+
+Core inserts bypass the ORM events, so afterwards the catalogue version is
+bumped and the review aggregates of the reviewed products are rebuilt
+explicitly.
+"""
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from slugify import slugify
+from sqlalchemy import update
+
+from app import catalogue, passwords, reviews
+from app.dbutil import upsert_insert, sync_id_sequence
+from app.models import (db, User, Category, Product, ProductImage, Review, Order, OrderItem,
+                        Wishlist, CartItem)
+
+DEFAULT_VOLUMES = {
+    'users': 10000,
+    'products': 5000,
+    'images': 3,          # gallery images per product (average)
+    'reviews': 50000,
+    'orders': 100000,
+    'wishlists': 20000,
+    'carts': 2000,        # shoppers with something in their cart
+}
+
+WISHLIST_ATTEMPTS = 10     # draws per wanted wishlist entry before giving up
+PRODUCT_POPULARITY = 1.1   # Zipf exponent over products
+CUSTOMER_POPULARITY = 0.7  # Zipf exponent over customers
+RATING_WEIGHTS = (0.07, 0.04, 0.09, 0.22, 0.58)  # 1 to 5 stars
+SYNTHETIC_PASSWORD = 'synthetic'
+
+ADJECTIVES = ('Aurora', 'Celeste', 'Vesper', 'Lumen', 'Seraph', 'Halcyon', 'Mira', 'Noor',
+              'Solstice', 'Elara', 'Opaline', 'Rivière', 'Cassia', 'Ember', 'Isla', 'Juno')
+PIECES = ('Ring', 'Band', 'Solitaire', 'Pendant', 'Necklace', 'Chain', 'Bracelet', 'Bangle',
+          'Cuff', 'Studs', 'Hoops', 'Drop Earrings')
+METALS = ('18K Rose Gold', '18K Yellow Gold', '18K White Gold', 'Platinum 950', '22K Yellow Gold')
+GEMSTONES = ('Diamond', 'Pink Diamond', 'Blue Sapphire', 'Emerald', 'Ruby', 'Pearl',
+             'Tanzanite', 'Morganite', None)
+REVIEW_TITLES = {1: 'Disappointed', 2: 'Not quite right', 3: 'Nice but', 4: 'Lovely piece',
+                 5: 'Absolutely stunning'}
+FIRST_NAMES = ('Amelia', 'Olivia', 'Isla', 'Ava', 'Noah', 'Oliver', 'George', 'Leo', 'Priya',
+               'Aisha', 'Mei', 'Sofia', 'Lucas', 'Arjun', 'Hannah', 'Zara')
+LAST_NAMES = ('Smith', 'Jones', 'Patel', 'Khan', 'Williams', 'Brown', 'Taylor', 'Chen',
+              'Davies', 'Evans', 'Wilson', 'Ali', 'Walker', 'Wright', 'Roberts', 'Green')
+CITIES = ('London', 'Manchester', 'Birmingham', 'Leeds', 'Glasgow', 'Bristol', 'Edinburgh')
+DEFAULT_CATEGORIES = ('Rings', 'Necklaces', 'Bracelets', 'Earrings')
+
+
+def _cum_weights(n, exponent):
+    total, out = 0.0, []
+    for rank in range(1, n + 1):
+        total += rank ** -exponent
+        out.append(total)
+    return out
+
+
+class Generator:
+    def __init__(self, seed=42, batch_size=10000, days=730, log=print):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.log = log
+        self.now = datetime.utcnow().replace(microsecond=0)
+
+    # ── helpers ──────────────────────────────────────────────────────────────
+    def _next_id(self, model):
+        return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    def _insert(self, stmt, rows, label):
+        """Insert ``rows`` (an iterable of dicts) in batches; returns how many."""
+        start, count, batch = time.perf_counter(), 0, []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                count += self._flush(stmt, batch)
+                batch = []
+        if batch:
+            count += self._flush(stmt, batch)
+        sync_id_sequence(stmt.table)
+        elapsed = time.perf_counter() - start
+        self.log(f'✓ {count} {label} ({elapsed:.1f}s, {count / max(elapsed, 1e-9):,.0f} rows/s)')
+        return count
+
+    def _flush(self, stmt, batch):
+        db.session.execute(stmt, batch)
+        db.session.commit()
+        return len(batch)
+
+    def _when(self):
+        """A time in the window, weighted towards the recent end."""
+        return self.now - timedelta(seconds=int(self.days * 86400 * self.rng.random() ** 1.5))
+
+    def _popular(self, population, weights, k=1):
+        return self.rng.choices(population, cum_weights=weights, k=k)
+
+    # ── tables ───────────────────────────────────────────────────────────────
+    def categories(self):
+        ids = [cid for cid, in db.session.query(Category.id).filter(Category.is_active.is_(True))]
+        if ids:
+            return ids
+        first = self._next_id(Category)
+        self._insert(Category.__table__.insert(), (
+            {'id': first + n, 'name': name, 'slug': slugify(name), 'display_order': n + 1,
+             'is_active': True, 'created_at': self.now}
+            for n, name in enumerate(DEFAULT_CATEGORIES)), 'categories')
+        return list(range(first, first + len(DEFAULT_CATEGORIES)))
+
+    def users(self, count):
+        first = self._next_id(User)
+        password_hash = passwords.hash_password(SYNTHETIC_PASSWORD)
+        rng = self.rng
+
+        def rows():
+            for uid in range(first, first + count):
+                yield {'id': uid, 'first_name': rng.choice(FIRST_NAMES),
+                       'last_name': rng.choice(LAST_NAMES), 'email': f'user{uid}@synthetic.example',
+                       'password_hash': password_hash, 'is_admin': False, 'is_active': True,
+                       'city': rng.choice(CITIES), 'country': 'United Kingdom',
+                       'created_at': self._when()}
+        self._insert(User.__table__.insert(), rows(), 'users')
+
+    def products(self, count, category_ids):
+        first = self._next_id(Product)
+        rng = self.rng
+
+        def rows():
+            for pid in range(first, first + count):
+                metal, gem = rng.choice(METALS), rng.choice(GEMSTONES)
+                name = f'{rng.choice(ADJECTIVES)} {gem or "Gold"} {rng.choice(PIECES)}'
+                price = round(math.exp(rng.gauss(7.6, 0.6)), -1)
+                on_sale = rng.random() < 0.15
+                yield {'id': pid, 'name': name, 'slug': f'{slugify(name)}-{pid}',
+                       'subtitle': f'{metal} · {gem}' if gem else metal,
+                       'description': f'{name} in {metal}, finished by hand in our London workshop.',
+                       'price': price, 'original_price': round(price * rng.uniform(1.1, 1.3), -1) if on_sale else None,
+                       'stock': 0 if rng.random() < 0.05 else rng.randint(1, 25), 'reserved': 0,
+                       'sku': f'SYN-{pid:07d}', 'category_id': rng.choice(category_ids),
+                       'badge': 'Sale' if on_sale else None, 'badge_color': 'rose' if on_sale else 'black',
+                       'material': metal, 'gemstone': gem, 'is_active': rng.random() > 0.02,
+                       'is_featured': rng.random() < 0.02, 'created_at': self._when()}
+        self._insert(Product.__table__.insert(), rows(), 'products')
+
+    def images(self, per_product, product_ids):
+        folder = current_app.config.get('UPLOAD_FOLDER', '')
+        files = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        if not files or not per_product:
+            return
+        rng = self.rng
+        first = self._next_id(ProductImage)
+
+        def rows():
+            image_id = first
+            for pid in product_ids:
+                for order in range(rng.randint(0, per_product * 2)):
+                    yield {'id': image_id, 'product_id': pid, 'filename': rng.choice(files),
+                           'display_order': order, 'created_at': self.now}
+                    image_id += 1
+        self._insert(ProductImage.__table__.insert(), rows(), 'gallery images')
+
+    def reviews(self, count, user_ids, products, product_weights):
+        first = self._next_id(Review)
+        rng = self.rng
+        touched = set()
+
+        def rows():
+            for rid in range(first, first + count):
+                pid = self._popular(products, product_weights)[0]
+                rating = rng.choices((1, 2, 3, 4, 5), weights=RATING_WEIGHTS)[0]
+                touched.add(pid)
+                yield {'id': rid, 'product_id': pid, 'user_id': rng.choice(user_ids), 'rating': rating,
+                       'title': REVIEW_TITLES[rating], 'body': f'{REVIEW_TITLES[rating]}.',
+                       'is_verified': rng.random() < 0.6, 'is_approved': True,
+                       'helpful_count': int(rng.paretovariate(1.5)) - 1, 'created_at': self._when()}
+        self._insert(Review.__table__.insert(), rows(), 'reviews')
+        return touched
+
+    def orders(self, count, customers, customer_weights, products, product_weights, prices):
+        first_order, item_id = self._next_id(Order), self._next_id(OrderItem)
+        rng = self.rng
+        order_stmt, item_stmt = Order.__table__.insert(), OrderItem.__table__.insert()
+
+        def status(age):
+            if age > timedelta(days=30):
+                return 'cancelled' if rng.random() < 0.06 else 'delivered'
+            if age > timedelta(days=7):
+                return rng.choice(('shipped', 'delivered', 'delivered'))
+            return rng.choice(('pending', 'confirmed', 'confirmed', 'shipped'))
+
+        start, orders, items = time.perf_counter(), [], []
+        placed = lines = 0
+        for oid in range(first_order, first_order + count):
+            picks = set(self._popular(products, product_weights, k=1 + min(int(rng.expovariate(1.2)), 5)))
+            subtotal = 0.0
+            for pid in picks:
+                quantity = 1 if rng.random() < 0.9 else 2
+                line = prices[pid] * quantity
+                subtotal += line
+                items.append({'id': item_id, 'order_id': oid, 'product_id': pid,
+                              'quantity': quantity, 'unit_price': prices[pid], 'subtotal': line})
+                item_id += 1
+            created = self._when()
+            order_status = status(self.now - created)
+            uid = self._popular(customers, customer_weights)[0]
+            orders.append({'id': oid, 'order_number': f'SYN-{oid:010d}', 'user_id': uid, 'status': order_status,
+                           'subtotal': subtotal, 'shipping_cost': 0, 'discount_amount': 0, 'total': subtotal,
+                           'item_count': len(picks),
+                           'discount_code': '', 'shipping_name': f'Customer {uid}',
+                           'shipping_email': f'user{uid}@synthetic.example', 'shipping_address1': '1 High Street',
+                           'shipping_city': rng.choice(CITIES), 'shipping_postcode': 'SW1A 1AA',
+                           'shipping_country': 'United Kingdom', 'payment_method': 'card',
+                           'payment_status': 'pending' if order_status == 'pending' else 'paid',
+                           'created_at': created, 'updated_at': created})
+            if len(orders) >= self.batch_size or oid == first_order + count - 1:
+                # orders first, then their lines, in one transaction
+                db.session.execute(order_stmt, orders)
+                db.session.execute(item_stmt, items)
+                db.session.commit()
+                placed, lines = placed + len(orders), lines + len(items)
+                orders, items = [], []
+        sync_id_sequence(Order.__table__)
+        sync_id_sequence(OrderItem.__table__)
+        elapsed = time.perf_counter() - start
+        self.log(f'✓ {placed} orders with {lines} items ({elapsed:.1f}s, '
+                 f'{(placed + lines) / max(elapsed, 1e-9):,.0f} rows/s)')
+
+    def wishlists(self, count, user_ids, products, product_weights):
+        rng = self.rng
+        count = min(count, len(user_ids) * len(products))
+        seen = set()
+
+        def rows():
+            # popular pairs repeat, so near saturation most draws are duplicates
+            for _ in range(count * WISHLIST_ATTEMPTS):
+                if len(seen) >= count:
+                    break
+                pair = (rng.choice(user_ids), self._popular(products, product_weights)[0])
+                if pair not in seen:
+                    seen.add(pair)
+                    yield {'user_id': pair[0], 'product_id': pair[1], 'added_at': self._when()}
+        self._insert(upsert_insert(Wishlist).on_conflict_do_nothing(), rows(), 'wishlist entries')
+        # workers holding cached wishlist sets reload them
+        db.session.execute(update(User).values(wishlist_version=User.wishlist_version + 1))
+        db.session.commit()
+
+    def carts(self, count, user_ids, products, product_weights):
+        rng = self.rng
+        shoppers = rng.sample(user_ids, min(count, len(user_ids)))
+
+        def rows():
+            for uid in shoppers:
+                for pid in set(self._popular(products, product_weights, k=rng.randint(1, 3))):
+                    yield {'user_id': uid, 'product_id': pid, 'quantity': 1,
+                           'added_at': self.now - timedelta(minutes=rng.randint(1, 10080))}
+        self._insert(upsert_insert(CartItem).on_conflict_do_nothing(), rows(), 'cart items')
+
+    # ── everything ───────────────────────────────────────────────────────────
+    def run(self, volumes):
+        v = {**DEFAULT_VOLUMES, **{k: n for k, n in volumes.items() if n is not None}}
+        start = time.perf_counter()
+        category_ids = self.categories()
+        self.users(v['users'])
+        first_product = self._next_id(Product)
+        self.products(v['products'], category_ids)
+        self.images(v['images'], range(first_product, first_product + v['products']))
+
+        user_ids = [uid for uid, in db.session.query(User.id).filter(User.is_admin.is_(False))]
+        prices = dict(db.session.query(Product.id, Product.price).filter(Product.is_active.is_(True)))
+        if not user_ids or not prices:
+            self.log('No customers or products to build activity from.')
+            return
+        products = sorted(prices)
+        self.rng.shuffle(products)  # popularity rank is independent of id
+        product_weights = _cum_weights(len(products), PRODUCT_POPULARITY)
+        customers = user_ids[:]
+        self.rng.shuffle(customers)
+        customer_weights = _cum_weights(len(customers), CUSTOMER_POPULARITY)
+
+        touched = self.reviews(v['reviews'], user_ids, products, product_weights)
+        self.orders(v['orders'], customers, customer_weights, products, product_weights, prices)
+        self.wishlists(v['wishlists'], user_ids, products, product_weights)
+        self.carts(v['carts'], user_ids, products, product_weights)
+
+        reviews.refresh_stats(db.session.connection(), touched)
+        catalogue.bump(db.session)
+        db.session.commit()
+        catalogue.invalidate()
+        self.log(f'✓ review aggregates rebuilt for {len(touched)} products, catalogue version bumped')
+        self.log(f'Done in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,204 @@
+"""
+Search-as-you-type suggestions.
+
+Each worker keeps a sorted array of normalised keys (every word-suffix of
+product names and subtitles, plus category, material and gemstone names)
+and answers a prefix with ``bisect``. Matches are ranked by popularity
+(units ordered). A prefix whose range holds at most ``SCAN_LIMIT`` keys is
+ranked on the spot; every wider prefix, whatever its length, has its best
+``TOP_LIMIT`` matches stored at build time. The stored lists are built
+bottom-up, each prefix merging its children's lists, so a keystroke never
+looks at more than ``SCAN_LIMIT`` keys or one stored list.
+
+The index is rebuilt when the catalogue version changes or it is older
+than ``TYPEAHEAD_MAX_AGE``. The rebuild runs on a background thread and is
+swapped in when done; requests keep using the old index meanwhile. Only a
+worker that has no index at all (not warmed up) builds one in a request.
+"""
+import bisect
+import heapq
+import os
+import re
+import threading
+import time
+
+from flask import current_app, url_for
+from sqlalchemy import func
+
+from app import catalogue
+from app.models import db, Product, Category, OrderItem
+
+# Prefixes matching more keys than this have their top suggestions precomputed
+SCAN_LIMIT = 64
+TOP_LIMIT = 10
+
+_WORD_RE = re.compile(r'[^\w]+')
+
+
+def normalise(text):
+    return ' '.join(_WORD_RE.sub(' ', (text or '').lower()).split())
+
+
+class Suggestion:
+    __slots__ = ('label', 'kind', 'target', 'score')
+
+    def __init__(self, label, kind, target, score):
+        self.label = label
+        self.kind = kind        # 'product', 'category', 'material', 'gemstone'
+        self.target = target    # product slug / category slug / search text
+        self.score = score
+
+    def to_dict(self):
+        if self.kind == 'product':
+            url = url_for('shop.product_detail', slug=self.target)
+        elif self.kind == 'category':
+            url = url_for('shop.products', category=self.target)
+        else:
+            url = url_for('shop.products', **{self.kind: self.target})
+        return {'label': self.label, 'type': self.kind, 'url': url}
+
+
+class PrefixIndex:
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+
+        popularity = dict(db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity))
+                          .group_by(OrderItem.product_id).all())
+        rows = (db.session.query(Product.id, Product.name, Product.slug, Product.subtitle,
+                                 Product.material, Product.gemstone,
+                                 Category.slug.label('category_slug'),
+                                 Category.name.label('category_name'))
+                .join(Category, Category.id == Product.category_id)
+                .filter(Product.is_active.is_(True), Category.is_active.is_(True)).all())
+
+        suggestions = []
+        keys = []
+        groups = {}
+
+        def add_keys(idx, *texts):
+            seen = set()
+            for text in texts:
+                words = normalise(text).split()
+                for i in range(len(words)):
+                    key = ' '.join(words[i:])
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append((key, idx))
+
+        def group(kind, target, label, score):
+            key = (kind, target)
+            if key not in groups:
+                groups[key] = len(suggestions)
+                suggestions.append(Suggestion(label, kind, target, 0))
+            suggestions[groups[key]].score += score
+
+        for r in rows:
+            # +1 so unsold products still rank above nothing
+            score = (popularity.get(r.id) or 0) + 1
+            idx = len(suggestions)
+            suggestions.append(Suggestion(r.name, 'product', r.slug, score))
+            add_keys(idx, r.name, r.subtitle)
+            group('category', r.category_slug, r.category_name, score)
+            for kind, text in (('material', r.material), ('gemstone', r.gemstone)):
+                label = re.sub(r'\s*\(.*?\)', '', text or '').strip()
+                if label:
+                    group(kind, label.lower(), label, score)
+
+        for idx in groups.values():
+            add_keys(idx, suggestions[idx].label)
+
+        keys.sort()
+        self.suggestions = suggestions
+        self.keys = [k for k, _ in keys]
+        self.targets = [i for _, i in keys]
+
+        self.top = {}
+        self._build_top('', 0, len(self.keys))
+
+    def _build_top(self, prefix, start, end):
+        """
+        Store the best matches of ``prefix`` (keys ``start:end``) if its range
+        is too wide to rank per request, and return them.
+        """
+        if end - start <= SCAN_LIMIT:
+            return self._rank(set(self.targets[start:end]), TOP_LIMIT)
+        depth = len(prefix)
+        i = start
+        # the key equal to the prefix sorts first and has no child
+        while i < end and len(self.keys[i]) == depth:
+            i += 1
+        candidates = set(self.targets[start:i])
+        while i < end:
+            child = prefix + self.keys[i][depth]
+            child_end = bisect.bisect_left(self.keys, child + '\uffff', i, end)
+            candidates.update(self._build_top(child, i, child_end))
+            i = child_end
+        self.top[prefix] = self._rank(candidates, TOP_LIMIT)
+        return self.top[prefix]
+
+    def _range(self, prefix):
+        """The ``keys`` slice bounds of every key starting with ``prefix``."""
+        start = bisect.bisect_left(self.keys, prefix)
+        return start, bisect.bisect_left(self.keys, prefix + '\uffff', start)
+
+    def _rank(self, idxs, limit):
+        return heapq.nlargest(limit, idxs, key=lambda i: (self.suggestions[i].score, -i))
+
+    def lookup(self, query, limit=8):
+        prefix = normalise(query)
+        if not prefix:
+            return []
+        start, end = self._range(prefix)
+        if end - start > SCAN_LIMIT and limit <= TOP_LIMIT:
+            return [self.suggestions[i] for i in self.top[prefix][:limit]]
+        return [self.suggestions[i] for i in self._rank(set(self.targets[start:end]), limit)]
+
+
+_index = {'current': None}
+_build_lock = threading.Lock()
+_rebuild = {'pid': None}
+_rebuild_lock = threading.Lock()
+
+
+def get_index():
+    """The worker's prefix index; a stale one is replaced in the background."""
+    version = catalogue.current_version()
+    index = _index['current']
+    if index is None:
+        with _build_lock:
+            index = _index['current']
+            if index is None:
+                index = _index['current'] = PrefixIndex(version)
+        return index
+    max_age = current_app.config.get('TYPEAHEAD_MAX_AGE', 600)
+    if index.version != version or time.monotonic() - index.built_at > max_age:
+        rebuild_later(current_app._get_current_object(), version)
+    return index
+
+
+def build():
+    """Build the index now, in this thread (warm-up, before workers fork)."""
+    with _build_lock:
+        index = _index['current'] = PrefixIndex(catalogue.current_version())
+    return index
+
+
+def rebuild_later(app, version):
+    """Build a new index on a background thread, unless one is being built."""
+    with _rebuild_lock:
+        # the pid, so a build running in the master at fork time isn't taken for ours
+        if _rebuild['pid'] == os.getpid():
+            return
+        _rebuild['pid'] = os.getpid()
+
+    def build():
+        try:
+            with app.app_context():
+                _index['current'] = PrefixIndex(version)
+        except Exception as e:
+            app.logger.warning('Typeahead index rebuild failed: %s', e)
+        finally:
+            _rebuild['pid'] = None
+
+    threading.Thread(target=build, name='typeahead-build', daemon=True).start()
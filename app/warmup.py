@@ -0,0 +1,119 @@
+"""
+Startup warm-up and timing.
+
+Templates are compiled to Python bytecode once and kept on disk
+(``JINJA_BYTECODE_CACHE_DIR``, default ``instance/jinja-cache``), so a
+restarted process loads them instead of parsing them again. With
+``WARMUP_ON_STARTUP``, ``create_app`` also compiles every template and
+configures the ORM mappers up front, so when the app is preloaded before
+workers fork they share that work copy-on-write instead of each paying for
+it on its first requests.
+
+``warm_caches`` builds the per-process catalogue structures (snapshot,
+settings, navigation, facet and slug indexes, typeahead) so a preloading
+server can fork workers that start with them.
+
+``StartupTimer`` records how long each phase of ``create_app`` took; the
+report is logged and kept in ``app.extensions['startup_timings']``.
+``flask startup bench`` measures cold start to first response in fresh
+processes, with and without the warm-up.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.orm import configure_mappers
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self.last) * 1000, 1)
+        self.last = now
+
+    def report(self):
+        return {**self.phases, 'total': round((self.last - self.started) * 1000, 1)}
+
+
+def bytecode_cache_dir(app):
+    return app.config.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+
+
+def install_bytecode_cache(app):
+    """Keep compiled templates on disk; call before the Jinja env is first used."""
+    directory = bytecode_cache_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(directory)}
+
+
+def compile_templates(app):
+    """Load every template once; returns how many."""
+    env = app.jinja_env
+    names = [n for n in env.list_templates() if n.endswith('.html')]
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def warm(app, timer):
+    configure_mappers()
+    timer.mark('mappers')
+    count = compile_templates(app)
+    timer.mark(f'templates ({count})')
+
+
+def warm_caches(app):
+    """Build the catalogue caches, then drop every database connection."""
+    from app import db, snapshot, facets, slugs, typeahead
+    timer = StartupTimer()
+    with app.app_context():
+        snapshot.get()
+        timer.mark('snapshot')
+        facets.get_index()
+        timer.mark('facets')
+        slugs.get_index()
+        timer.mark('slugs')
+        typeahead.build()
+        timer.mark('typeahead')
+        db.session.remove()
+        # connections must not be shared with forked workers
+        for engine in db.engines.values():
+            engine.dispose()
+    return timer.report()
+
+
+# ── Cold-start measurement ───────────────────────────────────────────────────
+PROBE_PATHS = ('/', '/shop/', '/auth/login')
+
+_PROBE = '''
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+app = create_app()
+t1 = time.perf_counter()
+client = app.test_client()
+out = {'create_app_ms': round((t1 - t0) * 1000, 1), 'first': {}, 'second': {}}
+for path in %r:
+    for run in ('first', 'second'):
+        s = time.perf_counter()
+        client.get(path)
+        out[run][path] = round((time.perf_counter() - s) * 1000, 1)
+out['to_first_response_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+print(json.dumps(out))
+''' % (PROBE_PATHS,)
+
+
+def measure_cold_start(warmup):
+    """Start a fresh interpreter, build the app and time its first requests."""
+    env = {**os.environ, 'WARMUP_ON_STARTUP': '1' if warmup else '0', 'FLASK_RUN_FROM_CLI': ''}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', _PROBE], cwd=root, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
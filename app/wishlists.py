@@ -0,0 +1,103 @@
+"""
+Cached per-user wishlists.
+
+Each worker keeps the product ids on a signed-in user's wishlist as a
+sorted ``array('I')`` (four bytes an id) in an LRU of
+``WISHLIST_CACHE_SIZE`` users. A set is stamped with the user's
+``users.wishlist_version``, which every change bumps in the same
+transaction. The user row is loaded for every request anyway, so checking
+that a cached set is current costs nothing, and a change made through any
+worker is picked up on the user's next request.
+
+A page of products is checked in one call (``members``), so product grids
+show wishlist state without querying.
+
+``toggle`` removes the entry with a conditional delete and, if there was
+nothing to remove, adds it with an insert that ignores the
+``(user_id, product_id)`` unique constraint: no read first, and double
+clicks or concurrent requests can't create duplicates.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, update
+
+from app.dbutil import upsert_insert
+from app.models import db, User, Wishlist
+
+
+class WishlistSet:
+    __slots__ = ('version', 'ids')
+
+    def __init__(self, version, ids):
+        self.version = version
+        self.ids = array('I', sorted(ids))
+
+    def __contains__(self, product_id):
+        i = bisect_left(self.ids, product_id)
+        return i < len(self.ids) and self.ids[i] == product_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def members(self, product_ids):
+        """The subset of ``product_ids`` on the wishlist."""
+        if not self.ids:
+            return frozenset()
+        return frozenset(pid for pid in product_ids if pid in self)
+
+
+EMPTY = WishlistSet(None, ())
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get(user):
+    """The wishlist set of ``user`` (empty for visitors)."""
+    if user is None or not user.is_authenticated:
+        return EMPTY
+    version = user.wishlist_version or 0
+    with _lock:
+        entry = _cache.get(user.id)
+        if entry is not None and entry.version == version:
+            _cache.move_to_end(user.id)
+            return entry
+    # read after the version, so the set is never older than its stamp
+    entry = WishlistSet(version, [pid for pid, in db.session.query(Wishlist.product_id)
+                                  .filter_by(user_id=user.id)])
+    with _lock:
+        _cache[user.id] = entry
+        _cache.move_to_end(user.id)
+        while len(_cache) > current_app.config.get('WISHLIST_CACHE_SIZE', 10000):
+            _cache.popitem(last=False)
+    return entry
+
+
+def bump(user_id):
+    """Mark ``user_id``'s wishlist changed, in the caller's transaction."""
+    db.session.execute(update(User).where(User.id == user_id)
+                       .values(wishlist_version=User.wishlist_version + 1))
+
+
+def toggle(user_id, product_id):
+    """Add or remove ``product_id`` and commit; returns whether it is now on the wishlist."""
+    try:
+        removed = db.session.execute(delete(Wishlist).where(
+            Wishlist.user_id == user_id, Wishlist.product_id == product_id)).rowcount
+        if not removed:
+            db.session.execute(upsert_insert(Wishlist)
+                               .values(user_id=user_id, product_id=product_id, added_at=datetime.utcnow())
+                               .on_conflict_do_nothing(index_elements=['user_id', 'product_id']))
+        bump(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    with _lock:
+        _cache.pop(user_id, None)
+    return not removed
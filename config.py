@@ -4,7 +4,92 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'orial-secret-key-2025-jewellery')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///orial.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Engine tuning profile: 'production' (WAL/pragmas or sized pool) or 'default'
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'production')
+    DB_REPORT_ON_STARTUP = True  # log effective engine settings from create_app
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KB = 64000
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800  # seconds
+    # Read replicas (comma-separated URLs) for views marked @use_replica
+    DATABASE_REPLICA_URLS = [u for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u]
+    DB_STICKY_SECONDS = 5  # reads stay on the primary this long after a write
+    REPLICA_SYNC_INTERVAL = int(os.environ.get('REPLICA_SYNC_INTERVAL', 0))  # local SQLite replicator, 0 = off
+    # Production server (gunicorn.conf.py)
+    SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:8000')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 0))  # 0 = 2 x CPUs + 1
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 4))  # per worker
+    SERVER_TIMEOUT = 30  # seconds a request may run before its worker is restarted
+    SERVER_GRACEFUL_TIMEOUT = 30  # seconds old workers get to finish on reload
+    SERVER_MAX_REQUESTS = 5000  # recycle workers after this many requests (0 = never)
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))  # trusted reverse proxies in front (X-Forwarded-*)
+    # Compile templates and configure mappers in create_app (before workers fork)
+    WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', '1') == '1'
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')  # default: instance/jinja-cache
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'static', 'images')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     FREE_SHIPPING_THRESHOLD = 200.00
     WTF_CSRF_ENABLED = True
+    RECOMMENDATION_TOP_K = 8  # neighbours stored per product
+    RECOMMENDATION_FULL_REBUILD_HOURS = 24  # refresh rebuilds everything once the oldest list is this old (0 = never)
+    CATALOGUE_VERSION_TTL = 2  # seconds a worker trusts its cached catalogue version
+    SHOP_PRICE_BANDS = (1000, 2500, 5000)  # facet boundaries (Rs)
+    TYPEAHEAD_MAX_AGE = 600  # seconds before suggestion popularity is refreshed
+    SNAPSHOT_MAX_AGE = 300  # seconds before the catalogue snapshot refreshes review aggregates
+    PRODUCT_PAGE_CACHE_SIZE = 1000  # product page bundles kept per worker
+    PRODUCT_PAGE_MAX_AGE = 600  # seconds before a bundle picks up new recommendations
+    PRODUCT_PAGE_REVIEWS = 6  # reviews shipped with the first render of a product page
+    WISHLIST_CACHE_SIZE = 10000  # signed-in users' wishlist sets kept per worker
+    STOCK_HOLD_SECONDS = 600  # how long opening checkout holds the cart's units
+    STOCK_HOLD_SWEEP_INTERVAL = 30  # seconds between sweeps of expired holds (0 = off)
+    CHECKOUT_KEY_TTL = 86400  # seconds a checkout submission key is remembered
+    CHECKOUT_KEY_COMPACT_INTERVAL = 3600  # seconds between deletions of expired keys (0 = off)
+    DISCOUNT_USAGE_SHARDS = 8  # counter rows a code's max_uses is split over
+    ORDER_ARCHIVE_AFTER_DAYS = 180  # delivered/cancelled orders older than this move to the archive
+    ORDER_ARCHIVE_BATCH = 500  # orders moved per transaction
+    API_PAGE_SIZE = 24  # JSON API records per page unless ?limit= says otherwise
+    API_MAX_PAGE_SIZE = 100
+    API_BATCH_MAX = 100  # ids per batch GET, changes per cart batch
+    # Streaming rendering of the shop listing and order lists (see app/streaming.py)
+    STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', '0') == '1'
+    STREAM_BUFFER_SIZE = 16384  # characters gathered before a chunk is sent
+    STREAM_CHUNK_SIZE = 100  # orders loaded at a time by a streamed listing
+    ADMIN_ORDERS_PER_PAGE = 20
+    ADMIN_ORDERS_MAX_PER_PAGE = 1000  # when streaming; 100 otherwise
+    # Outbox: side effects of checkout run on a background worker
+    OUTBOX_POLL_INTERVAL = 2  # seconds between polls when not woken (0 = no worker thread)
+    OUTBOX_MAX_ATTEMPTS = 8  # then the event is marked failed
+    OUTBOX_RETRY_BASE = 5  # seconds; doubles with each attempt
+    OUTBOX_CLAIM_TIMEOUT = 300  # seconds before a claimed event is retried by another worker
+    OUTBOX_RETENTION_DAYS = 7  # processed events kept this long
+    OUTBOX_MAIL_DIR = os.environ.get('OUTBOX_MAIL_DIR')  # rendered emails; default: instance/mail
+    # Session storage: 'sqlite', 'redis' or 'cookie' (Flask's signed cookie)
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH')  # default: instance/sessions.db
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'local://sessions')
+    SESSION_SWEEP_INTERVAL = 300  # seconds between expired-session sweeps
+    # Password hashing: bcrypt cost is calibrated to the target once, unless pinned
+    PASSWORD_HASH_ROUNDS = int(os.environ['PASSWORD_HASH_ROUNDS']) if os.environ.get('PASSWORD_HASH_ROUNDS') else None
+    PASSWORD_HASH_ROUNDS_FILE = os.environ.get('PASSWORD_HASH_ROUNDS_FILE')  # calibrated cost; default: instance/password-rounds
+    PASSWORD_HASH_TARGET_MS = 250
+    PASSWORD_HASH_MIN_ROUNDS = 12  # calibration only raises the cost above this (and BCRYPT_LOG_ROUNDS)
+    PASSWORD_HASH_WORKERS = 2  # concurrent hashes per worker process
+    # Request rate limits: counters kept in 'memory', 'sqlite' or 'redis'
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')
+    RATE_LIMIT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH')  # default: instance/ratelimit.db
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'local://ratelimit')
+    RATE_LIMIT_METHODS = ('POST',)  # only these requests are counted
+    RATE_LIMITS = {  # endpoint: ((key, requests, per seconds), ...); key is 'ip', 'user' or 'email'
+        'main.newsletter': (('ip', 5, 3600),),
+        'auth.login': (('ip', 30, 300), ('email', 10, 300)),
+        'auth.register': (('ip', 10, 3600), ('email', 10, 300)),
+        'account.change_password': (('user', 10, 300),),
+        'cart.add_to_cart': (('user', 60, 60),),
+        'shop.add_review': (('user', 10, 3600),),
+        'shop.toggle_wishlist': (('user', 60, 60),),
+        'api.cart_batch': (('user', 60, 60),),
+    }
@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for production.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master (``preload_app``), which then
+builds the catalogue snapshot, settings, navigation and search indexes and
+freezes the heap before forking, so every worker starts warm and shares
+that memory copy-on-write. Worker and thread counts come from ``Config``
+(``SERVER_WORKERS``, ``SERVER_THREADS``).
+
+``kill -HUP <master>`` is a rolling reload: the master rebuilds its caches
+from the current database, starts a full set of new workers, and only then
+asks the old ones to finish their requests and exit (within
+``SERVER_GRACEFUL_TIMEOUT``), so capacity never drops. Preloaded code is
+not re-imported on HUP; to deploy new code, send ``USR2`` to start a new
+master alongside the old one, then ``QUIT`` the old master.
+
+Behind nginx or a load balancer, set ``PROXY_FIX_HOPS`` (the number of
+proxies in front) so the app sees each client's address rather than the
+proxy's; rate limits are counted per client address.
+"""
+import gc
+import multiprocessing
+
+from config import Config
+
+wsgi_app = 'wsgi:app'
+bind = Config.SERVER_BIND
+workers = Config.SERVER_WORKERS or multiprocessing.cpu_count() * 2 + 1
+threads = Config.SERVER_THREADS
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = max_requests // 10
+preload_app = True
+
+
+def _warm(server):
+    from app.warmup import warm_caches
+    timings = warm_caches(server.app.wsgi())
+    server.log.info('Warmed caches in the master (ms): %s', timings)
+    # keep the warmed objects out of the collector so workers don't touch
+    # (and copy) their pages
+    gc.freeze()
+
+
+def when_ready(server):
+    _warm(server)
+
+
+def on_reload(server):
+    # new workers are forked after this returns; old ones exit afterwards
+    gc.unfreeze()
+    _warm(server)
+
+
+def post_fork(server, worker):
+    from app import db
+    with server.app.wsgi().app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,41 @@
+"""related products
+
+Precomputed neighbour lists for the product page's related items.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 10:53:44.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_recommendations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('related_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['related_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('product_recommendations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_recommendations_product_id'), ['product_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_recommendations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_recommendations_product_id'))
+
+    op.drop_table('product_recommendations')
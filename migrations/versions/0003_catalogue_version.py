@@ -0,0 +1,32 @@
+"""catalogue version
+
+The single-row version stamp the per-worker catalogue caches (facet
+bitmaps first) compare their build against.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 10:53:45.137911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalogue_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('catalogue_version')
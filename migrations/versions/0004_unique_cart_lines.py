@@ -0,0 +1,37 @@
+"""unique cart lines
+
+One cart line per user and product, so merging a guest cart on login can
+upsert. Existing duplicate lines are merged into the oldest one first.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 10:53:46.275822
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        UPDATE cart_items SET quantity = (
+            SELECT SUM(c.quantity) FROM cart_items c
+            WHERE c.user_id = cart_items.user_id AND c.product_id = cart_items.product_id)
+        WHERE id IN (SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id HAVING COUNT(*) > 1)
+    """)
+    op.execute('DELETE FROM cart_items WHERE id NOT IN '
+               '(SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id)')
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_cart_items_user_product', ['user_id', 'product_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cart_items_user_product', type_='unique')
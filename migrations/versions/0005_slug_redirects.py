@@ -0,0 +1,35 @@
+"""slug redirects
+
+Old product slugs, so a renamed product's former URL redirects to the
+new one.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 10:53:47.413733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_slug_redirects',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('old_slug', sa.String(length=220), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('old_slug')
+    )
+
+
+def downgrade():
+    op.drop_table('product_slug_redirects')
@@ -0,0 +1,57 @@
+"""review stats
+
+Per-product review counts and star histogram, kept current on every
+review change. Existing products are filled in from their approved
+reviews (what ``flask reviews rebuild-stats`` does).
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 10:53:48.551644
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_review_stats',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('review_count', sa.Integer(), nullable=False),
+    sa.Column('rating_total', sa.Integer(), nullable=False),
+    sa.Column('stars_1', sa.Integer(), nullable=False),
+    sa.Column('stars_2', sa.Integer(), nullable=False),
+    sa.Column('stars_3', sa.Integer(), nullable=False),
+    sa.Column('stars_4', sa.Integer(), nullable=False),
+    sa.Column('stars_5', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    op.execute(sa.text("""
+        INSERT INTO product_review_stats (product_id, review_count, rating_total,
+                                          stars_1, stars_2, stars_3, stars_4, stars_5,
+                                          version, updated_at)
+        SELECT p.id, COUNT(r.id), COALESCE(SUM(r.rating), 0),
+               COUNT(CASE WHEN r.rating = 1 THEN 1 END),
+               COUNT(CASE WHEN r.rating = 2 THEN 1 END),
+               COUNT(CASE WHEN r.rating = 3 THEN 1 END),
+               COUNT(CASE WHEN r.rating = 4 THEN 1 END),
+               COUNT(CASE WHEN r.rating = 5 THEN 1 END),
+               1, CURRENT_TIMESTAMP
+        FROM products p
+        LEFT JOIN reviews r ON r.product_id = p.id AND r.is_approved = :approved
+                           AND r.rating BETWEEN 1 AND 5
+        GROUP BY p.id
+    """).bindparams(approved=True))
+
+
+def downgrade():
+    op.drop_table('product_review_stats')
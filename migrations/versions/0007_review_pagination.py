@@ -0,0 +1,45 @@
+"""review pagination
+
+Helpful votes and the indexes behind keyset pagination of a product's
+reviews, newest first or most helpful first.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 10:53:49.689555
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('review_helpful_votes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('review_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['review_id'], ['reviews.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('review_id', 'user_id', name='uq_review_helpful_votes')
+    )
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('helpful_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index('ix_reviews_product_helpful', ['product_id', 'helpful_count', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_reviews_product_newest', ['product_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_index('ix_reviews_product_newest')
+        batch_op.drop_index('ix_reviews_product_helpful')
+        batch_op.drop_column('helpful_count')
+
+    op.drop_table('review_helpful_votes')
@@ -0,0 +1,51 @@
+"""stock holds
+
+Timed holds on stock while a shopper checks out, and the held total kept
+on each product.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 10:53:50.827466
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_holds',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'product_id', name='uq_stock_holds_user_product')
+    )
+    with op.batch_alter_table('stock_holds', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stock_holds_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_holds_product_id'), ['product_id'], unique=False)
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reserved', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('reserved')
+
+    with op.batch_alter_table('stock_holds', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_holds_product_id'))
+        batch_op.drop_index(batch_op.f('ix_stock_holds_expires_at'))
+
+    op.drop_table('stock_holds')
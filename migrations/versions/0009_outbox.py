@@ -0,0 +1,65 @@
+"""outbox
+
+The transactional outbox for checkout side effects, and the daily sales
+rollup its handler maintains. The rollup is filled from the orders
+already placed.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 10:53:51.965377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=80), nullable=False),
+    sa.Column('idempotency_key', sa.String(length=200), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key')
+    )
+    with op.batch_alter_table('outbox_events', schema=None) as batch_op:
+        batch_op.create_index('ix_outbox_events_due', ['status', 'available_at'], unique=False)
+
+    op.create_table('sales_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.execute("""
+        INSERT INTO sales_daily (day, order_count, units, revenue)
+        SELECT date(o.created_at), COUNT(*), SUM(COALESCE(i.units, 0)), SUM(o.total)
+        FROM orders o
+        LEFT JOIN (SELECT order_id, SUM(quantity) AS units FROM order_items GROUP BY order_id) i
+            ON i.order_id = o.id
+        WHERE o.created_at IS NOT NULL
+        GROUP BY date(o.created_at)
+    """)
+
+
+def downgrade():
+    op.drop_table('sales_daily')
+    with op.batch_alter_table('outbox_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_outbox_events_due')
+
+    op.drop_table('outbox_events')
@@ -0,0 +1,38 @@
+"""checkout keys
+
+Idempotency keys for checkout submissions.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 10:53:52.103288
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('checkout_keys',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('order_number', sa.String(length=20), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('checkout_keys', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_checkout_keys_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('checkout_keys', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_checkout_keys_created_at'))
+
+    op.drop_table('checkout_keys')
@@ -0,0 +1,87 @@
+"""discount engine
+
+Discount scopes, tiers and per-user limits, with usage counted in
+sharded rows instead of ``discounts.used_count``. Each code's existing
+count is carried over into its shards.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 10:53:53.241199
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('discount_usage',
+    sa.Column('discount_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('used', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['discount_id'], ['discounts.id'], ),
+    sa.PrimaryKeyConstraint('discount_id', 'shard')
+    )
+    op.create_table('discount_user_usage',
+    sa.Column('discount_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('used', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['discount_id'], ['discounts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('discount_id', 'user_id')
+    )
+    carry_over_discount_usage()
+    with op.batch_alter_table('discounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('per_user_limit', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('scope', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('scope_ids', sa.String(length=500), nullable=True))
+        batch_op.add_column(sa.Column('tiers', sa.Text(), nullable=True))
+        batch_op.drop_column('used_count')
+    op.execute("UPDATE discounts SET scope = 'order' WHERE scope IS NULL")
+
+
+def carry_over_discount_usage():
+    """
+    Move ``discounts.used_count`` into the ``discount_usage`` shards, filling
+    each shard up to its share of ``max_uses`` in turn (see app/discounts.py)
+    so a code has exactly what was left of its allowance. Anything over the
+    allowance, and the count of an unlimited code, goes on shard 0.
+    """
+    shards = current_app.config.get('DISCOUNT_USAGE_SHARDS', 8)
+    rows = []
+    for discount_id, used, max_uses in op.get_bind().execute(sa.text(
+            'SELECT id, used_count, max_uses FROM discounts WHERE used_count > 0')):
+        counts = [0] * shards
+        if max_uses:
+            base, extra = divmod(max_uses, shards)
+            for n in range(shards):
+                counts[n] = min(used, base + (1 if n < extra else 0))
+                used -= counts[n]
+        counts[0] += used
+        rows.extend({'discount_id': discount_id, 'shard': n, 'used': c}
+                    for n, c in enumerate(counts) if c)
+    if rows:
+        usage = sa.table('discount_usage', sa.column('discount_id', sa.Integer),
+                         sa.column('shard', sa.Integer), sa.column('used', sa.Integer))
+        op.bulk_insert(usage, rows)
+
+
+def downgrade():
+    with op.batch_alter_table('discounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('used_count', sa.Integer(), nullable=True))
+        batch_op.drop_column('tiers')
+        batch_op.drop_column('scope_ids')
+        batch_op.drop_column('scope')
+        batch_op.drop_column('per_user_limit')
+    op.execute('UPDATE discounts SET used_count = (SELECT COALESCE(SUM(used), 0) '
+               'FROM discount_usage WHERE discount_usage.discount_id = discounts.id)')
+
+    op.drop_table('discount_user_usage')
+    op.drop_table('discount_usage')
@@ -0,0 +1,90 @@
+"""order archive
+
+Archive tables for finished orders and the running totals of what has
+been archived. On SQLite ``orders`` and ``order_items`` are rebuilt with
+AUTOINCREMENT so ids are never reused once orders move to the archive.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 10:53:54.379110
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('order_archive_totals',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('paid_revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('orders_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_number', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=30), nullable=True),
+    sa.Column('subtotal', sa.Float(), nullable=False),
+    sa.Column('shipping_cost', sa.Float(), nullable=True),
+    sa.Column('discount_amount', sa.Float(), nullable=True),
+    sa.Column('total', sa.Float(), nullable=False),
+    sa.Column('discount_code', sa.String(length=50), nullable=True),
+    sa.Column('shipping_name', sa.String(length=160), nullable=True),
+    sa.Column('shipping_email', sa.String(length=120), nullable=True),
+    sa.Column('shipping_phone', sa.String(length=30), nullable=True),
+    sa.Column('shipping_address1', sa.String(length=200), nullable=True),
+    sa.Column('shipping_address2', sa.String(length=200), nullable=True),
+    sa.Column('shipping_city', sa.String(length=100), nullable=True),
+    sa.Column('shipping_postcode', sa.String(length=20), nullable=True),
+    sa.Column('shipping_country', sa.String(length=100), nullable=True),
+    sa.Column('payment_method', sa.String(length=50), nullable=True),
+    sa.Column('payment_status', sa.String(length=30), nullable=True),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('order_number')
+    )
+    with op.batch_alter_table('orders_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_archive_user_created', ['user_id', 'created_at'], unique=False)
+
+    op.create_table('order_items_archive',
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('unit_price', sa.Float(), nullable=False),
+    sa.Column('subtotal', sa.Float(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['orders_archive.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('order_items_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_items_archive_order_id'), ['order_id'], unique=False)
+
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('orders', 'order_items'):
+            with op.batch_alter_table(table, recreate='always',
+                                      table_kwargs={'sqlite_autoincrement': True}):
+                pass
+
+
+def downgrade():
+    with op.batch_alter_table('order_items_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_items_archive_order_id'))
+
+    op.drop_table('order_items_archive')
+    with op.batch_alter_table('orders_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_archive_user_created')
+
+    op.drop_table('orders_archive')
+    op.drop_table('order_archive_totals')
@@ -0,0 +1,37 @@
+"""wishlist sets
+
+A per-user wishlist version for the cached id sets, and one wishlist row
+per user and product (duplicates are dropped first).
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19 10:53:55.517021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0013'
+down_revision = '0012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('wishlist_version', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute('DELETE FROM wishlist WHERE id NOT IN '
+               '(SELECT MIN(id) FROM wishlist GROUP BY user_id, product_id)')
+    with op.batch_alter_table('wishlist', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_wishlist_user_product', ['user_id', 'product_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('wishlist', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_wishlist_user_product', type_='unique')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('wishlist_version')
@@ -0,0 +1,38 @@
+"""order item counts
+
+``item_count`` on live and archived orders, counted from their order
+lines, and the (user_id, created_at) index behind the account dashboard's
+recent orders.
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-19 10:53:56.654932
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0014'
+down_revision = '0013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for orders, items in (('orders', 'order_items'), ('orders_archive', 'order_items_archive')):
+        with op.batch_alter_table(orders, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+        op.execute(f'UPDATE {orders} SET item_count = '
+                   f'(SELECT COUNT(*) FROM {items} WHERE {items}.order_id = {orders}.id)')
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_user_created', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_user_created')
+    for orders in ('orders_archive', 'orders'):
+        with op.batch_alter_table(orders, schema=None) as batch_op:
+            batch_op.drop_column('item_count')
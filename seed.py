@@ -4,12 +4,23 @@ Seed script to populate the database with initial data:
 - Categories (Rings, Necklaces, Bracelets, Earrings)
 - Sample products with ORIAL design
 - Sample discount code
+
+``--synthetic`` adds generated volumes on top (see app/synthetic.py), e.g.
+``python seed.py --synthetic --products 200000 --orders 2000000``;
+``--append`` grows the existing database instead of recreating it.
+
+The tables are created as of the latest migration and stamped with it;
+to bring an existing database up to date without losing its data, run
+``flask db upgrade`` instead.
 """
 
+import argparse
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from flask_migrate import stamp
+
 from app import create_app
 from app.models import db, User, Category, Product, Discount, SiteSettings, ProductImage, NavigationItem
 
@@ -19,6 +30,7 @@ def seed():
     with app.app_context():
         db.drop_all()
         db.create_all()
+        stamp()
         print("✓ Database tables created")
 
         # Admin user
@@ -248,5 +260,34 @@ def seed():
         print("   Discount:    WELCOME10 (10% off orders over Rs100)")
 
 
+def seed_synthetic(volumes, append=False, seed_value=42, batch_size=10000, days=730):
+    from app.synthetic import Generator
+    if not append:
+        seed()
+    with app.app_context():
+        Generator(seed=seed_value, batch_size=batch_size, days=days).run(volumes)
+
+
+def parse_args(argv=None):
+    from app.synthetic import DEFAULT_VOLUMES
+    parser = argparse.ArgumentParser(description='Populate the ORIAL database.')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='add generated users, products, reviews, orders, wishlists and carts')
+    parser.add_argument('--append', action='store_true',
+                        help='add synthetic data to the existing database instead of recreating it')
+    for name, default in DEFAULT_VOLUMES.items():
+        parser.add_argument(f'--{name}', type=int, default=None, help=f'(default {default})')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (same seed, same data)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per INSERT batch and commit')
+    parser.add_argument('--days', type=int, default=730, help='history window for generated dates')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    seed()
+    args = parse_args()
+    if args.synthetic or args.append:
+        from app.synthetic import DEFAULT_VOLUMES
+        seed_synthetic({name: getattr(args, name) for name in DEFAULT_VOLUMES}, append=args.append,
+                       seed_value=args.seed, batch_size=args.batch_size, days=args.days)
+    else:
+        seed()
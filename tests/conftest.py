@@ -0,0 +1,88 @@
+"""
+Shared test setup: a throwaway SQLite primary with one SQLite read
+replica, a session store for the run, in-memory rate limits and a cheap
+bcrypt cost. ``Config`` reads the environment when it is imported, so this
+is set before the app is.
+"""
+import os
+import shutil
+import tempfile
+from itertools import count
+
+import pytest
+from flask import Blueprint, session
+
+_tmp = tempfile.mkdtemp(prefix='orial-tests-')
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_tmp, 'primary.db'),
+    'DATABASE_REPLICA_URLS': 'sqlite:///' + os.path.join(_tmp, 'replica.db'),
+    'SESSION_BACKEND': 'sqlite',
+    'SESSION_SQLITE_PATH': os.path.join(_tmp, 'sessions.db'),
+    'RATE_LIMIT_BACKEND': 'memory',
+    'PASSWORD_HASH_ROUNDS': '4',
+    'WARMUP_ON_STARTUP': '0',
+})
+
+from app import create_app, db  # noqa: E402
+from app.models import SiteSettings, User  # noqa: E402
+from app.routing import sync_replicas, use_replica  # noqa: E402
+
+PASSWORD = 'correct horse'
+
+# routes the tests drive directly, registered before the first request
+probe = Blueprint('probe', __name__)
+
+
+@probe.route('/remember/<value>')
+def remember(value):
+    session['value'] = value
+    return 'ok'
+
+
+@probe.route('/recall')
+def recall():
+    return session.get('value', '')
+
+
+@probe.route('/settings/<key>/<value>', methods=['POST'])
+def write_setting(key, value):
+    db.session.add(SiteSettings(key=key, value=value))
+    db.session.commit()
+    return 'ok'
+
+
+@probe.route('/settings/<key>')
+@use_replica
+def read_setting(key):
+    return db.session.query(SiteSettings.value).filter_by(key=key).scalar() or ''
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    app.register_blueprint(probe, url_prefix='/probe')
+    with app.app_context():
+        db.create_all()
+        sync_replicas(db)
+    yield app
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+_emails = count(1)
+
+
+@pytest.fixture
+def user(app):
+    """A customer who can sign in with ``PASSWORD``."""
+    with app.app_context():
+        user = User(first_name='Test', email=f'user{next(_emails)}@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        return user.email
@@ -0,0 +1,47 @@
+"""
+Read-replica routing: ``@use_replica`` reads go to the replica, except for
+a visitor who wrote within the last ``DB_STICKY_SECONDS``. The replica is
+only brought up to date by ``sync_replicas``, so what a read returns shows
+which database served it.
+"""
+import time
+
+from app import db
+from app.models import SiteSettings
+from app.routing import sync_replicas
+
+
+def write_behind_replica(app, key, value):
+    """A row on the primary that the replica hasn't seen, written outside a request."""
+    with app.app_context():
+        db.session.add(SiteSettings(key=key, value=value))
+        db.session.commit()
+
+
+def test_reads_go_to_the_replica(app, client):
+    write_behind_replica(app, 'replica-read', 'primary')
+    assert client.get('/probe/settings/replica-read').text == ''
+
+
+def test_read_after_write_goes_to_the_primary(app, client):
+    client.post('/probe/settings/sticky-read/written')
+    assert client.get('/probe/settings/sticky-read').text == 'written'
+
+
+def test_other_visitors_still_read_the_replica(app, client):
+    client.post('/probe/settings/other-visitor/written')
+    assert app.test_client().get('/probe/settings/other-visitor').text == ''
+
+
+def test_reads_return_to_the_replica_after_the_window(app, client, monkeypatch):
+    client.post('/probe/settings/window-ends/written')
+    later = time.time() + app.config['DB_STICKY_SECONDS'] + 1
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert client.get('/probe/settings/window-ends').text == ''
+
+
+def test_sync_brings_the_replica_up_to_date(app, client):
+    write_behind_replica(app, 'synced', 'primary')
+    with app.app_context():
+        assert sync_replicas(db) == ['replica_0']
+    assert client.get('/probe/settings/synced').text == 'primary'
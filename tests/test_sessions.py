@@ -0,0 +1,108 @@
+"""
+Server-side sessions: ids are only ever issued by the server. Every test
+runs against the SQLite store and the in-process Redis stand-in.
+"""
+import time
+
+import pytest
+
+from app import localredis, sessions
+from tests.conftest import PASSWORD
+
+COOKIE = 'session'
+
+
+@pytest.fixture(autouse=True, params=['sqlite', 'redis'])
+def backend(request, app, monkeypatch):
+    if request.param == 'redis':
+        store = sessions.RedisSessionBackend(localredis.from_url('local://test-sessions'))
+        monkeypatch.setattr(app, 'session_interface',
+                            sessions.ServerSessionInterface(store, sweep_interval=0))
+    return app.session_interface.backend
+
+
+def sid(client):
+    cookie = client.get_cookie(COOKIE)
+    return cookie.value if cookie else None
+
+
+def stored(app, session_id):
+    return app.session_interface.backend.load(session_id)
+
+
+def login(client, email):
+    return client.post('/auth/login', data={'email': email, 'password': PASSWORD})
+
+
+def test_first_write_issues_an_id(app, client):
+    client.get('/probe/remember/a')
+    assert sid(client) is not None
+    assert stored(app, sid(client)) is not None
+
+
+def test_known_id_is_kept_and_not_resent(app, client):
+    client.get('/probe/remember/a')
+    first = sid(client)
+    response = client.get('/probe/remember/b')
+    assert 'Set-Cookie' not in response.headers
+    assert sid(client) == first
+    assert client.get('/probe/recall').text == 'b'
+
+
+def test_unknown_id_is_replaced(app, client):
+    planted = 'A' * 43
+    client.set_cookie(COOKIE, planted)
+    client.get('/probe/remember/a')
+    assert sid(client) != planted
+    assert stored(app, planted) is None
+    assert stored(app, sid(client)) is not None
+
+
+def test_malformed_id_is_replaced(app, client):
+    client.set_cookie(COOKIE, 'not-an-id')
+    client.get('/probe/remember/a')
+    assert sid(client) != 'not-an-id'
+    assert stored(app, sid(client)) is not None
+
+
+def test_reading_an_unknown_id_sends_no_cookie(app, client):
+    client.set_cookie(COOKIE, 'A' * 43)
+    response = client.get('/probe/recall')
+    assert response.text == ''
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_login_moves_the_session_to_a_new_id(app, client, user):
+    client.get('/probe/remember/before-login')
+    guest = sid(client)
+    response = login(client, user)
+    assert response.status_code == 302
+    assert sid(client) != guest
+    assert stored(app, guest) is None
+    # the guest's data comes along
+    assert client.get('/probe/recall').text == 'before-login'
+
+
+def test_login_with_a_planted_id_gets_a_new_one(app, client, user):
+    planted = 'B' * 43
+    client.set_cookie(COOKIE, planted)
+    login(client, user)
+    assert sid(client) not in (None, planted)
+    assert stored(app, planted) is None
+
+
+def test_logout_moves_the_session_to_a_new_id(app, client, user):
+    login(client, user)
+    signed_in = sid(client)
+    response = client.get('/auth/logout')
+    assert response.status_code == 302
+    assert sid(client) != signed_in
+    assert stored(app, signed_in) is None
+
+
+def test_expired_session_is_not_loaded(backend, monkeypatch):
+    backend.save('expiring', '{"a": 1}', 60)
+    assert backend.load('expiring') == '{"a": 1}'
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert backend.load('expiring') is None
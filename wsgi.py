@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py
+
+``run.py`` starts the development server instead.
+"""
+from app import create_app
+
+app = create_app()